@@ -0,0 +1,746 @@
+from app import app
+import pandas as pd
+import numpy as np
+from scipy import sparse
+import os, re, time, json, hashlib, shutil, pickle, functools, tempfile, threading
+from collections import OrderedDict
+
+
+# Per-session columnar dataset store. Every uploaded (and later validated) dataset is written to disk under
+# DATASET_STORE_DIR/datasets/<session id>/<dataset fingerprint>/ so concurrent users never overwrite each other's data.
+# Each column is saved as a separate .npy file described by manifest.json:
+#   - 'array' columns (numeric, boolean, datetime) are memory-mapped as is
+#   - 'dictionary' columns (text and categoricals) are stored as integer codes (-1 for missing) and a JSON list of
+#     distinct values
+#   - 'pickle' columns (mixed object types, pandas extension types) are pickled as a fallback
+# Memory-mapped columns are read lazily and shared between worker processes through the OS page cache,
+# so a request only pays for the columns it actually reads
+
+
+def _sessionStoreDir(session_id):
+    if not re.fullmatch(r'[A-Za-z0-9]+', str(session_id)):
+        raise ValueError("Invalid session id {}".format(session_id))
+    return os.path.join(app.config.get('DATASET_STORE_DIR', 'cache-dir'), 'datasets', session_id)
+
+
+def _datasetDir(session_id, fingerprint):
+    if not re.fullmatch(r'[a-f0-9]+', str(fingerprint)):
+        raise ValueError("Invalid dataset fingerprint {}".format(fingerprint))
+    return os.path.join(_sessionStoreDir(session_id), fingerprint)
+
+
+def _codesDtype(n_categories):
+    # same integer width pandas uses for categorical codes so stored codes are wrapped without a copy
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _positionsDtype(n):
+    # smallest integer type holding row positions of a n rows dataset
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+
+def datasetFingerprint(*parts):
+    """Calculate a short fingerprint identifying a dataset version from the supplied parts
+    (e.g. uploaded file content digest, validation screen mappings, delimiter symbol)
+
+    Arguments:
+        parts (strings or bytes): values identifying the dataset content
+    Returns:
+        fingerprint (string): 16 character hexadecimal digest
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        sha.update(b'\x00')
+    return sha.hexdigest()[:16]
+
+
+def fileFingerprint(file, blocksize=1024*1024):
+    """Calculate the fingerprint of the uploaded file content reading it in blocks and rewinding the file afterwards
+
+    Arguments:
+        file (FileStorage): uploaded file object supporting read() and seek()
+    Returns:
+        fingerprint (string): 16 character hexadecimal digest of the file content
+    """
+    sha = hashlib.sha1()
+    for block in iter(lambda: file.read(blocksize), b''):
+        sha.update(block)
+    file.seek(0)
+    return datasetFingerprint(sha.digest())
+
+
+def writeDatasetColumn(dataset_dir, idx, name, values):
+    """Write a single dataset column into a dataset directory being created and return its manifest entry
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        idx (int): column position used to name the column files
+        name: column name
+        values (pandas series): column values
+    Returns:
+        entry (dict): manifest entry describing the stored column
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype) and \
+            pd.api.types.infer_dtype(values.cat.categories) in ('string', 'empty', 'integer', 'floating'):
+        return writeDictionaryColumn(dataset_dir, idx, name, values.cat.codes.to_numpy(),
+                                     values.cat.categories.to_list(), categorical=True)
+    elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        codes, uniques = pd.factorize(values)
+        return writeDictionaryColumn(dataset_dir, idx, name, codes, uniques.to_list())
+
+    entry = {'name': name}
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biufcmM':
+        entry['kind'] = 'array'
+        entry['file'] = 'c{}.npy'.format(idx)
+        np.save(os.path.join(dataset_dir, entry['file']), values.to_numpy())
+        if values.dtype.kind == 'M':
+            # sorted index of datetime columns used by date range filters: positions of non-missing values in date order
+            # and the sorted values so a date range resolves by binary search to the slice order[lo:hi]
+            entry['index'] = {'order': 'c{}.order.npy'.format(idx), 'values': 'c{}.sorted.npy'.format(idx)}
+            dates = values.to_numpy()
+            order = np.flatnonzero(~np.isnat(dates))
+            order = order[np.argsort(dates[order], kind='stable')].astype(_positionsDtype(len(dates)))
+            np.save(os.path.join(dataset_dir, entry['index']['order']), order)
+            np.save(os.path.join(dataset_dir, entry['index']['values']), dates[order])
+    else:
+        entry['kind'] = 'pickle'
+        entry['file'] = 'c{}.pkl'.format(idx)
+        with open(os.path.join(dataset_dir, entry['file']), 'wb') as fp:
+            pickle.dump(values.array, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    return entry
+
+
+def writeDictionaryColumn(dataset_dir, idx, name, codes, dictionary, categorical=False):
+    """Write an already dictionary encoded text column into a dataset directory being created and return its manifest entry
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        idx (int): column position used to name the column files
+        name: column name
+        codes (numpy array): integer positions of values in the dictionary (-1 for missing values)
+        dictionary (list): distinct column values (strings or numbers for categorical columns)
+        categorical (bool, optional): load the column as pandas categorical instead of text. Defaults to False
+    Returns:
+        entry (dict): manifest entry describing the stored column
+    """
+    entry = {'name': name, 'kind': 'dictionary', 'categorical': categorical,
+             'file': 'c{}.npy'.format(idx), 'dictionary': 'c{}.dict.json'.format(idx)}
+    codes = np.asarray(codes)
+    np.save(os.path.join(dataset_dir, entry['file']), codes.astype(_codesDtype(len(dictionary)), copy=False))
+    with open(os.path.join(dataset_dir, entry['dictionary']), 'w') as fp:
+        json.dump(dictionary, fp)
+
+    if categorical:
+        # inverted index of categorical columns used by filters: row positions sorted by code and the start offset of
+        # each code rows (missing values first) so rows of code c are order[offsets[c+1]:offsets[c+2]]
+        entry['index'] = {'order': 'c{}.order.npy'.format(idx), 'offsets': 'c{}.offsets.npy'.format(idx)}
+        order = np.argsort(codes, kind='stable').astype(_positionsDtype(codes.size))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes.astype(np.int64) + 1, minlength=len(dictionary) + 1))])
+        np.save(os.path.join(dataset_dir, entry['index']['order']), order)
+        np.save(os.path.join(dataset_dir, entry['index']['offsets']), offsets.astype(np.int64))
+    return entry
+
+
+@functools.lru_cache(maxsize=256)
+def _readDictionary(path):
+    # dataset directories are never modified once written so distinct values are cached by the worker process
+    with open(path) as fp:
+        dictionary = json.load(fp)
+    decoder = np.empty(len(dictionary) + 1, dtype=object)
+    decoder[:-1] = dictionary
+    decoder[-1] = np.nan #missing values are coded as -1 and hence decoded to the last element
+    return pd.Index(dictionary, dtype=None if len(dictionary) else object), decoder #numeric categories keep their type
+
+
+def _readColumn(dataset_dir, entry, categorical=False):
+    """Read a single stored column memory-mapping its data file
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory
+        entry (dict): manifest entry describing the column
+        categorical (bool, optional): read dictionary encoded text columns as pandas categorical. Defaults to False
+    Returns:
+        values (numpy array or pandas array): column values
+    """
+    path = os.path.join(dataset_dir, entry['file'])
+    if entry['kind'] == 'pickle':
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+
+    values = np.load(path, mmap_mode='r')
+    if entry['kind'] == 'dictionary':
+        categories, decoder = _readDictionary(os.path.join(dataset_dir, entry['dictionary']))
+        if entry.get('categorical') or categorical:
+            return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories))
+        return decoder[values]
+    return values
+
+
+def writePrefixIndex(dataset_dir, names, levels):
+    """Write a prefix tree (trie) index over hierarchical paths stored in several categorical columns (one per level)
+    and return its manifest entry. Rows are sorted by their path codes so the rows of every tree node (a path prefix)
+    are a contiguous run order[starts[node]:ends[node]] of the sorted row positions. Nodes of all levels are stored
+    in arrays ordered by level, parent node and code so children of a node are found by binary search
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        names (list): names of the level columns from the top (most relaxed) level down
+        levels (list): dictionary codes of the level columns (numpy arrays, -1 for missing values)
+    Returns:
+        entry (dict): manifest entry describing the stored index
+    """
+    levels = [np.asarray(codes, dtype=np.int64) for codes in levels]
+    nrows = len(levels[0]) if levels else 0
+    order = np.lexsort(levels[::-1]) if levels else np.arange(0) #np.lexsort() sorts by the last key first
+    boundary = np.zeros(nrows, dtype=bool)
+    boundary[:1] = True
+    nodes = {'codes': [], 'starts': [], 'ends': [], 'parents': []}
+    level_offsets = [0]
+    for codes in levels:
+        sorted_codes = codes[order]
+        boundary[1:] |= sorted_codes[1:] != sorted_codes[:-1] #a new node starts where the path prefix changes
+        starts = np.flatnonzero(boundary)
+        if len(level_offsets) == 1:
+            parents = np.full(len(starts), -1)
+        else:
+            parent_starts = nodes['starts'][-1]
+            parents = np.searchsorted(parent_starts, starts, side='right') - 1 + level_offsets[-2]
+        nodes['codes'].append(sorted_codes[starts])
+        nodes['starts'].append(starts)
+        nodes['ends'].append(np.append(starts[1:], nrows))
+        nodes['parents'].append(parents)
+        level_offsets.append(level_offsets[-1] + len(starts))
+
+    entry = {'columns': list(names), 'level_offsets': level_offsets, 'order': 'prefix.order.npy'}
+    np.save(os.path.join(dataset_dir, entry['order']), order.astype(_positionsDtype(nrows)))
+    for key, arrays in nodes.items():
+        entry[key] = 'prefix.{}.npy'.format(key)
+        np.save(os.path.join(dataset_dir, entry[key]), np.concatenate(arrays).astype(np.int64) if arrays else np.arange(0))
+    return entry
+
+
+def findPrefixRows(prefix_index, codes):
+    """Find row positions of a hierarchical path prefix in the prefix tree index by walking down the tree
+
+    Arguments:
+        prefix_index (dict): prefix tree index returned by loadPrefixIndex()
+        codes (list): dictionary codes of the path prefix values from the top level down
+    Returns:
+        {numpy array}: row positions of the path prefix (empty if the prefix is not found)
+    """
+    level_offsets = prefix_index['level_offsets']
+    node = -1
+    for level, code in enumerate(codes):
+        lo, hi = level_offsets[level], level_offsets[level+1]
+        if level > 0: #children of the current node are a contiguous run of the level nodes
+            parents = prefix_index['parents'][lo:hi]
+            lo, hi = lo + np.searchsorted(parents, node, side='left'), lo + np.searchsorted(parents, node, side='right')
+        node = lo + np.searchsorted(prefix_index['codes'][lo:hi], code)
+        if node >= hi or prefix_index['codes'][node] != code:
+            return prefix_index['order'][:0]
+    if node == -1:
+        return prefix_index['order']
+    return prefix_index['order'][prefix_index['starts'][node]:prefix_index['ends'][node]]
+
+
+def writeDataCube(dataset_dir, dimensions, max_cells):
+    """Write a data cube (i.e. a materialized group by table) holding the number of rows of every distinct combination
+    of dimension codes and return its manifest entry. Counts of any combination of dimension filters and group by
+    dimensions are then totalled over the cube cells instead of the dataset rows
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        dimensions (dict): dimension names and their integer codes per row (numpy arrays, -1 for missing values)
+        max_cells (int): maximum number of cube cells. Larger cubes are not worth storing compared to the dataset rows
+    Returns:
+        entry (dict): manifest entry describing the stored cube or None if the cube is too large or has no dimensions
+    """
+    if not dimensions:
+        return None
+    codes = np.column_stack([np.asarray(dimension_codes, dtype=np.int64) for dimension_codes in dimensions.values()])
+    cells, counts = np.unique(codes, axis=0, return_counts=True)
+    if cells.shape[0] > max_cells:
+        print("Data cube not stored: {} cells exceed the limit of {}".format(cells.shape[0], max_cells))
+        return None
+
+    entry = {'columns': list(dimensions), 'codes': 'cube.codes.npy', 'counts': 'cube.counts.npy'}
+    np.save(os.path.join(dataset_dir, entry['codes']), cells.astype(np.int32))
+    np.save(os.path.join(dataset_dir, entry['counts']), counts.astype(np.int64))
+    return entry
+
+
+def writeComponentMatrix(dataset_dir, name, matrix, vocabulary, delimiter):
+    """Write the sparse component matrix of a profile column (e.g. genetic_profile) and return its manifest entry.
+    Rows of the matrix are the column dictionary values (profiles) and columns the distinct profile components, so the
+    component counts of any rows selection are the matrix rows of the selected dictionary codes summed up
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        name (string): profile column name
+        matrix (scipy sparse matrix): number of occurrences of each component (column) in each profile (row)
+        vocabulary (list): component names of the matrix columns
+        delimiter (string): profile components delimiter the matrix was parsed with
+    Returns:
+        entry (dict): manifest entry describing the stored matrix
+    """
+    entry = {'matrix': 'components.{}.npz'.format(re.sub(r'\W', '_', str(name))),
+             'vocabulary': 'components.{}.json'.format(re.sub(r'\W', '_', str(name))), 'delimiter': delimiter}
+    sparse.save_npz(os.path.join(dataset_dir, entry['matrix']), sparse.csr_matrix(matrix))
+    with open(os.path.join(dataset_dir, entry['vocabulary']), 'w') as fp:
+        json.dump(list(vocabulary), fp)
+    return entry
+
+
+def createDatasetDir(session_id):
+    """Create an empty temporary directory to write a new session dataset version into column by column.
+    The dataset fingerprint is only needed once the dataset is committed (e.g. after the whole upload is read)
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+    Returns:
+        dataset_dir (string): path to the temporary dataset directory
+    """
+    os.makedirs(_sessionStoreDir(session_id), exist_ok=True)
+    return tempfile.mkdtemp(suffix='.tmp', dir=_sessionStoreDir(session_id))
+
+
+def discardDatasetDir(dataset_dir):
+    """Remove a temporary dataset directory that could not be completed (e.g. due to input parsing errors)
+
+    Arguments:
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+    """
+    if dataset_dir.endswith('.tmp'):
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+
+
+def commitDataset(session_id, fingerprint, dataset_dir, nrows, columns, prefix_index=None, data_cube=None, components=None):
+    """Write the manifest of a completed dataset directory and make it the current dataset version of the session.
+    Previous dataset versions of the same session are removed
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint
+        dataset_dir (string): path to the dataset directory returned by createDatasetDir()
+        nrows (int): number of dataset rows
+        columns (list): manifest entries of the written columns in the column order
+        prefix_index (dict, optional): manifest entry of the hierarchical paths prefix index (see writePrefixIndex())
+        data_cube (dict, optional): manifest entry of the data cube (see writeDataCube())
+        components (dict, optional): profile column names and manifest entries of their component matrices (see writeComponentMatrix())
+    """
+    manifest = {'fingerprint': fingerprint, 'nrows': int(nrows), 'created': time.time(), 'columns': columns}
+    if prefix_index is not None:
+        manifest['prefix_index'] = prefix_index
+    if data_cube is not None:
+        manifest['data_cube'] = data_cube
+    if components:
+        manifest['components'] = components
+    manifest['nbytes'] = sum([os.path.getsize(os.path.join(dataset_dir, f)) for f in os.listdir(dataset_dir)])
+    with open(os.path.join(dataset_dir, 'manifest.json'), 'w') as fp:
+        json.dump(manifest, fp)
+
+    #rename so other worker processes never read a partially written dataset
+    shutil.rmtree(_datasetDir(session_id, fingerprint), ignore_errors=True)
+    os.replace(dataset_dir, _datasetDir(session_id, fingerprint))
+
+    session_dir = _sessionStoreDir(session_id)
+    for dirname in os.listdir(session_dir):
+        if dirname != fingerprint and not dirname.endswith('.tmp'):
+            shutil.rmtree(os.path.join(session_dir, dirname), ignore_errors=True)
+    invalidateSelections(session_id, keep_fingerprint=fingerprint)
+
+    purgeExpiredDatasets()
+    print("Stored dataset {} of session {} with {} rows and {} columns ({:.1f} MB)".format(
+        fingerprint, session_id, manifest['nrows'], len(manifest['columns']), manifest['nbytes']/1024**2))
+
+
+def storeDataset(session_id, fingerprint, df, hierarchy=None, cube_dimensions=None, components=None):
+    """Store a session dataset in the columnar on-disk format. Previous dataset versions of the same session are removed
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint
+        df (pandas dataframe): dataset to store
+        hierarchy (list, optional): names of categorical columns holding hierarchical path levels from the top level down
+                                    to build the prefix tree index of (e.g. hs_level_0, hs_level_1, ...). Defaults to None
+        cube_dimensions (dict, optional): dimension names and their integer codes per row to build the data cube of
+                                          (see writeDataCube()). The cube is limited by the DATA_CUBE_MAX_CELLS config
+                                          value (0 disables it). Defaults to None
+        components (dict, optional): profile column names and their (matrix, vocabulary, delimiter) component matrices
+                                     (see writeComponentMatrix()). Defaults to None
+    """
+    dataset_dir = createDatasetDir(session_id)
+    columns = [writeDatasetColumn(dataset_dir, idx, df.columns[idx], df.iloc[:, idx]) for idx in range(df.shape[1])]
+    prefix_index = None
+    if hierarchy:
+        prefix_index = writePrefixIndex(dataset_dir, hierarchy, [df[name].cat.codes.to_numpy() for name in hierarchy])
+    data_cube = None
+    if cube_dimensions and app.config.get('DATA_CUBE_MAX_CELLS', 0) > 0:
+        data_cube = writeDataCube(dataset_dir, cube_dimensions, app.config['DATA_CUBE_MAX_CELLS'])
+    components = {name: writeComponentMatrix(dataset_dir, name, *components[name]) for name in (components or {})}
+    commitDataset(session_id, fingerprint, dataset_dir, df.shape[0], columns, prefix_index, data_cube, components)
+
+
+def _readManifest(session_id, fingerprint):
+    path = os.path.join(_datasetDir(session_id, fingerprint), 'manifest.json')
+    try:
+        os.utime(path) #mark as recently used for the expiry purge
+        with open(path) as fp:
+            return json.load(fp)
+    except OSError:
+        return None #expired, replaced by a newer upload or never stored
+
+
+def datasetColumns(session_id, fingerprint, kind=None):
+    """List column names of a stored dataset without reading any column data
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        kind (string, optional): list only the columns stored as this kind ('dictionary', 'array' or 'pickle').
+                                 Defaults to None listing all columns
+    Returns:
+        {list}: column names or None if the dataset does not exist
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None:
+        return None
+    return [entry['name'] for entry in manifest['columns'] if kind is None or entry['kind'] == kind]
+
+
+def loadDataset(session_id, fingerprint, columns=None, categorical=False):
+    """Load a session dataset from the columnar store. Only the requested columns are read and data files are
+    memory-mapped so numeric, date and categorical columns are not copied into the worker process memory
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        columns (list, optional): names of columns to read. Defaults to None reading all columns
+        categorical (bool, optional): read all dictionary encoded text columns (e.g. unmapped fields) as pandas categorical
+                                      from their stored codes. Defaults to False
+    Returns:
+        df (pandas dataframe): stored dataset or None if the dataset does not exist (e.g. expired or replaced)
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None:
+        return None
+
+    dataset_dir = _datasetDir(session_id, fingerprint)
+    entries = [entry for entry in manifest['columns'] if columns is None or entry['name'] in columns]
+    df = pd.DataFrame({idx: _readColumn(dataset_dir, entry, categorical) for idx, entry in enumerate(entries)},
+                      index=pd.RangeIndex(manifest['nrows']), copy=False)
+    df.columns = pd.Index([entry['name'] for entry in entries], dtype=object) #column names are not necessarily unique
+    return df
+
+
+def loadDatasetIndexes(session_id, fingerprint, columns=None):
+    """Load indexes of the stored columns used by data filters. Index files are memory-mapped.
+    Categorical columns have inverted indexes of dictionary codes and datetime columns have sorted indexes of values
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        columns (list, optional): names of columns to read indexes of. Defaults to None reading all indexes
+    Returns:
+        {dict}: dictionary of column names and index tuples of numpy arrays. Categorical columns have (order, offsets)
+                tuples where row positions with dictionary code c are order[offsets[c+1]:offsets[c+2]] (missing values are c=-1).
+                Datetime columns have (order, values) tuples of non-missing value positions sorted by value and sorted values
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None:
+        return {}
+
+    dataset_dir = _datasetDir(session_id, fingerprint)
+    return {entry['name']: tuple(np.load(os.path.join(dataset_dir, entry['index'][key]), mmap_mode='r') for key in entry['index'])
+            for entry in manifest['columns'] if 'index' in entry and (columns is None or entry['name'] in columns)}
+
+
+def loadPrefixIndex(session_id, fingerprint):
+    """Load the hierarchical paths prefix tree index of a stored dataset (see writePrefixIndex()). Index files are memory-mapped
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+    Returns:
+        {dict}: index level column names, level offsets and node arrays or None if the dataset has no prefix index
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None or 'prefix_index' not in manifest:
+        return None
+
+    dataset_dir = _datasetDir(session_id, fingerprint)
+    entry = manifest['prefix_index']
+    prefix_index = {'columns': entry['columns'], 'level_offsets': entry['level_offsets']}
+    for key in ['order', 'codes', 'starts', 'ends', 'parents']:
+        prefix_index[key] = np.load(os.path.join(dataset_dir, entry[key]), mmap_mode='r')
+    return prefix_index
+
+
+def loadDataCube(session_id, fingerprint):
+    """Load the data cube of a stored dataset (see writeDataCube()). Cube files are memory-mapped
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+    Returns:
+        {dict}: cube dimension names ('columns'), cells dimension codes ('codes', one column per dimension) and cells
+                row counts ('counts') or None if the dataset has no data cube
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None or 'data_cube' not in manifest:
+        return None
+
+    dataset_dir = _datasetDir(session_id, fingerprint)
+    entry = manifest['data_cube']
+    return {'columns': entry['columns'],
+            'codes': np.load(os.path.join(dataset_dir, entry['codes']), mmap_mode='r'),
+            'counts': np.load(os.path.join(dataset_dir, entry['counts']), mmap_mode='r')}
+
+
+def loadComponentMatrices(session_id, fingerprint):
+    """Load the component matrices of the stored dataset profile columns (see writeComponentMatrix())
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+    Returns:
+        {dict}: profile column names and (matrix, vocabulary, delimiter) tuples of sparse CSR matrices, component names
+                and components delimiter
+    """
+    manifest = _readManifest(session_id, fingerprint)
+    if manifest is None or 'components' not in manifest:
+        return {}
+
+    dataset_dir = _datasetDir(session_id, fingerprint)
+    components = {}
+    for name, entry in manifest['components'].items():
+        with open(os.path.join(dataset_dir, entry['vocabulary'])) as fp:
+            vocabulary = json.load(fp)
+        components[name] = (sparse.load_npz(os.path.join(dataset_dir, entry['matrix'])).tocsr(), vocabulary, entry['delimiter'])
+    return components
+
+
+def deleteDatasets(session_id):
+    """Remove all datasets of a session from disk
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+    """
+    shutil.rmtree(_sessionStoreDir(session_id), ignore_errors=True)
+    invalidateSelections(session_id)
+
+
+def datasetStorageUsage():
+    """Per-session dataset storage usage: bytes of the stored dataset files on disk (not process memory). Memory-mapped
+    column files are only paged in when read, so this is the upper bound of the OS page cache a session dataset can occupy
+
+    Returns:
+        {dict}: dictionary of session identifiers and stored dataset sizes in bytes {session_id: nbytes}
+    """
+    datasets_dir = os.path.join(app.config.get('DATASET_STORE_DIR', 'cache-dir'), 'datasets')
+    usage = {}
+    for session_id in (os.listdir(datasets_dir) if os.path.isdir(datasets_dir) else []):
+        for fingerprint in os.listdir(os.path.join(datasets_dir, session_id)):
+            try:
+                with open(os.path.join(datasets_dir, session_id, fingerprint, 'manifest.json')) as fp:
+                    usage[session_id] = usage.get(session_id, 0) + json.load(fp)['nbytes']
+            except (OSError, ValueError):
+                continue #dataset being written or removed
+    return usage
+
+
+def purgeExpiredDatasets():
+    """Remove session datasets from disk that were not used longer than DATASET_STORE_TIMEOUT seconds"""
+    datasets_dir = os.path.join(app.config.get('DATASET_STORE_DIR', 'cache-dir'), 'datasets')
+    if not os.path.isdir(datasets_dir):
+        return
+    expiry_time = time.time() - app.config.get('DATASET_STORE_TIMEOUT', 86400)
+    for session_id in os.listdir(datasets_dir):
+        session_dir = os.path.join(datasets_dir, session_id)
+        try:
+            last_used = max([os.path.getmtime(os.path.join(session_dir, f, 'manifest.json'))
+                             for f in os.listdir(session_dir) if not f.endswith('.tmp')] or [0])
+        except OSError:
+            continue #being written or removed concurrently by another worker
+        if last_used < expiry_time:
+            print("Purging expired datasets of session {}".format(session_id))
+            shutil.rmtree(session_dir, ignore_errors=True)
+            invalidateSelections(session_id)
+
+
+# LRU cache of filtered row selections. Filtered data is identified by the dataset fingerprint and the canonical filter
+# specification, so requests only changing plot options (e.g. log scale, group by) reuse the row positions selected by
+# the previous requests instead of evaluating the filters again. Row positions are kept in the worker process memory
+# up to SELECTION_CACHE_MEMORY_LIMIT bytes evicting the least recently used selections first. The group codes of the
+# selected rows (group by plots option) are cached alongside the selection they were computed on
+_selections = OrderedDict()
+_selections_lock = threading.Lock()
+_selections_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'nbytes': 0}
+_last_selections = {} #filter specification of the last selection of each session filters group
+
+
+def getCachedSelection(session_id, fingerprint, spec):
+    """Look up the row positions of a filtered dataset selection in the selection cache
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        spec (string): canonical filter specification
+    Returns:
+        {numpy array}: read-only row positions of the selection or None if not cached
+    """
+    key = (session_id, fingerprint, spec)
+    with _selections_lock:
+        positions = _selections.get(key)
+        if positions is None:
+            _selections_stats['misses'] += 1
+            return None
+        _selections.move_to_end(key)
+        _selections_stats['hits'] += 1
+        return positions
+
+
+def cacheSelection(session_id, fingerprint, spec, positions):
+    """Add the row positions of a filtered dataset selection to the selection cache evicting the least recently used
+    selections above the SELECTION_CACHE_MEMORY_LIMIT config value
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        spec (string): canonical filter specification
+        positions (numpy array): selected row positions
+    """
+    positions = np.asarray(positions)
+    positions = positions.astype(_positionsDtype(positions.max() + 1 if positions.size else 0))
+    positions.flags.writeable = False #shared by concurrent requests
+    _cacheEntry((session_id, fingerprint, spec), positions)
+
+
+def _entryBytes(entry):
+    # cached selections are row positions arrays and cached groupings (codes, groups, other) tuples
+    return entry[0].nbytes if isinstance(entry, tuple) else entry.nbytes
+
+
+def _cacheEntry(key, entry):
+    """Add an entry to the selection cache evicting the least recently used entries above the SELECTION_CACHE_MEMORY_LIMIT
+    config value
+
+    Arguments:
+        key (tuple): (session id, dataset fingerprint, filter specification[, grouping column])
+        entry (numpy array or tuple): read-only row positions of a selection or a grouping of its rows
+    """
+    limit = app.config.get('SELECTION_CACHE_MEMORY_LIMIT', 256*1024**2)
+    with _selections_lock:
+        previous = _selections.pop(key, None)
+        if previous is not None:
+            _selections_stats['nbytes'] -= _entryBytes(previous)
+        if _entryBytes(entry) <= limit:
+            _selections[key] = entry
+            _selections_stats['nbytes'] += _entryBytes(entry)
+        while _selections_stats['nbytes'] > limit:
+            _, evicted = _selections.popitem(last=False)
+            _selections_stats['nbytes'] -= _entryBytes(evicted)
+            _selections_stats['evictions'] += 1
+
+
+def getCachedGrouping(session_id, fingerprint, spec, column):
+    """Look up the grouping of the rows of a filtered dataset selection by a column (see cacheGrouping())
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        spec (string): canonical filter specification of the selection
+        column (string): grouping column name
+    Returns:
+        {tuple}: (codes, groups, other) grouping of the selected rows or None if not cached
+    """
+    key = (session_id, fingerprint, spec, column)
+    with _selections_lock:
+        grouping = _selections.get(key)
+        if grouping is None:
+            _selections_stats['misses'] += 1
+            return None
+        _selections.move_to_end(key)
+        _selections_stats['hits'] += 1
+        return grouping
+
+
+def cacheGrouping(session_id, fingerprint, spec, column, codes, groups, other):
+    """Add the grouping of the rows of a filtered dataset selection by a column (e.g. the group by plots option)
+    to the selection cache. Groupings share the selection cache memory limit and least recently used eviction
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        spec (string): canonical filter specification of the selection
+        column (string): grouping column name
+        codes (numpy array): group of each selected row (-1 for rows of no group)
+        groups (list): group names
+        other (string): name of the group lumping the remaining values ('' if there is none)
+    """
+    codes = np.array(codes)
+    codes.flags.writeable = False #shared by concurrent requests
+    _cacheEntry((session_id, fingerprint, spec, column), (codes, list(groups), other))
+
+
+def setLastSelection(session_id, fingerprint, group, spec):
+    """Record the filter specification of the last selection of a filters group (e.g. filterset1) of a session dataset
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        group (string): filters group name
+        spec (string): canonical filter specification of the selection
+    """
+    with _selections_lock:
+        _last_selections[(session_id, fingerprint, group)] = spec
+
+
+def getLastSelection(session_id, fingerprint, group):
+    """Look up the last selection of a filters group of a session dataset (see setLastSelection())
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        fingerprint (string): dataset fingerprint stored in session['dataset_fingerprint']
+        group (string): filters group name
+    Returns:
+        spec (string): canonical filter specification of the last selection or None if unknown or no longer cached
+        positions (numpy array): read-only row positions of the last selection or None
+    """
+    with _selections_lock:
+        spec = _last_selections.get((session_id, fingerprint, group))
+        positions = _selections.get((session_id, fingerprint, spec))
+    if positions is None:
+        return None, None
+    return spec, positions
+
+
+def invalidateSelections(session_id, keep_fingerprint=None):
+    """Remove cached selections of a session datasets (e.g. after a new dataset version was stored)
+
+    Arguments:
+        session_id (string): session identifier (session['id'])
+        keep_fingerprint (string, optional): fingerprint of the dataset version whose selections are kept. Defaults to None
+    """
+    with _selections_lock:
+        for key in [k for k in _selections if k[0] == session_id and k[1] != keep_fingerprint]:
+            _selections_stats['nbytes'] -= _entryBytes(_selections.pop(key))
+        for key in [k for k in _last_selections if k[0] == session_id and k[1] != keep_fingerprint]:
+            del _last_selections[key]
+
+
+def selectionCacheStats():
+    """Selection cache statistics of the worker process
+
+    Returns:
+        {dict}: numbers of cache hits, misses, evictions and cached selections, cached bytes and the memory limit
+    """
+    with _selections_lock:
+        stats = dict(_selections_stats)
+        stats['entries'] = len(_selections)
+    stats['limit'] = app.config.get('SELECTION_CACHE_MEMORY_LIMIT', 256*1024**2)
+    return stats
@@ -0,0 +1,208 @@
+from app import app
+from app.datastore import createDatasetDir, discardDatasetDir, commitDataset, writeDatasetColumn, \
+    writeDictionaryColumn, datasetFingerprint
+import pandas as pd
+import numpy as np
+from xlsx2csv import Xlsx2csv, XlsxException
+import os, io, re, hashlib, tempfile
+
+
+# Streaming ingest of uploaded files into the session dataset store. The input is read once in chunks of
+# UPLOAD_CHUNK_ROWS rows: every column is dictionary encoded on the fly and its integer codes are spooled to disk,
+# while the validation screen statistics (counts, distinct and missing values) are accumulated chunk by chunk.
+# Peak memory is hence bounded by a chunk of text plus the distinct values of each column instead of the whole file
+_TRUE_VALUES = ['True', 'TRUE', 'true'] #same boolean literals as the pandas CSV parser
+_FALSE_VALUES = ['False', 'FALSE', 'false']
+
+
+class _HashingReader(io.RawIOBase):
+    # file wrapper calculating the content digest while the file is being parsed so the fingerprint needs no extra read
+    def __init__(self, file):
+        self.file = file
+        self.sha = hashlib.sha1()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(len(buffer))
+        self.sha.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _encodeChunkColumn(values, dictionary):
+    """Dictionary encode a chunk of column values extending the column dictionary with newly seen values
+
+    Arguments:
+        values (numpy array): chunk column values as strings (NaN for missing values)
+        dictionary (dict): column dictionary of already seen values and their codes {value: code}
+    Returns:
+        codes (numpy array): dictionary codes of chunk values (-1 for missing values)
+    """
+    codes, uniques = pd.factorize(values)
+    mapping = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques] + [-1], dtype=np.int32)
+    return mapping[codes] #missing value code -1 maps to the last mapping element
+
+
+def _inferDictionaryType(dictionary, has_missing):
+    """Infer column data type from the distinct column values following the pandas CSV parser rules
+    (i.e. integers, floats if integers have missing values, booleans and text otherwise)
+
+    Arguments:
+        dictionary (list): distinct column values as strings
+        has_missing (bool): True if the column has missing values
+    Returns:
+        decoder (numpy array): typed dictionary values followed by the missing value element or None for text columns
+    """
+    if len(dictionary) == 0:
+        return np.array([np.nan]) #all values are missing
+    uniques = pd.Series(dictionary, dtype=object)
+    if uniques.isin(_TRUE_VALUES + _FALSE_VALUES).all():
+        decoder = uniques.isin(_TRUE_VALUES).to_numpy()
+        return np.append(decoder.astype(object), np.nan) if has_missing else np.append(decoder, False)
+
+    numeric = pd.to_numeric(uniques, errors='coerce')
+    if numeric.isna().any():
+        return None
+    decoder = numeric.to_numpy()
+    if decoder.dtype.kind in 'iu' and has_missing == False:
+        return np.append(decoder, decoder.dtype.type(0))
+    return np.append(decoder.astype(np.float64), np.nan)
+
+
+def ingestCSV(file, session_id, chunksize=None, filename=None):
+    """Read an uploaded CSV file in a single streaming pass into the session dataset store.
+    Rows with missing value in the first column are considered empty and skipped
+
+    Arguments:
+        file (FileStorage): the uploaded file transferred from the frontend
+        session_id (string): session identifier (session['id'])
+        chunksize (int, optional): rows per parsed chunk. Defaults to UPLOAD_CHUNK_ROWS config value
+        filename (string, optional): file name reported in error messages. Defaults to the uploaded file name
+    Returns:
+        fingerprint (string): fingerprint of the stored dataset
+        summary {dict}: dataset statistics for the validation screen including data dimensions and per column
+                        non-missing value counts, distinct value counts (including missing value) and data types
+                        {'data_shape': (rows, columns), 'counts': {column: n}, 'unique': {column: n}, 'dtypes': {column: 'dtype'}}
+        error_msg (string): error message if upload failed ('' otherwise)
+    """
+    chunksize = chunksize or app.config.get('UPLOAD_CHUNK_ROWS', 100000)
+    filename = filename or file.filename
+    reader = _HashingReader(file)
+    dataset_dir = None
+    spool_files = []
+    try:
+        try:
+            chunks = pd.read_csv(io.BufferedReader(reader), header=None, dtype=str, chunksize=chunksize)
+            nrows = 0
+            for chunk in chunks:
+                if dataset_dir is None:
+                    #first row is the header. Duplicated column names are allowed by the parser (no automatic renaming)
+                    column_names = chunk.iloc[0, :].to_list()
+                    chunk = chunk.iloc[1:, :]
+                    if pd.Index(column_names).duplicated().any():
+                        dupl_col_names = ",".join(map(str, pd.Index(column_names)[pd.Index(column_names).duplicated()]))
+                        return None, {}, f'''Duplicated column(s) found ({dupl_col_names}) in file {filename}! Aborting upload. Make sure input has unique header names'''
+                    dataset_dir = createDatasetDir(session_id)
+                    dictionaries = [{} for _ in column_names]
+                    has_missing = np.zeros(len(column_names), dtype=bool) #in any row including skipped empty rows
+                    counts = np.zeros(len(column_names), dtype=np.int64)
+                    spool_files = [open(os.path.join(dataset_dir, 'c{}.codes'.format(idx)), 'wb') for idx in range(len(column_names))]
+
+                has_missing |= chunk.isna().any(axis=0).to_numpy()
+                chunk = chunk[chunk.iloc[:, 0].notna()]
+                nrows += chunk.shape[0]
+                for idx in range(len(column_names)):
+                    codes = _encodeChunkColumn(chunk.iloc[:, idx].to_numpy(), dictionaries[idx])
+                    counts[idx] += np.count_nonzero(codes >= 0)
+                    codes.tofile(spool_files[idx])
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            if dataset_dir is not None:
+                discardDatasetDir(dataset_dir)
+            return None, {}, 'Could not parse file {}! Aborting upload. Error: {}'.format(filename, e)
+        finally:
+            for spool_file in spool_files:
+                spool_file.close()
+
+        fingerprint = datasetFingerprint(reader.sha.digest()) #same fingerprint as fileFingerprint() of the file
+        summary = {'data_shape': (nrows, len(column_names)), 'counts': {}, 'unique': {}, 'dtypes': {}}
+        columns = []
+        for idx, column_name in enumerate(column_names):
+            spool_path = os.path.join(dataset_dir, 'c{}.codes'.format(idx))
+            codes = np.fromfile(spool_path, dtype=np.int32)
+            dictionary = list(dictionaries[idx])
+            decoder = _inferDictionaryType(dictionary, has_missing[idx])
+            if decoder is None:
+                columns.append(writeDictionaryColumn(dataset_dir, idx, column_name, codes, dictionary))
+                summary['unique'][column_name] = len(dictionary) + int(counts[idx] < nrows)
+                summary['dtypes'][column_name] = 'object'
+            else:
+                columns.append(writeDatasetColumn(dataset_dir, idx, column_name, pd.Series(decoder[codes])))
+                summary['unique'][column_name] = pd.unique(decoder[:-1]).size + int(counts[idx] < nrows)
+                summary['dtypes'][column_name] = str(decoder.dtype)
+            summary['counts'][column_name] = int(counts[idx])
+            os.remove(spool_path)
+            dictionaries[idx].clear() #release distinct values of the already stored column
+
+        commitDataset(session_id, fingerprint, dataset_dir, nrows, columns)
+        return fingerprint, summary, ''
+    except BaseException:
+        #any failure (e.g. disk full while spooling or writing columns) leaves no partial dataset directory behind
+        if dataset_dir is not None:
+            discardDatasetDir(dataset_dir)
+        raise
+
+
+def _selectXLSXSheet(xlsx, sheet):
+    """Find the worksheet number (starting from 1) to convert from a sheet name or number.
+    If not specified the active sheet (i.e. the sheet shown when workbook was last saved) is selected
+
+    Arguments:
+        xlsx (Xlsx2csv): opened workbook
+        sheet (string): sheet name or number
+    Returns:
+        sheetid (int): worksheet number or None if the sheet is not found
+    """
+    if sheet:
+        sheetid = xlsx.getSheetIdByName(sheet)
+        if sheetid is None and re.fullmatch(r'\d+', sheet) and 1 <= int(sheet) <= len(xlsx.workbook.sheets):
+            sheetid = int(sheet)
+        return sheetid
+    workbook_xml = xlsx.ziphandle.read(xlsx.content_types.types['workbook'].lstrip('/')).decode('utf-8', 'ignore')
+    active_tab = re.search(r'<(?:\w+:)?workbookView[^>]*\sactiveTab="(\d+)"', workbook_xml)
+    if active_tab and int(active_tab.group(1)) < len(xlsx.workbook.sheets):
+        return int(active_tab.group(1)) + 1
+    return 1
+
+
+def ingestXLSX(file, session_id, sheet=None, chunksize=None):
+    """Convert a worksheet of an uploaded Excel file to CSV text with xlsx2csv and stream it through the CSV ingest.
+    xlsx2csv parses the worksheet XML incrementally writing rows as they are read, so the workbook is never loaded as
+    Python objects row by row. Dates are written in the YYYY-MM-DD format expected by the date field
+
+    Arguments:
+        file (FileStorage): the uploaded file transferred from the frontend
+        session_id (string): session identifier (session['id'])
+        sheet (string, optional): worksheet name or number (starting from 1). Defaults to None selecting the active sheet
+        chunksize (int, optional): rows per parsed chunk. Defaults to UPLOAD_CHUNK_ROWS config value
+    Returns:
+        fingerprint (string): fingerprint of the stored dataset (i.e. of the converted worksheet content)
+        summary {dict}: dataset statistics for the validation screen (see ingestCSV())
+        error_msg (string): error message if upload failed ('' otherwise)
+    """
+    try:
+        xlsx = Xlsx2csv(file, dateformat='%Y-%m-%d', skip_empty_lines=True, skip_hidden_rows=False)
+    except XlsxException:
+        return None, {}, 'Could not open Excel file {}! Aborting upload. Make sure it is a valid xlsx workbook'.format(file.filename)
+
+    with xlsx, tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='') as csv_file:
+        sheetid = _selectXLSXSheet(xlsx, sheet)
+        if sheetid is None:
+            return None, {}, 'Sheet {} not found in file {}! Available sheets: {}'.format(
+                sheet, file.filename, ', '.join([s['name'] for s in xlsx.workbook.sheets]))
+        print("Converting sheet {} of {} to CSV".format(xlsx.workbook.sheets[sheetid-1]['name'], file.filename))
+        xlsx.convert(csv_file, sheetid=sheetid)
+        csv_file.seek(0)
+        return ingestCSV(csv_file.buffer, session_id, chunksize=chunksize,
+                         filename="{} (sheet {})".format(file.filename, xlsx.workbook.sheets[sheetid-1]['name']))
@@ -191,7 +191,7 @@ function renderTraceControls(){
 
 /**
  * Reset all previosuly selected data filters and render the initial input data (i.e. global unfiltered dataset)
- * The function resets group #1 and #2 and GROUP BY filters together with the y-axis transformation sliders (% and log scales)
+ * The function resets group #1 and #2 (and removes the added groups) and GROUP BY filters together with the y-axis transformation sliders (% and log scales)
  * Finishes with a POST request for plots re-calculation via the key postPlotData()
  */
 function resetAllFilters(){
@@ -209,6 +209,7 @@ function resetAllFilters(){
 
     }
     $("#date_range_filter1").find("input")[0].value=''; $("#date_range_filter1").find("input")[1].value=''
+    $("#accordion_section_filters_subset1").find("input.filter_pattern, input.hs_path_filter").val('');
 
     if(filters_group2_values.length > 0) {
         console.log('Resetting group#2 filters due groupby selector activation')
@@ -218,6 +219,8 @@ function resetAllFilters(){
         }
     }
     $("#date_range_filter2").find("input")[0].value=''; $("#date_range_filter2").find("input")[1].value=''
+    $("#accordion_section_filters_subset2").find("input.filter_pattern").val('');
+    $(".filters_group_added").remove(); //groups added by addFiltersGroup()
     //reset groupby filter
     if (groupby_values_array.length > 0){
         $('#groupby_selector').selectpicker('val',null);
@@ -412,6 +415,45 @@ function clearSession(targeturl){
     }); 
 }
 
+/**
+ * Adds a filters group (Group #3, #4, ...) to the left control panel by cloning the Group #2 filters with cleared values.
+ * Tag ids are renamed from filterset2 to filtersetN so postPlotData() posts the group filters under their own keys and
+ * the backend compares all groups as the traces of the group by mode plots
+ * @returns - false if the maximum number of groups (FILTER_GROUPS_MAX) is reached
+ */
+function addFiltersGroup(){
+    let ngroup = document.querySelectorAll('[id^="accordion_section_filters_subset"]').length + 1
+    let max_groups = parseInt(document.getElementById('add_filters_group_button').dataset.maxGroups)
+    if(ngroup > max_groups){
+        Swal.fire({
+            text: "At most "+max_groups+" filters groups can be compared",
+            icon: "error"
+        });
+        return false
+    }
+    let group2_item = document.getElementById('accordion_section_filters_subset2').parentElement
+    let group_item = group2_item.cloneNode(true)
+    group_item.classList.add('filters_group_added')
+    //bootstrap-select wrappers of the Group #2 selects are replaced by the plain selects initialized again below
+    group_item.querySelectorAll('div.bootstrap-select').forEach(wrapper => {
+        let select = wrapper.querySelector('select')
+        select.classList.remove('bs-select-hidden')
+        Array.from(select.options).forEach(option => {option.selected = false})
+        wrapper.replaceWith(select)
+    })
+    group_item.querySelectorAll('input').forEach(input => {input.value = ''})
+    group_item.querySelectorAll('[id], [name], [for], [data-bs-target]').forEach(tag => {
+        for(const attr of ['id', 'name', 'for', 'data-bs-target']){
+            if(tag.hasAttribute(attr)){
+                tag.setAttribute(attr, tag.getAttribute(attr).replace(/(filterset|_filter|filters_subset)2$/, '$1'+ngroup))
+            }
+        }
+    })
+    group_item.querySelector('.accordion-header span').textContent = 'FILTERS GROUP #'+ngroup
+    group2_item.parentElement.appendChild(group_item)
+    $(group_item).find('select.selectpicker').selectpicker()
+}
+
 /**
  * The key function allowing to POST data from all data filters (the left control panel) via AJAX calls to the backend and 
  * extract Group #1 or unfiltered initial input data containing all fields as a CSV file that can be analyzed externally.
@@ -462,6 +504,16 @@ function postPlotData(source_call_id=null, extract_filtered_excel_data = false)
             }
         }
     }
+    if(document.getElementById('hs_path_filterset1') !== null && document.getElementById('hs_path_filterset1').value.trim() !== ''){
+        SelectedFieldsMap['datafilters2apply']['hs_path_filterset1']=document.getElementById('hs_path_filterset1').value.trim();
+    }
+    //wildcard pattern filters are sent as typed and matched against the field values on the server
+    var pattern_tags = $("#accordion_section_filters_subset1").find("input.filter_pattern");
+    for(var i=0; i<pattern_tags.length; i++){
+        if(pattern_tags[i].value.trim() !== ''){
+            SelectedFieldsMap['datafilters2apply'][pattern_tags[i].id]=pattern_tags[i].value.trim();
+        }
+    }
 
     let ids=['start_date_filterset1', 'start_date_filterset2','end_date_filterset1', 'end_date_filterset2']
     for (const id of ids){
@@ -480,7 +532,8 @@ function postPlotData(source_call_id=null, extract_filtered_excel_data = false)
 
 
     let groupby_values_array=$('#groupby_selector').selectpicker('option:selected').val();
-    let filters_group2_values=Array.from($("#accordion_section_filters_subset2").find("select")).map(i=>{return(i.value)}).filter(function(i){return i.length > 0})
+    //the added groups (Group #3 and on) follow the Group #2 rules
+    let filters_group2_values=Array.from($("#accordion_section_filters_subset2").find("select, input.filter_pattern")).concat(Array.from($(".filters_group_added").find("select, input.filter_pattern, input[type=date]"))).map(i=>{return(i.value.trim())}).filter(function(i){return i.length > 0})
 
     console.log(groupby_values_array)
     console.log(filters_group2_values)
@@ -508,6 +561,22 @@ function postPlotData(source_call_id=null, extract_filtered_excel_data = false)
                 $('#groupby_selector').selectpicker('val', null); //deactivate any groupby previously selected values when filters group 2 active
             }
         }
+        var pattern_tags2 = $("#accordion_section_filters_subset2").find("input.filter_pattern");
+        for (let i = 0; i < pattern_tags2.length; i++) {
+            if (pattern_tags2[i].value.trim() !== '') {
+                SelectedFieldsMap['datafilters2apply'][pattern_tags2[i].id] = pattern_tags2[i].value.trim();
+                $('#groupby_selector').selectpicker('val', null);
+            }
+        }
+        //added groups are posted with their filtersetN keys
+        $(".filters_group_added").find("select").each(function(){
+            $(this).val().forEach((value, j) => {SelectedFieldsMap['datafilters2apply'][this.id + '_' + j] = value})
+        })
+        $(".filters_group_added").find("input.filter_pattern, input[type=date]").each(function(){
+            if(this.value.trim() !== ''){
+                SelectedFieldsMap['datafilters2apply'][this.id] = this.value.trim()
+            }
+        })
     }
 
     console.log(SelectedFieldsMap)
@@ -725,6 +794,10 @@ function renderplots(graphsMap){
                 }
 
                 Plotly.react('plotDiv_' + key, JSON.parse(graphsMap['figures'][key]))
+                if(key === 'hierarchy_of_clusters_sunburst_chart'){
+                    document.getElementById('plotDiv_' + key).removeAllListeners('plotly_sunburstclick');
+                    document.getElementById('plotDiv_' + key).on('plotly_sunburstclick', filterSunburstNode);
+                }
                 generate_caption(graphsMap['captions'][key], 'plotDiv_' + key);
                 Plotly.update('plotDiv_' + key,{},{'margin':{l:1,r:1}});
                 
@@ -747,6 +820,22 @@ function renderplots(graphsMap){
 }
 
 
+/**
+ * Applies the hierarchical subtype path of a sunburst node clicked while holding the Shift key as Group #1 filter
+ * and re-renders plots on the node samples. Clicks without the Shift key keep the default sunburst zoom behaviour
+ * @param {Object} event - Plotly sunburst click event data storing the clicked node id (i.e. path such as 1/2/3)
+ * @returns {Boolean} - false to cancel the sunburst zoom on the filtered node
+ */
+function filterSunburstNode(event){
+    if(event.event.shiftKey === false || event.points.length === 0 || document.getElementById('hs_path_filterset1') === null){
+        return true;
+    }
+    document.getElementById('hs_path_filterset1').value = event.points[0].id;
+    postPlotData();
+    return false;
+}
+
+
 /**
  * Generates a caption by accessing a specified plot <div> with the plot. Creates a new caption in the <p> tag or replaces text if it already exists 
  * @param {String} caption - The text of a figure caption to add or replace
@@ -1,27 +1,26 @@
 from app import app
 from flask import request, render_template, flash, session, jsonify, Response
-from flask_caching import Cache
 from werkzeug.utils import secure_filename
 from werkzeug.wsgi import FileWrapper
 import pandas as pd
 import numpy as np
-from scipy.stats import pearsonr
-from openpyxl import load_workbook
+from scipy import sparse, special, stats
 from collections import Counter
+import multiprocessing
 
 # import modin.pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.utils
 from plotly.subplots import make_subplots
-import json, re, time, itertools
+import json, re, time, itertools, fnmatch
 import string, random
 from plotly.io.json import to_json_plotly
 from io import BytesIO
-
-
-
-cache = Cache(app=app, config={"CACHE_TYPE": "filesystem", 'CACHE_DIR': 'cache-dir', "CACHE_DEFAULT_TIMEOUT": 86400})
+from app.datastore import storeDataset, loadDataset, loadDatasetIndexes, loadPrefixIndex, loadDataCube, loadComponentMatrices, \
+    findPrefixRows, datasetColumns, deleteDatasets, datasetFingerprint, getCachedSelection, cacheSelection, getLastSelection, setLastSelection, selectionCacheStats, \
+    getCachedGrouping, cacheGrouping, datasetStorageUsage
+from app.ingest import ingestCSV, ingestXLSX
 
 
 
@@ -67,6 +66,8 @@ def extactFilterValuesFromPOST2Dict(form_filt_values_dict,setname='filterset1'):
     filter_dict['geoloc_id'] = list()
     filter_dict['source_site'] = list()
     filter_dict['source_type'] = list()
+    filter_dict['patterns'] = {} #wildcard patterns per expected variable {'expected variable':['ST131*',...]}
+    setname = setname + r'(?!\d)' #filterset1 keys only (not filterset10 keys)
 
     for formkey in form_filt_values_dict:
         print(formkey)
@@ -98,83 +99,492 @@ def extactFilterValuesFromPOST2Dict(form_filt_values_dict,setname='filterset1'):
             filter_dict['source_type'].append(form_filt_values_dict[formkey])
         elif re.match(r'select_geoloc_id_'+setname+'.*', formkey):
             filter_dict['geoloc_id'].append(form_filt_values_dict[formkey])
+        elif re.match(r'hs_path_'+setname+'$', formkey):
+            filter_dict['hs_path'] = form_filt_values_dict[formkey].split('/') #sunburst node id (e.g. 1/2/3)
+        elif re.match(r'pattern_(\w+)_'+setname+'$', formkey):
+            df_column_name = re.match(r'pattern_(\w+)_'+setname+'$', formkey).group(1)
+            patterns = [p.strip() for p in form_filt_values_dict[formkey].split(',') if p.strip()]
+            if df_column_name in filter_dict and patterns:
+                filter_dict['patterns'][df_column_name] = patterns
     return filter_dict
 
 
-def getFilteredData(filter_dict, df):
+def getDashboardColumns(column_names, form_data_dict):
+    '''
+    Select the session dataset columns needed to filter data and render the dashboard plots so that only these are read
+    from the session dataset store
+    Arguments:
+        column_names {list} - column names of the stored session dataset
+        form_data_dict {dict} - dictionary of the form data submitted by the EpiVizor frontend
+    Return:
+        {list} - column names to load or None to load all columns (i.e. validation screen submission or data export)
+    '''
+    if 'datafilters2apply' not in form_data_dict or 'get_excel_subset' in form_data_dict:
+        return None
+    dashboard_fields = ['primary_type', 'secondary_type', 'genetic_profile', 'phenotypic_profile', 'cluster_id',
+                        'investigation_id', 'source_type', 'source_site', 'geoloc_id', 'date', 'age', '__age_years', 'gender']
+    return [c for c in column_names if c in dashboard_fields or re.match(r"hs_level_\d+$", str(c))
+            or c == form_data_dict.get('groupby_selector_value')]
+
+
+def encodeCategorical(series):
+    '''
+    Dictionary encode a column of expected categorical variable into pandas categorical with sorted categories.
+    Missing values get the -1 code that is consistently displayed as "not specified" filter value
+    Arguments:
+        series {pandas series} - column values (text or numbers)
+    Return:
+        {pandas series} - categorical column or the original column if its values are neither text nor numbers
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype) or \
+            pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'integer', 'floating', 'empty'):
+        return series
+    return series.astype('category')
+
+
+def decodeCategoricals(df, columns=None):
+    '''
+    Copy dataframe columns converting categorical columns back to plain column values (text or numbers) for plot rendering.
+    Plot rendering functions modify their input data so each plot gets a private dataframe of only the columns it reads
+    instead of a copy of the whole dataframe
+    Arguments:
+        df {pandas dataframe} - dataframe with possibly categorical columns
+        columns {list} - names of the columns to copy (columns not in the dataframe are skipped) or None to copy all columns
+    Return:
+        df {pandas dataframe} - copy of the dataframe columns without categorical columns
+    '''
+    if columns is None:
+        positions = list(range(df.shape[1]))
+    else:
+        positions = [df.columns.get_loc(c) for c in dict.fromkeys(columns) if c in df.columns]
+    data = {}
+    for idx, position in enumerate(positions):
+        values = df.iloc[:, position]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            data[idx] = pd.Series(np.asarray(values), index=df.index)
+        else:
+            data[idx] = values.copy()
+    df_copy = pd.DataFrame(data, index=df.index)
+    df_copy.columns = df.columns[positions]
+    return df_copy
+
+
+def parseDates(series):
+    '''
+    Parse date field values into datetime64 column. Each distinct value is parsed only once and unparsable values become NaT
+    Arguments:
+        series {pandas series} - date values (e.g. 2021-03-01)
+    Return:
+        {pandas series} - datetime64 column
+    '''
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    codes, uniques = pd.factorize(series)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce')
+    if not pd.api.types.is_datetime64_dtype(parsed): #e.g. mixed time zones
+        return pd.to_datetime(series, errors='coerce')
+    return pd.Series(np.append(parsed.to_numpy(), np.datetime64('NaT'))[codes], index=series.index, name=series.name) #missing values code -1 maps to NaT
+
+
+def getFilterValues(series, dtype=str):
+    '''
+    List sorted distinct column values to populate filter selectors with missing values shown as "not specified".
+    Categorical columns are listed from their categories without scanning column values
+    Arguments:
+        series {pandas series} - column values
+        dtype {type} - type to cast values to
+    Return:
+        {list} - sorted distinct values
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = set(series.cat.categories.astype(dtype))
+        if (series.cat.codes.to_numpy() == -1).any():
+            values.add("not specified")
+        return sorted(values)
+    return sorted(set(series.fillna("not specified").astype(dtype)))
+
+
+def getValuesMatches(values_index, values, patterns=[], case=True):
+    '''
+    Match distinct string values (e.g. column categories) against the filter values and wildcard patterns
+    Arguments:
+        values_index {pandas index} - distinct string values
+        values {list} - filter values
+        patterns {list} - wildcard patterns (see fnmatch module)
+        case {bool} - case sensitive matching
+    Return:
+        {numpy array} - boolean mask of matched values
+    '''
+    if case == False:
+        values_index, values = values_index.str.lower(), [str(value).lower() for value in values]
+    selected = np.asarray(values_index.isin(values), dtype=bool)
+    if patterns:
+        regex = '|'.join([fnmatch.translate(pattern) for pattern in patterns])
+        selected |= np.asarray(values_index.str.match(regex, case=case), dtype=bool)
+    return selected
+
+
+def getFilterCodes(series, values, patterns=[], case=True):
+    '''
+    Find the dictionary codes of the categorical column categories equal to the filter values or matching the wildcard patterns.
+    Categories are compared as strings and missing values (code -1) are selected by the "not specified" filter value or pattern.
+    Patterns are matched once per category so the cost depends on the column cardinality rather than on the number of rows
+    Arguments:
+        series {pandas series} - categorical column values
+        values {list} - filter values (e.g. ['B.1.1.7','B.1.1.529'])
+        patterns {list} - wildcard patterns with * matching any characters and ? any single character (e.g. ['ST131*'])
+        case {bool} - case sensitive matching
+    Return:
+        {numpy array} - codes of matched categories
+    '''
+    categories = series.cat.categories.astype(str)
+    selected = getValuesMatches(categories, values, patterns, case)
+    codes = np.flatnonzero(selected)
+    if getValuesMatches(pd.Index(["not specified"]), values, patterns, case)[0]:
+        codes = np.append(-1, codes)
+    return codes
+
+
+def getFilterBitmap(series, values, index=None, case=True, patterns=[]):
+    '''
+    Select column rows equal to any of the filter values or matching any of the wildcard patterns as a boolean row bitmap.
+    Categorical columns are matched on their categories only and matched rows are looked up in the column inverted index
+    (see loadDatasetIndexes()) without scanning the column values. Missing values are selected by the "not specified" filter value
+    Arguments:
+        series {pandas series} - column values of the whole dataset
+        values {list} - filter values (e.g. ['B.1.1.7','B.1.1.529'])
+        index {tuple} - column inverted index (order, offsets) or None to match the column codes instead
+        case {bool} - case sensitive matching
+        patterns {list} - wildcard patterns (e.g. ['ST131*', 'O157:*'])
+    Return:
+        {numpy array} - boolean mask of matched rows
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype) == False:
+        codes, uniques = pd.factorize(series.fillna("not specified").astype(str))
+        return getValuesMatches(pd.Index(uniques), values, patterns, case)[codes]
+
+    codes = getFilterCodes(series, values, patterns, case)
+    if index is None or len(index[0]) != series.shape[0]:
+        return np.isin(series.cat.codes.to_numpy(), codes)
+    order, offsets = index
+    bitmap = np.zeros(series.shape[0], dtype=bool)
+    for code in codes:
+        bitmap[order[offsets[code+1]:offsets[code+2]]] = True
+    return bitmap
+
+
+def getDateRangeBitmap(dates, start_date=None, end_date=None, index=None):
+    '''
+    Select rows with dates within the inclusive date range as a boolean row bitmap. Rows with missing dates are never selected.
+    With the column sorted index (see loadDatasetIndexes()) the range is found by binary search on the sorted dates
+    and rows are looked up from the index slice without scanning the column values
+    Arguments:
+        dates {pandas series} - date values of the whole dataset
+        start_date {string} - range start date (e.g. 20210101) or None for an open range
+        end_date {string} - range end date (e.g. 20211231) or None for an open range
+        index {tuple} - column sorted index (order, values) or None to compare the column values instead
+    Return:
+        {numpy array} - boolean mask of selected rows
+    '''
+    start = np.datetime64(pd.Timestamp(start_date)) if start_date else None
+    end = np.datetime64(pd.Timestamp(end_date)) if end_date else None
+    if index is None or pd.api.types.is_datetime64_dtype(dates) == False or index[1].dtype != dates.dtype:
+        dates = parseDates(dates).to_numpy()
+        bitmap = ~np.isnat(dates)
+        if start is not None:
+            bitmap &= dates >= start
+        if end is not None:
+            bitmap &= dates <= end
+        return bitmap
+
+    order, values = index
+    lo = np.searchsorted(values, start, side='left') if start is not None else 0
+    hi = np.searchsorted(values, end, side='right') if end is not None else len(values)
+    bitmap = np.zeros(dates.shape[0], dtype=bool)
+    bitmap[order[lo:hi]] = True
+    return bitmap
+
+
+def getHierarchyPathBitmap(df, path, prefix_index=None):
+    '''
+    Select rows of a hierarchical subtype path prefix (e.g. the 1/2/3 sunburst node id) as a boolean row bitmap.
+    With the prefix tree index (see loadPrefixIndex()) the node rows are found by walking down the tree
+    from the top level without scanning the hs_level_X columns
+    Arguments:
+        df {pandas dataframe} - dataframe of the whole dataset with hs_level_X columns
+        path {list} - path values from the top level (hs_level_0) down (e.g. ['1','2','3'])
+        prefix_index {dict} - prefix tree index of the hs_level_X columns or None to match the columns values instead
+    Return:
+        {numpy array} - boolean mask of selected rows
+    '''
+    hier_column_names = ["hs_level_" + str(level) for level in range(0, len(path))]
+    bitmap = np.zeros(df.shape[0], dtype=bool)
+    if any([c not in df.columns for c in hier_column_names]):
+        return bitmap
+    if prefix_index is None or prefix_index['columns'][:len(path)] != hier_column_names or \
+            len(prefix_index['order']) != df.shape[0] or \
+            any([isinstance(df[c].dtype, pd.CategoricalDtype) == False for c in hier_column_names]):
+        bitmap[:] = True
+        for column, value in zip(hier_column_names, path):
+            bitmap &= getFilterBitmap(df[column], [value])
+        return bitmap
+
+    codes = [df[column].cat.categories.astype(str).get_indexer([value])[0] for column, value in zip(hier_column_names, path)]
+    if min(codes, default=0) == -1: #path value not found
+        return bitmap
+    bitmap[findPrefixRows(prefix_index, codes)] = True
+    return bitmap
+
+
+def getFilterSpec(filter_dict):
+    '''
+    Canonical filter specification identifying the data selected by the filters regardless of the order values were selected in.
+    Empty filters are omitted and values are sorted (except for the hierarchical subtype path)
+    Arguments:
+        filter_dict {dict} - dictionary with filter values (see extactFilterValuesFromPOST2Dict())
+    Return:
+        {string} - JSON text of the canonical filter specification
+    '''
+    spec = {}
+    for key, value in filter_dict.items():
+        if not value:
+            continue
+        if key == 'patterns':
+            value = {field: sorted(patterns) for field, patterns in value.items()}
+        elif isinstance(value, list) and key != 'hs_path':
+            value = sorted(set(map(str, value)))
+        spec[key] = value
+    return json.dumps(spec, sort_keys=True)
+
+
+def getSelectionBitmap(filter_dict, df, indexes={}, prefix_index=None):
+    '''
+    Evaluate the filters on the input dataframe rows. Each filter is evaluated to a row bitmap and the bitmaps are
+    combined (hierarchical subtype levels by OR, other filters by AND)
+    Arguments:
+        filter_dict {dict} - dictionary with filter values (see getFilteredData())
+        df {pandas dataframe} - dataframe to be filtered on
+        indexes {dict} - indexes of the dataframe categorical and date columns (see loadDatasetIndexes())
+        prefix_index {dict} - prefix tree index of the hierarchical subtype levels (see loadPrefixIndex())
+    Return:
+        {numpy array} - boolean mask of selected rows
+    '''
+    selected = np.ones(df.shape[0], dtype=bool)
+
+    hs_filters = [key for key in filter_dict if 'hs_level' in key and filter_dict[key]]
+    if hs_filters:
+        print("Hierarchical subtype filter for the sunburst plot is being applied on", df.shape)
+        hs_selected = np.zeros(df.shape[0], dtype=bool)
+        for selected_hs_filter in hs_filters:
+            hs_selected |= getFilterBitmap(df[selected_hs_filter], filter_dict[selected_hs_filter], indexes.get(selected_hs_filter))
+        selected &= hs_selected
+        print(f"After hierarchical cluster code filter left {np.count_nonzero(selected)} rows")
+
+    if filter_dict.get('hs_path'):
+        print("Hierarchical subtype path {} filter is being applied".format('/'.join(filter_dict['hs_path'])))
+        selected &= getHierarchyPathBitmap(df, filter_dict['hs_path'], prefix_index)
+
+    #The expected variables filters
+    for field in ['primary_type', 'secondary_type', 'genetic_profile', 'phenotypic_profile', 'cluster_id',
+                  'investigation_id', 'source_site', 'source_type', 'geoloc_id']:
+        if filter_dict[field] or field in filter_dict.get('patterns', {}):
+            selected &= getFilterBitmap(df[field], filter_dict[field], indexes.get(field), case=False,
+                                        patterns=filter_dict.get('patterns', {}).get(field, []))
+
+    #Date range filter (dates already parsed at mapping time)
+    if 'date' in df.columns:
+        if filter_dict['start_date'] or filter_dict['end_date']:
+            print("date >= {} and date <= {}".format(filter_dict['start_date'], filter_dict['end_date']))
+            selected &= getDateRangeBitmap(df['date'], filter_dict['start_date'], filter_dict['end_date'], indexes.get('date'))
+    elif filter_dict['start_date'] or filter_dict['end_date']:
+        print('WARNING: the date field "date" not mapped or available so date filtering (if selected) was not applied!')
+    return selected
+
+
+def getFilterRefinement(previous_dict, filter_dict):
+    '''
+    Compare filters with the previously applied ones and find the filters narrowing down the previous data selection.
+    Filters are a refinement if every previous filter is kept or narrowed (i.e. a subset of values and patterns,
+    a shorter date range or a longer hierarchical subtype path) and new filters are only added
+    Arguments:
+        previous_dict {dict} - dictionary with previously applied filter values (see extactFilterValuesFromPOST2Dict())
+        filter_dict {dict} - dictionary with filter values to apply
+    Return:
+        {dict} - dictionary with the changed filter values only or None if filters do not narrow down the previous selection
+    '''
+    refinement = extactFilterValuesFromPOST2Dict({})
+
+    #hierarchical subtype levels are combined by OR so they can only be added or kept
+    previous_hs = {key: sorted(values) for key, values in previous_dict.items() if 'hs_level' in key and values}
+    current_hs = {key: sorted(values) for key, values in filter_dict.items() if 'hs_level' in key and values}
+    if previous_hs != current_hs:
+        if previous_hs:
+            return None
+        refinement.update(current_hs)
+
+    previous_path, current_path = previous_dict.get('hs_path') or [], filter_dict.get('hs_path') or []
+    if previous_path != current_path:
+        if current_path[:len(previous_path)] != previous_path:
+            return None
+        refinement['hs_path'] = current_path
+
+    for field in ['primary_type', 'secondary_type', 'genetic_profile', 'phenotypic_profile', 'cluster_id',
+                  'investigation_id', 'source_site', 'source_type', 'geoloc_id']:
+        previous_values, current_values = set(map(str, previous_dict[field])), set(map(str, filter_dict[field]))
+        previous_patterns = set(previous_dict.get('patterns', {}).get(field, []))
+        current_patterns = set(filter_dict.get('patterns', {}).get(field, []))
+        if (previous_values, previous_patterns) == (current_values, current_patterns):
+            continue
+        if previous_values or previous_patterns:
+            if not (current_values or current_patterns) or not (current_values <= previous_values and current_patterns <= previous_patterns):
+                return None
+        refinement[field] = sorted(current_values)
+        if current_patterns:
+            refinement['patterns'][field] = sorted(current_patterns)
+
+    #dates are compared as YYYYMMDD text
+    if previous_dict['start_date'] != filter_dict['start_date']:
+        if filter_dict['start_date'] is None or (previous_dict['start_date'] or '') > filter_dict['start_date']:
+            return None
+        refinement['start_date'] = filter_dict['start_date']
+    if previous_dict['end_date'] != filter_dict['end_date']:
+        if filter_dict['end_date'] is None or (previous_dict['end_date'] is not None and previous_dict['end_date'] < filter_dict['end_date']):
+            return None
+        refinement['end_date'] = filter_dict['end_date']
+    return refinement
+
+
+def getFilteredData(filter_dict, df, indexes={}, prefix_index=None, dataset_key=None, group=None, columns=None):
     '''
     Filter input dataframe based on the parsed POST dictionary values from EpiVizor frontend filters and obtain new filtered dataframe
-    Usually applied to further filter the original input data or to create Group #1 and #2 subsets for comparison purposes
+    Usually applied to further filter the original input data or to create Group #1 and #2 subsets for comparison purposes.
+    Each filter is evaluated to a row bitmap (hierarchical subtype levels are combined by OR, other filters by AND)
+    and the dataframe rows are selected once from the final bitmap.
+    For stored datasets the selected rows are cached. If the filters narrow down the previous selection of the same group,
+    only the changed filters are evaluated on the previously selected rows
     
     Arguments:
         filter_dict {dict} - dictionary with filter values of form {'expected variable':[val1,val2,....]}.
                             For example, {'primary_type': ['B.1.1.529', 'B.1.1.7'], ...}
         df {pandas dataframe} - dataframe to be filtered on
+        indexes {dict} - indexes of the dataframe categorical and date columns (see loadDatasetIndexes())
+        prefix_index {dict} - prefix tree index of the hierarchical subtype levels (see loadPrefixIndex())
+        dataset_key {tuple} - (session id, dataset fingerprint) of the stored dataset to look up and cache the selected rows
+                              in the selection cache or None to always evaluate the filters
+        group {string} - filters group name (e.g. filterset1) to track the previous selection of
+        columns {list} - columns of the selected rows to return (e.g. leaving out the columns counted by the data cube).
+                         All columns if None
     Return: 
         df {pandas dataframe} - resulting filtered dataframe according to the supplied filters
     '''
     print(f"getFilteredData() and {','.join(df.columns.to_list())}")
-    
-    #convert values to REGEX safe equivalents such as 'B\\.1\\.1\\.7 instead of B.1.1.7 where dot is everything
-    regex_characters=['\.','\+','\*','\?','\^','\$','\(','\)','\[','\]','\|','\{','\}']
-    for variable in [key for key,value in filter_dict.items() if filter_dict[key] is not None]:
-            if isinstance(filter_dict[variable],list):
-                for character in regex_characters:
-                    filter_dict[variable] = [re.sub(character,'\\'+character,i) for i in filter_dict[variable]]
-            else:
-                for character in regex_characters:
-                    filter_dict[variable] = re.sub(character,'\\'+character,filter_dict[variable])
-    hs_idx_final=[]
-    for selected_hs_filter in [key for key in filter_dict if 'hs_level' in key]:
-        print("Hierarchical subtype filter for the sunburst plot is being applied on", df.shape)
-        regex = '|'.join(filter_dict[selected_hs_filter])
-        idx_bool = (df.loc[:,selected_hs_filter].str.fullmatch(regex) ).to_list()
-        if not hs_idx_final:
-            hs_idx_final = idx_bool
-        else:
-            hs_idx_final = [any(tup) for  tup in zip(idx_bool,hs_idx_final)]
-          
-    if hs_idx_final:
-        df = df.loc[hs_idx_final,:].copy()
-        print(f"After hierarchical cluster code filter left {df.shape[0]} rows")   
+    columns = slice(None) if columns is None else df.columns.get_indexer(columns)
+    if dataset_key is None:
+        df = df.iloc[np.flatnonzero(getSelectionBitmap(filter_dict, df, indexes, prefix_index)), columns]
+        print("After filtering {}".format(df.shape))
+        return df
 
-    #The expected variables filters
-    if filter_dict['primary_type']:
-        df = df.loc[(df['primary_type'].str.fullmatch('|'.join(filter_dict['primary_type']), case=False, na=False))].copy()
-    if filter_dict['secondary_type']:
-        df = df.loc[(df['secondary_type'].str.fullmatch('|'.join(filter_dict['secondary_type']), case=False, na=False))].copy()
-    if filter_dict['genetic_profile']:
-        df = df.loc[(df['genetic_profile'].str.fullmatch("|".join(filter_dict['genetic_profile']), case=False, na=False))].copy()
-    if filter_dict['phenotypic_profile']:
-        df = df.loc[(df['phenotypic_profile'].str.fullmatch("|".join(filter_dict['phenotypic_profile']), case=False, na=False))].copy()
-    if filter_dict['cluster_id']:
-        df = df.loc[(df['cluster_id'].str.fullmatch('|'.join(filter_dict['cluster_id']), case=False, na=False))].copy()
-    if filter_dict['investigation_id']:
-        df = df.loc[(df['investigation_id'].str.fullmatch('|'.join(filter_dict['investigation_id']), case=False, na=False))].copy()
-    if filter_dict['source_site']:
-        df = df.loc[(df['source_site'].str.fullmatch("|".join(filter_dict['source_site']), case=False, na=False))].copy()
-    if filter_dict['source_type']:
-        df = df.loc[(df['source_type'].str.fullmatch("|".join(filter_dict['source_type']), case=False, na=False))].copy()
-    if filter_dict['geoloc_id']:
-        df = df.loc[(df['geoloc_id'].str.fullmatch("|".join(filter_dict['geoloc_id']), case=False, na=False))].copy()
-
-    #Date range filter
-    if 'date' in df.columns:
-        df.loc[:,'date']=pd.to_datetime(df['date'],errors='coerce')
-        if filter_dict['start_date'] and filter_dict['end_date']:
-            print("date >= " + filter_dict['start_date'] + " and date <= " + filter_dict['end_date'])
-            df.query("date >= " + filter_dict['start_date'] + " and date <= " + filter_dict['end_date'], inplace=True)
-        elif filter_dict['start_date'] and filter_dict['end_date'] is None:
-            df.query("date >= " + filter_dict['start_date'], inplace=True)
-        elif filter_dict['start_date'] is None and filter_dict['end_date']:
-            df.query("date <= " + filter_dict['end_date'], inplace=True)
-    else:
-        print('WARNING: the date field "date" not mapped or available so date filtering (if selected) was not applied!')
-        
+    df = df.iloc[getSelectionPositions(filter_dict, df, indexes, prefix_index, dataset_key, group), columns]
     print("After filtering {}".format(df.shape))
     return df
 
 
+def getSelectionPositions(filter_dict, df, indexes={}, prefix_index=None, dataset_key=None, group=None):
+    '''
+    Row positions of the stored dataset rows selected by the filters looked up in the selection cache (see getFilteredData()).
+    If not cached and the filters narrow down the previous selection of the same group, only the changed filters are
+    evaluated on the previously selected rows
+    Arguments:
+        filter_dict {dict} - dictionary with filter values (see extactFilterValuesFromPOST2Dict())
+        df {pandas dataframe} - stored dataset with the filtered columns
+        indexes {dict} - indexes of the dataframe categorical and date columns (see loadDatasetIndexes())
+        prefix_index {dict} - prefix tree index of the hierarchical subtype levels (see loadPrefixIndex())
+        dataset_key {tuple} - (session id, dataset fingerprint) of the stored dataset
+        group {string} - filters group name (e.g. filterset1) to track the previous selection of
+    Return:
+        positions {numpy array} - positions of the selected rows
+    '''
+    spec = getFilterSpec(filter_dict)
+    positions = getCachedSelection(*dataset_key, spec)
+    if positions is not None:
+        print("Filtered {} rows found in the selection cache".format(positions.size))
+    else:
+        previous_spec, previous_positions = getLastSelection(*dataset_key, group) if group else (None, None)
+        refinement = None
+        if previous_spec is not None:
+            previous_dict = extactFilterValuesFromPOST2Dict({})
+            previous_dict.update(json.loads(previous_spec))
+            refinement = getFilterRefinement(previous_dict, filter_dict)
+        if refinement is not None:
+            print("Refining the previous selection of {} rows with the changed filters".format(previous_positions.size))
+            columns = [c for c, values in refinement.items() if values and c in df.columns] + list(refinement['patterns']) + \
+                      ["hs_level_" + str(level) for level in range(0, len(refinement.get('hs_path') or []))] + \
+                      (['date'] if refinement['start_date'] or refinement['end_date'] else [])
+            columns = [c for c in dict.fromkeys(columns) if c in df.columns]
+            df_selected = df.iloc[previous_positions, df.columns.get_indexer(columns)]
+            positions = previous_positions[getSelectionBitmap(refinement, df_selected)]
+        else:
+            positions = np.flatnonzero(getSelectionBitmap(filter_dict, df, indexes, prefix_index))
+        cacheSelection(*dataset_key, spec, positions)
+    if group:
+        setLastSelection(*dataset_key, group, spec)
+    return positions
+
+
+def getSelectionGrouping(df, column, filter_dict, ngroups=10):
+    '''
+    Group codes of the selected rows shared by all plots rendered in group by mode (see getGroupCodes()). The grouping is
+    cached with the filtered selection so plots and subsequent requests on the same selection do not rank the groups again
+    Arguments:
+        df {pandas dataframe} - selected rows of the session dataset (Group #1)
+        column {string} - group by field name
+        filter_dict {dict} - filter values the rows were selected with (see extactFilterValuesFromPOST2Dict())
+        ngroups {int} - number of the most numerous values kept as groups
+    Return:
+        {tuple} - (codes, groups, other) grouping of the selected rows
+    '''
+    dataset_key = (session['id'], session['dataset_fingerprint'])
+    spec, key = getFilterSpec(filter_dict), '{}[:{}]'.format(column, ngroups)
+    grouping = getCachedGrouping(*dataset_key, spec, key)
+    if grouping is None:
+        grouping = getGroupCodes(df[column], ngroups)
+        cacheGrouping(*dataset_key, spec, key, *grouping)
+    return grouping
+
+
+def getFilterGroups(form_filt_values_dict, max_groups=10):
+    '''
+    Filter groups submitted by the EpiVizor frontend. Group #1 is always present as the primary data selection
+    Arguments:
+        form_filt_values_dict {dict} - filter values submitted by the frontend ('datafilters2apply')
+        max_groups {int} - number of groups kept (groups with the lowest numbers) or None to keep all groups
+    Return:
+        {list} - filter group names ordered by group number (e.g. ['filterset1', 'filterset2', 'filterset3'])
+    '''
+    numbers = {int(match.group(1)) for match in [re.search(r'filterset(\d+)', key) for key in form_filt_values_dict] if match}
+    return ['filterset{}'.format(number) for number in sorted(numbers | {1}) if number > 0][:max_groups]
+
+
+def getGroupsSelection(df, positions, names):
+    '''
+    Rows of all filter groups stacked into one dataframe with the group of each row in the 'filter group' column. The
+    N groups comparison is rendered by the group by mode plots, so every plot aggregates all groups in a single pass over
+    the group codes instead of filtering and aggregating each group separately. Rows selected by several groups are
+    repeated once per group
+    Arguments:
+        df {pandas dataframe} - session dataset
+        positions {list} - selected row positions of each group (see getSelectionPositions())
+        names {list} - group names
+    Return:
+        df {pandas dataframe} - stacked rows of the groups
+        grouping {tuple} - (codes, groups, other) grouping of the stacked rows (see getGroupCodes())
+    '''
+    codes = np.repeat(np.arange(len(positions), dtype=np.int16), [len(group_positions) for group_positions in positions])
+    df = df.iloc[np.concatenate(positions)].reset_index(drop=True)
+    df['filter group'] = pd.Categorical.from_codes(codes, names)
+    return df, (codes, list(names), '')
+
+
 def renderPlotsFromDict(metadata, form_dict, df):
     """Renders Plotly figure objects for the custom plots view from the input data and returns 
 
@@ -307,7 +717,8 @@ def clearsession():
     Returns:
         {string}: 'success' string upon completion
     """
-    # cache.clear()
+    if 'id' in session:
+        deleteDatasets(session['id'])
     session.clear()
     session.pop('_flashes', None)
     session['filename'] = "NA"
@@ -315,6 +726,68 @@ def clearsession():
     return 'success'
 
 
+@app.route('/selectioncache', methods=['GET'])
+def selectioncache():
+    """Reports the filtered data selection cache statistics of the worker process serving the request
+
+    Returns:
+        {json}: numbers of cache hits, misses, evictions and cached selections, cached bytes and the memory limit
+    """
+    return jsonify(selectionCacheStats())
+
+
+@app.route('/datasetstorage', methods=['GET'])
+def datasetstorage():
+    """Reports the dataset storage usage on disk (see datasetStorageUsage()) without revealing other session identifiers
+
+    Returns:
+        {json}: stored dataset bytes of the requesting session, number of sessions with stored datasets and their total bytes
+    """
+    usage = datasetStorageUsage()
+    return jsonify({'session_bytes': usage.get(session.get('id'), 0), 'sessions': len(usage), 'total_bytes': sum(usage.values())})
+
+
+@app.route('/enrichment', methods=['POST'])
+def enrichment():
+    """Scans every categorical column and profile component of the session dataset for categories enriched in the Group #1
+    selection compared to the Group #2 selection. The selections are given by the same 'datafilters2apply' filters as the
+    dashboard POST requests (and are served from the selection cache when already rendered)
+
+    Returns:
+        {json}: numbers of Group #1 and #2 samples, number of tested categories and the ENRICHMENT_MAX_RESULTS top ranked
+                categories with their counts, odds ratio, test, p-value and FDR q-value (see getEnrichmentStatistics())
+    """
+    form_data_dict = request.form.to_dict()
+    form_data_dict['datafilters2apply'] = json.loads(form_data_dict.get('datafilters2apply', '{}'))
+    column_names = None
+    if 'id' in session and 'dataset_fingerprint' in session:
+        column_names = datasetColumns(session['id'], session['dataset_fingerprint'])
+    if column_names is None:
+        return jsonify({'error': 'ERROR: No data present. Upload your data file for enrichment analysis'})
+    if not [k for k in form_data_dict['datafilters2apply'] if re.match(r'.+filterset2(?!\d)', k)]:
+        return jsonify({'error': 'ERROR: Group #2 filter(s) are required for enrichment analysis'})
+
+    dataset_key = (session['id'], session['dataset_fingerprint'])
+    # every stored text column (mapped or not) is scanned except the unique sample identifiers and the derived columns
+    scan_columns = [c for c in datasetColumns(*dataset_key, kind='dictionary') if c != 'sample_id' and not str(c).startswith('__')]
+    df = loadDataset(*dataset_key, columns=(getDashboardColumns(column_names, form_data_dict) or column_names) + scan_columns,
+                     categorical=True)
+    indexes = loadDatasetIndexes(*dataset_key, df.columns.to_list())
+    prefix_index = loadPrefixIndex(*dataset_key)
+    positions = {}
+    for group in ['filterset1', 'filterset2']:
+        filter_dict = extactFilterValuesFromPOST2Dict(form_data_dict['datafilters2apply'], group)
+        positions[group] = getSelectionPositions(filter_dict, df, indexes, prefix_index, dataset_key, group)
+    counts = getEnrichmentCounts(df.loc[:, df.columns.isin(scan_columns)], positions['filterset1'], positions['filterset2'],
+                                 loadComponentMatrices(*dataset_key))
+    statistics = getEnrichmentStatistics(counts)
+    print("Enrichment scan of {} categories in {} vs {} samples".format(statistics.shape[0], len(positions['filterset1']),
+                                                                        len(positions['filterset2'])))
+    return jsonify({'group1_samples': int(len(positions['filterset1'])), 'group2_samples': int(len(positions['filterset2'])),
+                    'tests': int(statistics.shape[0]),
+                    'results': statistics.head(app.config.get('ENRICHMENT_MAX_RESULTS', 1000)).to_dict(orient='records')})
+
+
 @app.route('/', methods=['GET', 'POST'])
 def dashboard():
     """The main EpiVizor entrypoint function to process all frontend requests.
@@ -349,8 +822,8 @@ def dashboard():
     form_data_dict = request.form.to_dict()  # convert form data from frontend to a dictionary
     
 
-    if form_data_dict == {}:
-        clearsession() #clear any session cookies that might be left over on first page load (detected by no filters applied yet)  
+    if form_data_dict == {} or 'file' in request.files:
+        clearsession() #clear any session cookies that might be left over on first page load (detected by no filters applied yet) or on new file upload
 
     if 'datafilters2apply' in form_data_dict:
         form_data_dict['datafilters2apply'] = json.loads(form_data_dict['datafilters2apply'])
@@ -360,7 +833,13 @@ def dashboard():
 
     print("Request dict form-data: {}".format(form_data_dict))
 
-    if 'id' not in session or cache.get('df_dashboard') is None:
+    df = None
+    if 'id' in session and 'dataset_fingerprint' in session:
+        column_names = datasetColumns(session['id'], session['dataset_fingerprint'])
+        if column_names is not None:
+            df = loadDataset(session['id'], session['dataset_fingerprint'],
+                             columns=getDashboardColumns(column_names, form_data_dict))
+    if 'id' not in session or df is None:
         session['id'] = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10))
         session['filename'] = "NA"
   
@@ -377,7 +856,8 @@ def dashboard():
         else:
             raise ValueError("unsupported file extension for file {}".format(filename))
 
-        metadata_dict, upload_errors = uploadvalidatedata(request.files['file'], extension)
+        metadata_dict, upload_errors = uploadvalidatedata(request.files['file'], extension,
+                                                          sheet=form_data_dict.get('xlsx_sheet', '').strip() or None)
         session['filename'] = secure_filename(request.files['file'].filename)
         print("rendering splash screen after file upload to the server ...")
 
@@ -413,9 +893,7 @@ def dashboard():
             )
         
 
-    if request.method == 'POST' and isinstance(cache.get('df_dashboard'), type(pd.DataFrame())) == False: #if session expired
-        print(cache.get('df_dashboard'), type(cache.get('df_dashboard')))
-        print(isinstance(cache.get('df_dashboard'), type(pd.DataFrame)))
+    if request.method == 'POST' and isinstance(df, pd.DataFrame) == False: #if session expired
         print("Session expired and initial df is not available anymore")
         flash("Session expired and initial df is not available anymore")
         return render_template(
@@ -431,10 +909,9 @@ def dashboard():
         )
 
     # process POST request
-    if request.method == 'POST' and (isinstance(cache.get('df_dashboard'), type(pd.DataFrame())) == True
-                                     or request.form.to_dict() != {}) and cache.get("df_dashboard").empty == False:  # and session['filename'] == "NA"
-        df = cache.get("df_dashboard")
+    if request.method == 'POST' and df.empty == False:
         df2 = pd.DataFrame() #to hold second filtered subset data if filters applied
+        df_sunburst, groups_grouping = None, None #Group #1 rows and stacked rows grouping if more than two groups are compared
         print("Method POST:", isinstance(df, pd.DataFrame))
     
         ## RENAME DATAFRAME FIELDS ACCORDING 2 VALIDATION SCREEN MAPPINGS
@@ -444,6 +921,7 @@ def dashboard():
 
         if 'validatedfields_exp2obs_map' in form_data_dict:
             print("Renaming dataframe according to validation screen values mapping dictionary ...")
+            df = df.copy(deep=False) #columns loaded from the session dataset store are read-only memory maps so do not modify them in place
             
             # Delete fields that were not selected in validation screen (i.e. blank selection)
             df.drop(columns=[k for k, v in form_data_dict['validatedfields_exp2obs_map'].items() if v == 'notselected'],
@@ -492,11 +970,25 @@ def dashboard():
                     flash('Hierarchial substype plot() could not split using the selected delimiter {}'.
                           format(session['delimiter_symbol']))
 
+            # dictionary encode the categorical expected variables so filters run on integer codes instead of strings
+            categorical_fields = ['primary_type', 'secondary_type', 'genetic_profile', 'phenotypic_profile', 'cluster_id',
+                                  'investigation_id', 'source_type', 'source_site', 'geoloc_id', 'gender', 'hierarchical_subtype']
+            for idx in [idx for idx, c in enumerate(df.columns) if c in categorical_fields or re.match(r"hs_level_\d+$", c)]:
+                df.isetitem(idx, encodeCategorical(df.iloc[:, idx]))
+
+            # parse dates once instead of parsing text dates on every request. The epidemiological curve derives its
+            # weeks, months and years from the weekly bins of the selected dates (see getEpiCurveSeries())
+            if 'date' in df.columns:
+                df['date'] = parseDates(df['date'])
+            # parse age once into completed years the age plot bins are counted from
+            if 'age' in df.columns:
+                df['__age_years'] = getAgeYears(df)
+
 
         df_column_names = df.columns.to_list()
         # proceed with POST if dataframe is available
         if isinstance(df, pd.DataFrame):
-            df_column_names = df.columns.to_list()  # update with new appended new columns
+            df_column_names = [c for c in df.columns if not str(c).startswith('__')]  # update with new appended new columns (except derived ones)
 
             # CASTING field values if needed using the following positional fields in each tuple: (filter_field, df_field, dtype)
             # FORMAT: filter field in html; df_field dataframe field; dtype data type as per pandas
@@ -513,8 +1005,7 @@ def dashboard():
                 try:
                     if df_field in df_column_names:
                         # populate filters based on specific fields
-                        filter_fields2values_dict[filter_field] = sorted(
-                            set(df[df_field].fillna("not specified").astype(dtype)))
+                        filter_fields2values_dict[filter_field] = getFilterValues(df[df_field], dtype)
                 except Exception as e:
                     print(filter_field, df_field, dtype)
                     print(e)
@@ -530,9 +1021,19 @@ def dashboard():
                         filters_fields2values_dict=filter_fields2values_dict,
                         render_splash_screen = False
                     )
-            cache.delete('df_dashboard')
-            cache.add('df_dashboard', df, timeout=0)
-            print("Added dataframe to session cache with {} rows".format(df.shape[0]))
+            if 'validatedfields_exp2obs_map' in form_data_dict:
+                session['dataset_fingerprint'] = datasetFingerprint(session['dataset_fingerprint'],
+                                                                    json.dumps(form_data_dict['validatedfields_exp2obs_map'], sort_keys=True),
+                                                                    session.get('delimiter_symbol'))
+                hier_column_names = sorted([c for c in df.columns if re.match(r"hs_level_\d+$", str(c)) and
+                                            isinstance(df[c].dtype, pd.CategoricalDtype)], key=lambda c: int(c[9:]))
+                # profile columns are parsed into component matrices once (see renderBarComponentsPlot())
+                components = {column: getComponentMatrix(df[column].cat.categories, session['delimiter_symbol']) + (session['delimiter_symbol'],)
+                              for column in ['genetic_profile', 'phenotypic_profile'] if column in df.columns and
+                              isinstance(df[column].dtype, pd.CategoricalDtype) and session.get('delimiter_symbol')}
+                storeDataset(session['id'], session['dataset_fingerprint'], df, hierarchy=hier_column_names,
+                             cube_dimensions=getDataCubeDimensions(df), components=components)
+                print("Added dataframe to session dataset store with {} rows".format(df.shape[0]))
 
 
         if isinstance(df, pd.DataFrame) == False:
@@ -543,6 +1044,16 @@ def dashboard():
         # Parse filters data submitted by POST request
         # Parse multiple selections (if any) per variable
         # Filter dataframe and send it for rendering
+        group_filters = {} #filter values of each filters group applied to the data
+        # histogram and age plots consume the counts of a single aggregation pass over the selected rows of each group.
+        # Counts of the data cube dimensions are answered by the cube when the group filters are covered by it,
+        # so these columns are left out of the selected rows (except the group by field read by the other plots)
+        hist_columns = ['geoloc_id', 'gender', 'source_type', 'source_site', 'primary_type', 'secondary_type',
+                        'genetic_profile', 'phenotypic_profile', 'cluster_id', 'investigation_id']
+        cube = loadDataCube(session['id'], session['dataset_fingerprint'])
+        aggregates, aggregates2, age_counts = {}, {}, {}
+        rowColumns = lambda df, counts, age_counts: [c for c in df.columns if c == form_data_dict.get('groupby_selector_value') or
+                                                     (c not in counts and (age_counts is None or c not in ['age', '__age_years']))]
         if 'datafilters2apply' in form_data_dict and form_data_dict['datafilters2apply'] != {}:
             print("Applying new filters to data")
             form_filt_values_dict = form_data_dict['datafilters2apply']
@@ -551,13 +1062,37 @@ def dashboard():
             # STARTING DATA FILTERING ON POST VALUES
             # REGEX as multiple values could be selected in filters
             # Sort keys finding which belong to which set
-            filterKeysSet2 = [k for k in form_filt_values_dict if re.match(r'.+filterset2',k)]
-            if filterKeysSet2:
+            filterKeysSet2 = [k for k in form_filt_values_dict if re.match(r'.+filterset2(?!\d)',k)]
+            filter_groups = getFilterGroups(form_filt_values_dict, app.config.get('FILTER_GROUPS_MAX', 10))
+            dropped_groups = getFilterGroups(form_filt_values_dict, None)[len(filter_groups):]
+            if dropped_groups:
+                flash('Filters group(s) {} not applied: at most {} groups are compared'.format(
+                    ', '.join('#' + group[9:] for group in dropped_groups), len(filter_groups)))
+            indexes = loadDatasetIndexes(session['id'], session['dataset_fingerprint'], df.columns.to_list())
+            prefix_index = loadPrefixIndex(session['id'], session['dataset_fingerprint'])
+            dataset_key = (session['id'], session['dataset_fingerprint'])
+            if set(filter_groups) - {'filterset1', 'filterset2'}:
+                print("{} sets of filters were selected!".format(len(filter_groups)))
+                # each group is evaluated into (cached) row positions and all groups are stacked with their group codes
+                group_positions = []
+                for group in filter_groups:
+                    group_filters[group] = extactFilterValuesFromPOST2Dict(form_filt_values_dict, group)
+                    group_positions.append(getSelectionPositions(group_filters[group], df, indexes, prefix_index, dataset_key, group))
+                    if len(group_positions[-1]) == 0:
+                        msg='{\"error\":\"ERROR: Empty dataframe after group #' + group[9:] + ' filter(s) application\"}'
+                        print(msg)
+                        return msg
+                df_groups, groups_grouping = getGroupsSelection(df, group_positions, ['Group #{}'.format(group[9:]) for group in filter_groups])
+            elif filterKeysSet2:
                 print("Second set of filters were selected!")
                 #now need to find which variables and apply filters to a copy of the dataset
                 filter_dict=extactFilterValuesFromPOST2Dict(form_filt_values_dict,'filterset2')
+                group_filters['filterset2'] = filter_dict
                 print("Filter_dict Group #2: {}".format(filter_dict))
-                df2 = getFilteredData(filter_dict, df.copy()) #filtered df of subset#2
+                aggregates2.update(getCubeCounts(cube, df, filter_dict, hist_columns) or {})
+                age_counts['filterset2'] = getCubeAgeBinCounts(cube, df, filter_dict)
+                df2 = getFilteredData(filter_dict, df, indexes, prefix_index, dataset_key, 'filterset2', #filtered df of subset#2
+                                      columns=rowColumns(df, aggregates2, age_counts['filterset2']))
                 if df2.empty:
                     msg='{\"error\":\"ERROR: Empty dataframe after group #2 filter(s) application\"}'
                     print(msg)
@@ -565,9 +1100,15 @@ def dashboard():
 
             #alaways runs as set#1 is the default primary data selection. Needs to run after the set#2 data extraction due to global df reference
             filter_dict = extactFilterValuesFromPOST2Dict(form_filt_values_dict, 'filterset1')
+            group_filters['filterset1'] = filter_dict
             print("Filter_dict Group #1: {}".format(filter_dict))
             print("Starting data filtering on global data")
-            df = getFilteredData(filter_dict, df.copy())
+            if groups_grouping is None and 'get_excel_subset' not in form_data_dict:
+                aggregates.update(getCubeCounts(cube, df, filter_dict, hist_columns,
+                                                None if filterKeysSet2 else form_data_dict.get('groupby_selector_value')) or {})
+                age_counts['filterset1'] = getCubeAgeBinCounts(cube, df, filter_dict, form_data_dict.get('groupby_selector_value'))
+            df = getFilteredData(filter_dict, df, indexes, prefix_index, dataset_key, 'filterset1',
+                                 columns=rowColumns(df, aggregates, age_counts.get('filterset1')))
             if df.empty:
                 msg='{\"error\": \"ERROR: Empty dataframe after group #1 filter(s) application\"}' #will cause AJAX call fail due to parsing
                 print(msg)
@@ -577,85 +1118,97 @@ def dashboard():
             if 'get_excel_subset' in form_data_dict:
                 print("Return filtered csv file for data export")
                 b = BytesIO()
-                df.to_csv(b, sep=',', encoding='utf-8', index=False)
+                df.loc[:, [not str(c).startswith('__') for c in df.columns]].to_csv(b, sep=',', encoding='utf-8', index=False)
                 b.seek(0)
                 return Response(FileWrapper(b), mimetype="text/plain", direct_passthrough=True)
 
+            # more than two groups are compared as the traces of the group by mode plots (see getGroupsSelection())
+            if groups_grouping is not None:
+                if 'groupby_selector_value' in form_data_dict:
+                    flash('Group by {} is not applied when comparing more than two groups'.format(form_data_dict['groupby_selector_value']))
+                form_data_dict['groupby_selector_value'] = 'filter group'
+                df_sunburst, df = df, df_groups
+
         # -----------------------------------RENDER PLOTS-------------------
         print("Started rendering plots on {} cases".format(df.shape))
-
-        plot_title='Geolocation distribution ({})'.format(session['validatedfields_exp2obs_map']['geoloc_id'])
-        
-        renderHistPlot(df.copy(), 'geoloc_id', form_data_dict, jsonPlotsDict, 'geoloc_chart',
-                       plot_title,
-                       df2=df2.copy())
+        # the epidemiological curve modifies its input data so it gets a private copy of only the columns it reads (see decodeCategoricals())
+        groupby_columns = [form_data_dict['groupby_selector_value']] if 'groupby_selector_value' in form_data_dict else []
+        groupby = groupby_columns[0] if groupby_columns and df2.empty else None
+        # group by mode plots share the top groups of the Group #1 selection and aggregate by its group codes
+        grouping = groups_grouping
+        if grouping is None and groupby_columns and groupby_columns[0] in df.columns:
+            grouping = getSelectionGrouping(df, groupby_columns[0],
+                                            group_filters.get('filterset1', extactFilterValuesFromPOST2Dict({}, 'filterset1')))
+        for group, df_group, group_aggregates in [('filterset1', df, aggregates), ('filterset2', df2, aggregates2)]:
+            if df_group.empty:
+                continue
+            if group not in group_filters: #no row selection (i.e. the whole dataset)
+                group_aggregates.update(getCubeCounts(cube, df_group, extactFilterValuesFromPOST2Dict({}, group), hist_columns, groupby) or {})
+                age_counts[group] = getCubeAgeBinCounts(cube, df_group, extactFilterValuesFromPOST2Dict({}, group),
+                                                        groupby_columns[0] if groupby_columns else None)
+            if group_aggregates:
+                print("Counts of {} answered by the data cube".format(", ".join(group_aggregates)))
+            group_aggregates.update(aggregateSelection(df_group, [c for c in hist_columns if c not in group_aggregates], groupby))
+
+        # every panel renders into its own plots dictionary from the shared read-only selections and counts
+        # so the independent panels can be rendered by forked worker processes (see renderPanels())
+        def renderHistPanel(df_col_name, plot_title, layout_dict={}):
+            return lambda plotsDict, key: renderHistPlot(df, df_col_name, form_data_dict, plotsDict, key, plot_title, df2=df2,
+                                                         layout_dict=layout_dict, counts=aggregates.get(df_col_name),
+                                                         counts2=aggregates2.get(df_col_name), grouping=grouping)
+
+        def renderComponentsPanel(df_col_name, plot_title):
+            return lambda plotsDict, key: renderBarComponentsPlot(df, df_col_name, form_data_dict, plotsDict, key, plot_title,
+                                                                  df2=df2, components=components.get(df_col_name), grouping=grouping)
 
         # AGE PLOT DISTRIBUTION
-        if all(item in df.columns.to_list() for item in ['age']):
-            AgeSexFigCapDict = generateAgeBarPlot(df.copy(),form_data_dict,df2=df2)
-            jsonPlotsDict['figures']['age_distribution_chart'] = AgeSexFigCapDict['figure']
-            jsonPlotsDict['captions']['age_distribution_chart'] = AgeSexFigCapDict['caption']
-        else:
-            print("gender and age histogram will not be rendered. Missing age field")
-            flash("gender and age histogram will not be rendered. Missing age field")
-            jsonPlotsDict['figures']['age_distribution_chart'] = '{}'
-            jsonPlotsDict['captions']['age_distribution_chart'] = '{}'
-
-
-        plot_title='Gender distribution ({})'.format(session['validatedfields_exp2obs_map']['gender'])
-        renderHistPlot(df_col_name='gender', df=df.copy(), form_data_dict=form_data_dict, jsonPlotsDict=jsonPlotsDict,
-                       jsonPlotsDictKey='gender_distribution_chart',
-                       plot_title=plot_title,
-                       df2=df2.copy())
-
-        plot_title='source_type distribution ({})'.format(session['validatedfields_exp2obs_map']['source_type'])
-        renderHistPlot(df.copy(), 'source_type', form_data_dict, jsonPlotsDict, 'sample_source_type_distribution_chart',
-                       plot_title,df2=df2.copy())
-
-        plot_title ='Source site distribution ({})'.format(session['validatedfields_exp2obs_map']['source_site'])
-        renderHistPlot(df.copy(), 'source_site', form_data_dict, jsonPlotsDict, 'sample_source_site_distribution_chart',
-                       plot_title,df2=df2.copy())
-
-        renderEpiCurve(df.copy(),'date',form_data_dict,jsonPlotsDict,'sample_accum_plot', df2=df2)
-
-        plot_title ='Primary type ({})'.format(session['validatedfields_exp2obs_map']['primary_type'])
-        renderHistPlot(df.copy(),'primary_type',form_data_dict,jsonPlotsDict,'primary_type_chart',
-                       plot_title,df2=df2.copy())
-        plot_title ='Secondary type ({})'.format(session['validatedfields_exp2obs_map']['secondary_type'])
-        renderHistPlot(df.copy(),'secondary_type',form_data_dict,jsonPlotsDict,'secondary_type_chart',
-                       plot_title,df2=df2.copy())
-
-        # GENETIC and PHENO PROFILE PLOTS
-        plot_title ='Genetic profile  ({})'.format(session['validatedfields_exp2obs_map']['genetic_profile'])
-        plot_title_components ='Genetic components ({})'.format(session['validatedfields_exp2obs_map']['genetic_profile'])
-        renderHistPlot(df.copy(), 'genetic_profile', form_data_dict, jsonPlotsDict, 'genetic_profile_bar_chart',
-                       plot_title, df2=df2.copy(), layout_dict={'xaxis.tickangle':90})
-        renderBarComponentsPlot(df.copy(), 'genetic_profile', form_data_dict, jsonPlotsDict, 'genetic_components_bar_chart',
-                                plot_title_components,
-                                df2=df2)
-
-        plot_title ='Phenotypic profile  ({})'.format(session['validatedfields_exp2obs_map']['phenotypic_profile'])
-        plot_title_components ='Phenotypic components ({})'.format(session['validatedfields_exp2obs_map']['phenotypic_profile'])
-        renderHistPlot(df.copy(), 'phenotypic_profile', form_data_dict, jsonPlotsDict, 'phenotypic_profile_bar_chart',
-                       plot_title, df2=df2.copy(), layout_dict={'xaxis.tickangle':90})
-        renderBarComponentsPlot(df.copy(), 'phenotypic_profile', form_data_dict, jsonPlotsDict,
-                                'phenotypic_components_bar_chart',
-                                plot_title_components,
-                                df2=df2)
-
-
-        # Hierarchy of clusters sunburst plot
-        renderSunburstPlot(df=df.copy(),jsonPlotsDict=jsonPlotsDict)
-        # RENDER PRIMARY and INVESTIGATION ID BARPLOTS
-        renderHistPlot(df=df.copy(), df_col_name='cluster_id', form_data_dict=form_data_dict, jsonPlotsDict=jsonPlotsDict,
-                       jsonPlotsDictKey='clusterid_codes_distribution_chart',
-                       plot_title='Cluster IDs distribution ({})'.format(session['validatedfields_exp2obs_map']['cluster_id']),
-                       df2=df2.copy())
-        renderHistPlot(df_col_name='investigation_id', df=df.copy(), form_data_dict=form_data_dict,
-                       jsonPlotsDict=jsonPlotsDict,
-                       jsonPlotsDictKey='investigationid_codes_distribution_chart',
-                       plot_title='Investigation IDs distribution ({})'.format(session['validatedfields_exp2obs_map']['investigation_id']),
-                       df2=df2.copy())
+        def renderAgePanel(plotsDict, key):
+            if age_counts.get('filterset1') is not None or 'age' in df.columns.to_list():
+                AgeSexFigCapDict = generateAgeBarPlot(df, form_data_dict, df2=df2, grouping=grouping, age_counts=age_counts.get('filterset1'),
+                                                      age_counts2=age_counts.get('filterset2'))
+                plotsDict['figures'][key] = AgeSexFigCapDict['figure']
+                plotsDict['captions'][key] = AgeSexFigCapDict['caption']
+                if 'comparison' in AgeSexFigCapDict:
+                    addComparison(plotsDict, key, AgeSexFigCapDict['comparison'])
+            else:
+                print("gender and age histogram will not be rendered. Missing age field")
+                flash("gender and age histogram will not be rendered. Missing age field")
+                plotsDict['figures'][key] = '{}'
+                plotsDict['captions'][key] = '{}'
+
+        mapping = session['validatedfields_exp2obs_map']
+        components = loadComponentMatrices(session['id'], session['dataset_fingerprint'])
+        panels = {
+            'geoloc_chart': renderHistPanel('geoloc_id', 'Geolocation distribution ({})'.format(mapping['geoloc_id'])),
+            'age_distribution_chart': renderAgePanel,
+            'gender_distribution_chart': renderHistPanel('gender', 'Gender distribution ({})'.format(mapping['gender'])),
+            'sample_source_type_distribution_chart': renderHistPanel('source_type', 'source_type distribution ({})'.format(mapping['source_type'])),
+            'sample_source_site_distribution_chart': renderHistPanel('source_site', 'Source site distribution ({})'.format(mapping['source_site'])),
+            'sample_accum_plot': lambda plotsDict, key: renderEpiCurve(decodeCategoricals(df, ['date'] + groupby_columns), 'date',
+                                                                       form_data_dict, plotsDict, key,
+                                                                       df2=decodeCategoricals(df2, ['date'] + groupby_columns),
+                                                                       grouping=grouping),
+            'primary_type_chart': renderHistPanel('primary_type', 'Primary type ({})'.format(mapping['primary_type'])),
+            'secondary_type_chart': renderHistPanel('secondary_type', 'Secondary type ({})'.format(mapping['secondary_type'])),
+            # GENETIC and PHENO PROFILE PLOTS
+            'genetic_profile_bar_chart': renderHistPanel('genetic_profile', 'Genetic profile  ({})'.format(mapping['genetic_profile']),
+                                                         layout_dict={'xaxis.tickangle':90}),
+            'genetic_components_bar_chart': renderComponentsPanel('genetic_profile', 'Genetic components ({})'.format(mapping['genetic_profile'])),
+            'phenotypic_profile_bar_chart': renderHistPanel('phenotypic_profile', 'Phenotypic profile  ({})'.format(mapping['phenotypic_profile']),
+                                                            layout_dict={'xaxis.tickangle':90}),
+            'phenotypic_components_bar_chart': renderComponentsPanel('phenotypic_profile',
+                                                                     'Phenotypic components ({})'.format(mapping['phenotypic_profile'])),
+            # Hierarchy of clusters sunburst plot
+            'hierarchy_of_clusters_sunburst_chart': lambda plotsDict, key: renderSunburstPlot(df=df if df_sunburst is None else df_sunburst,
+                                                                                               jsonPlotsDict=plotsDict),
+            # RENDER PRIMARY and INVESTIGATION ID BARPLOTS
+            'clusterid_codes_distribution_chart': renderHistPanel('cluster_id', 'Cluster IDs distribution ({})'.format(mapping['cluster_id'])),
+            'investigationid_codes_distribution_chart': renderHistPanel('investigation_id',
+                                                                        'Investigation IDs distribution ({})'.format(mapping['investigation_id'])),
+        }
+        renderPanels(panels, jsonPlotsDict, workers=app.config.get('RENDER_WORKERS', 1), timeout=app.config.get('RENDER_PANEL_TIMEOUT'))
+        # Group #1 vs Group #2 statistics of all plots in one batch
+        renderComparisonCaptions(jsonPlotsDict)
 
     
 
@@ -687,22 +1240,330 @@ def dashboard():
 
 
 ### --------------------- AUXILARY FUNCTIONS -------------------
-def calculate_correlation(vector1, vector2, name):
-    """Calcualte Pearson correlation using two vectors of the same length and the same variable/field
+def getAlignedCounts(counts1, counts2):
+    '''
+    Align the Group #1 and Group #2 counts of a plot on the union of their categories (e.g. field values or time bins)
+    Arguments:
+        counts1 {pandas series} - Group #1 counts indexed by category
+        counts2 {pandas series} - Group #2 counts indexed by category
+    Return:
+        {tuple} - (categories, Group #1 counts, Group #2 counts) with zero counts of categories missing in a group
+    '''
+    categories = counts1.index.union(counts2.index)
+    return categories, counts1.reindex(categories, fill_value=0).to_numpy(), counts2.reindex(categories, fill_value=0).to_numpy()
+
 
+def addComparison(jsonPlotsDict, jsonPlotsDictKey, comparison):
+    '''
+    Register the aligned Group #1 and Group #2 counts of a plot to be compared by renderComparisonCaptions() once all
+    plots are rendered. Plots with less than 3 categories are not compared
     Arguments:
-        vector1 (list): list of integer values from the Group #1 dataset 
-        vector2 (list): list of integer values from the Group #2 dataset
-        name (string):  a custom string usually used to identify a plot that made function call
+        jsonPlotsDict {dict} - a global instance of the figure and captions dictionary
+        jsonPlotsDictKey {string} - plot key of the caption the statistics are added to
+        comparison {tuple} - aligned counts (see getAlignedCounts())
+    '''
+    if len(comparison[0]) >= 3:
+        jsonPlotsDict.setdefault('comparisons', {})[jsonPlotsDictKey] = comparison
+
+
+def getComparisonStatistics(comparisons):
+    '''
+    Group #1 vs Group #2 statistics of all compared plots calculated in one vectorized batch over the concatenated
+    aligned count vectors (per plot sums are bincounts over the plot number of each category):
+    Pearson correlation of the counts (two-sided p-value of the t statistic as scipy.stats.pearsonr()),
+    chi-square test of homogeneity of the two groups distributions (2 x categories table of the categories with samples)
+    and the largest difference of category proportions between the groups (two-proportion z-test)
+    Arguments:
+        comparisons {dict} - aligned counts of each compared plot {plot key: (categories, counts1, counts2)}
+    Return:
+        {pandas dataframe} - statistics indexed by plot key
+    '''
+    keys = list(comparisons)
+    sizes = np.array([len(comparisons[key][0]) for key in keys])
+    plot = np.repeat(np.arange(len(keys)), sizes)
+    ends = np.cumsum(sizes) - 1
+    counts1 = np.concatenate([np.asarray(comparisons[key][1], dtype=float) for key in keys])
+    counts2 = np.concatenate([np.asarray(comparisons[key][2], dtype=float) for key in keys])
+    categories = np.concatenate([np.asarray(comparisons[key][0], dtype=object) for key in keys])
+    plot_sum = lambda values: np.bincount(plot, weights=values, minlength=len(keys))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n1, n2 = plot_sum(counts1), plot_sum(counts2)
+        deviations1, deviations2 = counts1 - (n1 / sizes)[plot], counts2 - (n2 / sizes)[plot]
+        corr = np.clip(plot_sum(deviations1 * deviations2) / np.sqrt(plot_sum(deviations1 ** 2) * plot_sum(deviations2 ** 2)), -1, 1)
+        corr_pvalue = 2 * stats.t.sf(np.abs(corr) * np.sqrt((sizes - 2) / (1 - corr ** 2)), sizes - 2)
+
+        totals = counts1 + counts2
+        expected1, expected2 = totals * (n1 / (n1 + n2))[plot], totals * (n2 / (n1 + n2))[plot]
+        chi2 = plot_sum(np.where(totals > 0, (counts1 - expected1) ** 2 / expected1 + (counts2 - expected2) ** 2 / expected2, 0))
+        chi2_dof = plot_sum(totals > 0).astype(np.int64) - 1
+        chi2_pvalue = stats.chi2.sf(chi2, chi2_dof)
+
+        differences = counts1 / n1[plot] - counts2 / n2[plot]
+        pooled = totals / (n1 + n2)[plot]
+        zscores = differences / np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2)[plot])
+        largest = np.lexsort((np.abs(np.nan_to_num(differences)), plot))[ends] #category of the largest difference of each plot
+
+    return pd.DataFrame({'npoints': sizes, 'corr': corr, 'corr_pvalue': corr_pvalue,
+                         'chi2': chi2, 'chi2_dof': chi2_dof, 'chi2_pvalue': chi2_pvalue,
+                         'difference_category': categories[largest], 'difference': differences[largest] * 100,
+                         'difference_pvalue': 2 * stats.norm.sf(np.abs(zscores[largest]))}, index=keys)
+
+
+def renderComparisonCaptions(jsonPlotsDict):
+    '''
+    Add the Group #1 vs Group #2 statistics of the plots registered by addComparison() to their captions
+    Arguments:
+        jsonPlotsDict {dict} - a global instance of the figure and captions dictionary
+    '''
+    comparisons = jsonPlotsDict.pop('comparisons', {})
+    if not comparisons:
+        return
+    for key, row in getComparisonStatistics(comparisons).iterrows():
+        print('Group #1 vs Group #2 statistics of {}: {}'.format(key, row.to_dict()))
+        jsonPlotsDict['captions'][key] = jsonPlotsDict['captions'][key] + \
+            "\nPearson correlation coefficient between two groups based on the {} data points: {:.3f} (p-value: {:.3e})".format(
+                row['npoints'], row['corr'], row['corr_pvalue']) + \
+            "\nChi-square test of the two groups distributions: {:.2f} ({} degrees of freedom, p-value: {:.3e})".format(
+                row['chi2'], row['chi2_dof'], row['chi2_pvalue']) + \
+            "\nLargest proportion difference between two groups: {} ({:+.2f} percentage points, p-value: {:.3e})".format(
+                row['difference_category'], row['difference'], row['difference_pvalue'])
+
+
+_renderWorkerPanels = {} #panels of the request that forked this render worker process (see renderPanels())
+_renderPanelsWarm = False #plots were rendered by this process so forked workers inherit the lazily built figure validators
 
-    Returns:
-        (tuple):    tuple of 3 values corresponding to Pearson correlation value,two-sided p-value calculated from beta distribution 
-                    and length of vector 1 values
-    """
-    corr, pvalue = pearsonr(vector1,vector2)
-    print('Pearsons correlation in {} Group#1 vs Group #2: {}'.format(name, corr))
-    return corr,pvalue, len(vector1)
 
+def _initRenderWorker(panels):
+    # runs in a worker process forked by the request thread, so the panels (closures over the selected data) and the
+    # request context are inherited instead of being pickled
+    global _renderWorkerPanels
+    _renderWorkerPanels = panels
+
+
+def _renderWorkerPanel(key):
+    # messages flashed to the worker copy of the session are sent back with the plots
+    nflashes = len(session.get('_flashes', []))
+    plotsDict = {'figures': {}, 'captions': {}}
+    _renderWorkerPanels[key](plotsDict, key)
+    plotsDict['flashes'] = session.get('_flashes', [])[nflashes:]
+    return plotsDict
+
+
+def renderPanels(panels, jsonPlotsDict, workers=1, timeout=None):
+    '''
+    Render independent dashboard panels. Each panel renders into a private plots dictionary merged into jsonPlotsDict once
+    it has finished, so a failing panel is rendered empty (with a flash message) without affecting the other panels.
+    Panels are rendered one after another by the request thread unless several workers are requested. Figures are built
+    in pure Python, so only worker processes render them in parallel: a pool is forked per request and reads the selected
+    data as inherited (copy on write) memory. Forking is only safe in single threaded server workers (threads = 1 in
+    uwsgi.ini) as a lock held by another thread at fork time stays locked in the child
+    Arguments:
+        panels {dict} - plot keys and functions rendering the plot into a given plots dictionary f(plotsDict, key)
+        jsonPlotsDict {dict} - a global instance of the figure and captions dictionary
+        workers {int} - number of worker processes forked per request. Panels are rendered one after another by the
+                        request thread if 1 or if processes cannot be forked on the platform. The first plots of a process
+                        are also rendered by the request thread so forked workers start with built figures
+        timeout {float} - seconds the worker processes may take to render the panels (None to wait for every panel). The
+                          unfinished panels are rendered empty and stopped by terminating the pool. Ignored when rendering
+                          one panel after another
+    '''
+    global _renderPanelsWarm
+    results = {}
+    if workers <= 1 or not _renderPanelsWarm or 'fork' not in multiprocessing.get_all_start_methods():
+        #forked workers would build the figure validators anew for every request if this process never rendered plots
+        _renderPanelsWarm = True
+        for key, render in panels.items():
+            results[key] = {'figures': {}, 'captions': {}}
+            try:
+                render(results[key], key)
+            except Exception as e:
+                results[key] = e
+    else:
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(panels)), initializer=_initRenderWorker,
+                                                        initargs=(panels,))
+        try:
+            pending = {key: pool.apply_async(_renderWorkerPanel, (key,)) for key in panels}
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for key, result in pending.items():
+                try:
+                    results[key] = result.get(None if deadline is None else max(0, deadline - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    results[key] = TimeoutError('not rendered within {} seconds'.format(timeout))
+                except Exception as e:
+                    results[key] = e
+        finally:
+            pool.terminate() #stops the panels still running after the timeout
+
+    for key in panels:
+        if isinstance(results[key], Exception):
+            msg = "Plot {} could not be rendered: {}".format(key, results[key])
+            print(msg); flash(msg)
+            jsonPlotsDict['figures'][key] = '{}'
+            jsonPlotsDict['captions'][key] = '{}'
+            continue
+        for category, message in results[key].pop('flashes', []):
+            flash(message, category)
+        jsonPlotsDict['figures'].update(results[key]['figures'])
+        jsonPlotsDict['captions'].update(results[key]['captions'])
+        if 'comparisons' in results[key]:
+            jsonPlotsDict.setdefault('comparisons', {}).update(results[key]['comparisons'])
+
+
+def getFisherExactPvalues(counts, draws, successes, population):
+    '''
+    Two-sided Fisher exact test p-values of many 2 x 2 tables at once. The p-value of a table sums the hypergeometric
+    probabilities of all tables with the same margins that are not more probable than the observed one (as
+    scipy.stats.fisher_exact()). Supports of all tables are laid out in one array and summed by a bincount over the tables
+    Arguments:
+        counts {numpy array} - observed count of each table (e.g. Group #1 samples of a category)
+        draws {numpy array} - first row margin of each table (e.g. Group #1 samples)
+        successes {numpy array} - first column margin of each table (e.g. samples of a category in both groups)
+        population {numpy array} - total count of each table
+    Return:
+        {numpy array} - p-value of each table
+    '''
+    counts, draws, successes, population = [np.asarray(values, dtype=np.int64) for values in (counts, draws, successes, population)]
+    low, high = np.maximum(0, draws - (population - successes)), np.minimum(successes, draws)
+    sizes = high - low + 1
+    table = np.repeat(np.arange(len(counts)), sizes)
+    values = low[table] + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    logChoose = lambda n, k: special.gammaln(n + 1) - special.gammaln(k + 1) - special.gammaln(n - k + 1)
+    logpmf = lambda x, t: logChoose(successes[t], x) + logChoose(population[t] - successes[t], draws[t] - x) - \
+        logChoose(population[t], draws[t])
+    observed = logpmf(counts, np.arange(len(counts)))
+    probabilities = logpmf(values, table)
+    pvalues = np.bincount(table, weights=np.where(probabilities <= observed[table] + 1e-7, np.exp(probabilities), 0),
+                          minlength=len(counts))
+    return np.minimum(pvalues, 1)
+
+
+def getEnrichmentCounts(df, positions1, positions2, components={}):
+    '''
+    Sample counts of each category of every categorical column and of every profile component in two row selections.
+    Each column is counted by one bincount of its codes per selection and the profile components by a product of the
+    profile counts and the component presence matrix
+    Arguments:
+        df {pandas dataframe} - stored dataset with the categorical columns
+        positions1 {numpy array} - row positions of Group #1
+        positions2 {numpy array} - row positions of Group #2
+        components {dict} - component matrices of the profile columns (see loadComponentMatrices())
+    Return:
+        {pandas dataframe} - 'field', 'category', 'count1', 'total1', 'count2' and 'total2' (samples with a value of the
+                             field in each group) of the categories found in any of the groups
+    '''
+    frames = []
+    for column in df.columns:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            continue
+        codes, categories = getColumnCodes(df[column])
+        counts = [np.bincount(selected[selected >= 0], minlength=len(categories)) for selected in (codes[positions1], codes[positions2])]
+        fields = [(column, categories.astype(str), counts)]
+        if column in components and components[column][0].shape[0] == len(categories):
+            presence = components[column][0].sign().T.tocsr() #samples having a component regardless of its occurrences
+            fields.append(("{} components".format(column), components[column][1], [presence @ c for c in counts]))
+        for field, names, (counts1, counts2) in fields:
+            frames.append(pd.DataFrame({'field': field, 'category': np.asarray(names, dtype=object),
+                                        'count1': counts1.astype(np.int64), 'total1': counts[0].sum(),
+                                        'count2': counts2.astype(np.int64), 'total2': counts[1].sum()}))
+    if not frames:
+        return pd.DataFrame(columns=['field', 'category', 'count1', 'total1', 'count2', 'total2'])
+    counts = pd.concat(frames, ignore_index=True)
+    return counts[(counts['count1'] + counts['count2']) > 0].reset_index(drop=True)
+
+
+def getEnrichmentStatistics(counts):
+    '''
+    Group #1 vs Group #2 enrichment statistics of every category in one vectorized batch over the 2 x 2 tables of
+    (group, category or not): odds ratio (Haldane-Anscombe corrected if a cell is zero), chi-square test p-value with
+    Yates correction or the Fisher exact test p-value if any expected count is below 5, and the Benjamini-Hochberg
+    FDR adjusted q-value over all categories
+    Arguments:
+        counts {pandas dataframe} - category counts of the two groups (see getEnrichmentCounts())
+    Return:
+        {pandas dataframe} - counts with 'percent1', 'percent2', 'odds_ratio', 'test', 'pvalue' and 'qvalue' columns
+                             ranked by p-value (and by the odds ratio magnitude)
+    '''
+    a, c = counts['count1'].to_numpy(dtype=float), counts['count2'].to_numpy(dtype=float)
+    b, d = counts['total1'].to_numpy(dtype=float) - a, counts['total2'].to_numpy(dtype=float) - c
+    n = a + b + c + d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correction = np.where((a == 0) | (b == 0) | (c == 0) | (d == 0), 0.5, 0)
+        odds_ratio = (a + correction) * (d + correction) / ((b + correction) * (c + correction))
+        margins = (a + b) * (c + d) * (a + c) * (b + d)
+        expected = np.minimum(a + b, c + d) * np.minimum(a + c, b + d) / n #smallest expected count of each table
+        chi2 = n * np.maximum(np.abs(a * d - b * c) - n / 2, 0) ** 2 / margins
+        pvalues = stats.chi2.sf(chi2, 1)
+    fisher = ~(expected >= 5)
+    pvalues[fisher] = getFisherExactPvalues(a[fisher], (a + b)[fisher], (a + c)[fisher], n[fisher])
+
+    statistics = counts.assign(percent1=a / np.maximum(a + b, 1) * 100, percent2=c / np.maximum(c + d, 1) * 100,
+                               odds_ratio=odds_ratio, test=np.where(fisher, 'fisher', 'chi-square'), pvalue=pvalues,
+                               qvalue=stats.false_discovery_control(pvalues) if len(pvalues) else pvalues)
+    order = np.lexsort((-np.abs(np.log(odds_ratio)), pvalues))
+    return statistics.iloc[order].reset_index(drop=True)
+
+
+def getHierarchyNodes(df, hier_column_names, max_nodes):
+    '''
+    Aggregate complete hierarchical paths (samples with all levels specified) into sunburst nodes. Paths of every level are
+    numbered by factorizing the (parent path, level value) pairs so the samples of each path are counted by a bincount.
+    The most numerous paths are added in descending count order (ties in path order) while they and their new ancestor
+    nodes fit in the node budget
+    Arguments:
+        df {pandas dataframe} - selected rows with the hierarchical level columns
+        hier_column_names {list} - hierarchical level column names from the top (most relaxed) level down
+        max_nodes {int} - maximum number of sunburst nodes (at least the most numerous path is always shown)
+    Return:
+        nodes {pandas dataframe} - 'id' (e.g. 1/2/3), 'parent' (e.g. 1/2), 'labels' (e.g. 3) and 'counts' of the shown paths
+                                   and their ancestors, deepest level first and each level sorted by its path labels
+                                   from the bottom up (the node order of px.sunburst(path=...))
+        npaths {int} - number of shown paths
+        ntotal {int} - number of complete paths
+    '''
+    levels = [getColumnCodes(df[column]) for column in hier_column_names]
+    complete = np.all([codes >= 0 for codes, _ in levels], axis=0)
+    nodes = np.zeros(np.count_nonzero(complete), dtype=np.int64)
+    parents, codes = [], [] #per level parent node and level value code of each node
+    for level_codes, categories in levels:
+        keys = nodes * len(categories) + level_codes[complete]
+        nodes, uniques = pd.factorize(keys, sort=True)
+        parents.append(uniques // len(categories))
+        codes.append(uniques % len(categories))
+    counts = np.bincount(nodes, minlength=len(codes[-1]))
+    if counts.size == 0:
+        return pd.DataFrame(columns=['id', 'parent', 'labels', 'counts']), 0, 0
+
+    # ancestors of the paths sorted by descending counts and the number of nodes each path adds to the plot
+    paths = np.argsort(-counts, kind='stable')
+    ancestors = [paths]
+    for level in range(len(levels) - 1, 0, -1):
+        ancestors.insert(0, parents[level][ancestors[0]])
+    new_nodes = np.zeros(len(paths), dtype=np.int64)
+    for level_ancestors in ancestors:
+        new_nodes[np.unique(level_ancestors, return_index=True)[1]] += 1
+    npaths = max(int(np.searchsorted(np.cumsum(new_nodes), max_nodes, side='right')), 1)
+
+    tree = []
+    for level, (level_codes, categories) in enumerate(levels):
+        level_nodes = np.unique(ancestors[level][:npaths])
+        labels = categories.astype(str).to_numpy(dtype=object)[codes[level][level_nodes]]
+        if level == 0:
+            parent_ids, ids = np.full(len(labels), '', dtype=object), labels
+        else:
+            parent_ids = ids[np.searchsorted(parent_nodes, parents[level][level_nodes])]
+            ids = parent_ids + '/' + labels
+        level_counts = np.bincount(ancestors[level][:npaths], weights=counts[paths[:npaths]], minlength=len(codes[level]))
+        path_codes = [codes[level][level_nodes]] #sort nodes by their level value then by ancestor values as px.sunburst does
+        node = level_nodes
+        for ancestor_level in range(level, 0, -1):
+            node = parents[ancestor_level][node]
+            path_codes.append(codes[ancestor_level - 1][node])
+        order = np.lexsort(path_codes[::-1])
+        tree.insert(0, pd.DataFrame({'id': ids[order], 'parent': parent_ids[order], 'labels': labels[order],
+                                     'counts': level_counts[level_nodes][order].astype(np.int64)}))
+        parent_nodes = level_nodes
+    return pd.concat(tree, ignore_index=True), npaths, len(paths)
 
 
 def renderSunburstPlot(df,jsonPlotsDict):
@@ -710,11 +1571,11 @@ def renderSunburstPlot(df,jsonPlotsDict):
     Since the resulting figure and caption objects are stored in global dictionary (jsonPlotsDict) this function does not return any value
 
     First a total number of hierchical levels are determined basd on column names with `hs_level_` prefix.
-    Then given a list of hierarhical columns the unique hierarhcial paths are calculated and sorted in descending order (from highest to lowerst)
-    using the pandas value_counts() and results are stored in 'df_filtered' pandas dataframe
+    Then given a list of hierarhical columns the complete hierarhcial paths are counted and aggregated into sunburst nodes (ids, parents and counts)
+    by getHierarchyNodes() and results are stored in 'df_nodes' pandas dataframe
 
-    Only the top most abundant 100 hierchical paths are using for the plot rendering due to perfomrance considerations. Suburst are resource heavy at 
-    the present Plotly library implementation v5.1.0
+    Only the top most abundant hierchical paths fitting in SUNBURST_MAX_NODES sectors (including their ancestors) are used for the plot rendering
+    due to perfomrance considerations. Suburst are resource heavy at the present Plotly library implementation v5.1.0
 
     If the 'hierarchical_subtype' column has the square bracked with level names supplied, this information will be added to metadata
     This column should be formated some_colum_name[name1, name2, ...]. The comma delimiter and square brackets are must components of the format
@@ -734,28 +1595,26 @@ def renderSunburstPlot(df,jsonPlotsDict):
             
 
             if all(item in df.columns.to_list() for item in hier_column_names):
-                is_na_idx=df[hier_column_names].isna().apply(lambda x: not any(x), axis=1) #is True if any value is missing
-                df_filtered = df[is_na_idx].value_counts(hier_column_names).reset_index(name="counts").sort_values(['counts'],ascending=False)
+                df_nodes, display_nrows, total_nrows = getHierarchyNodes(df, hier_column_names, app.config.get('SUNBURST_MAX_NODES', 1000))
 
-                if df_filtered.empty:
+                if df_nodes.empty:
                     msg='Empty dataframe after filtering of missing data samples. Check data completeness.'
                     print(msg)
                     flash(msg)
                     jsonPlotsDict['figures']['hierarchy_of_clusters_sunburst_chart'] = '{}'
                     jsonPlotsDict['captions']['hierarchy_of_clusters_sunburst_chart'] = '{}'
-               
-                if df_filtered.shape[0] > 100:
-                    display_nrows = 100
-                else:
-                    display_nrows = df_filtered.shape[0]
+                    return
 
 
-                print(f"Started rendering hierarchical subtype sunburst plot on {df_filtered.shape[0]} samples")
+                print(f"Started rendering hierarchical subtype sunburst plot on {total_nrows} paths")
                 plot_title ="Hierarchical subtype sunburst plot ({})".format(session['validatedfields_exp2obs_map']['hierarchical_subtype'])
                 fig = px.sunburst(
-                    data_frame=df_filtered.head(display_nrows),
-                    path=hier_column_names,
+                    data_frame=df_nodes,
+                    ids='id',
+                    names='labels',
+                    parents='parent',
                     values='counts',
+                    branchvalues='total',
                     hover_data=['counts'],  # generates 'customdata' field
                     maxdepth=3,
                     title=plot_title,
@@ -787,7 +1646,7 @@ def renderSunburstPlot(df,jsonPlotsDict):
                                                               "with the most relaxed conditions compared to other levels\n" \
                                                               "Note 2: Only {} top most numerous hierarchy paths rendered to improve performance\n" \
                                                               "Note 3: The selected delimiter symbol is '{}'\n"\
-                                                              "Note 4: If defined, the Group #2 samples are NOT rendered, only Group #1 samples".format(sum(df_filtered.head(display_nrows)['counts']),hier_num_of_levels,display_nrows, session['delimiter_symbol'])
+                                                              "Note 4: If defined, the Group #2 samples are NOT rendered, only Group #1 samples".format(df_nodes.loc[df_nodes['parent'] == '', 'counts'].sum(),hier_num_of_levels,display_nrows, session['delimiter_symbol'])
                 
 
             else:
@@ -801,7 +1660,53 @@ def renderSunburstPlot(df,jsonPlotsDict):
         jsonPlotsDict['captions']['hierarchy_of_clusters_sunburst_chart'] = '{}'
 
 
-def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, plot_title,df2=pd.DataFrame()):
+def getComponentMatrix(profiles, delimiter):
+    '''
+    Parse profiles (e.g. blaCMY2|blaTEM|str) into a sparse matrix of component occurrences. Distinct profiles (i.e. the
+    dictionary of a categorical profile column) are parsed once instead of splitting the profile of every sample
+    Arguments:
+        profiles {pandas index} - distinct profiles
+        delimiter {string} - profile components delimiter
+    Return:
+        matrix {scipy sparse matrix} - CSR matrix of the number of occurrences of each component (column) in each profile (row)
+        vocabulary {list} - component names of the matrix columns
+    '''
+    components = pd.Series(profiles.astype(str), dtype=object).str.split(delimiter, regex=False).explode()
+    component_codes, vocabulary = pd.factorize(components, sort=True)
+    matrix = sparse.csr_matrix((np.ones(len(component_codes), dtype=np.int64), (components.index.to_numpy(), component_codes)),
+                               shape=(len(profiles), len(vocabulary))) #duplicated (row, column) entries are summed up
+    return matrix, vocabulary.to_list()
+
+
+def getComponentCounts(series, delimiter, components=None, traces=None, ntraces=1):
+    '''
+    Count profile components of the samples of each plot trace by a sparse product of per trace profile counts and the
+    profile component matrix. Missing profiles are not counted
+    Arguments:
+        series {pandas series} - profile column values of the selected rows
+        delimiter {string} - profile components delimiter
+        components {tuple} - (matrix, vocabulary, delimiter) component matrix of the categorical column dictionary
+                             (see loadComponentMatrices()) or None to parse the distinct profiles of the series
+        traces {numpy array} - trace index of each row (-1 for rows of no trace) or None for a single trace
+        ntraces {int} - number of traces
+    Return:
+        {list} - Counter of component counts of each trace (components without samples are omitted)
+    '''
+    codes, profiles = getColumnCodes(series)
+    if components is None or components[2] != delimiter or components[0].shape[0] != len(profiles):
+        components = getComponentMatrix(profiles, delimiter) + (delimiter,)
+    matrix, vocabulary = components[0], components[1]
+    traces = np.zeros(len(codes), dtype=np.int64) if traces is None else np.asarray(traces, dtype=np.int64)
+    selected = (codes >= 0) & (traces >= 0)
+    profile_counts = np.bincount(traces[selected] * len(profiles) + codes[selected],
+                                 minlength=ntraces * len(profiles)).reshape(ntraces, len(profiles))
+    component_counts = (sparse.csr_matrix(profile_counts) @ matrix).toarray()
+    return [Counter({vocabulary[idx]: int(trace_counts[idx]) for idx in np.flatnonzero(trace_counts)})
+            for trace_counts in component_counts]
+
+
+def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, plot_title,df2=pd.DataFrame(),
+                            components=None, grouping=None):
     """Render bar plot for the 'genetic_profile' and 'phenotypic_profile' profile fields containing individual components. 
     Given a profile field delimited by some symbol (e.g. blaCMY2|blaTEM|str), extract its components and plot using go.Bar()
 
@@ -814,6 +1719,9 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
                                    in the jsonPlotsDict dictionary
         plot_title (string):   a string used to assign initial plot title to the resulting figure
         df2 (pandas dataframe, optional): A copy of the Group #2 pandas dataframe representing the second dataset to render. Defaults to pd.DataFrame().
+        components (tuple, optional): precomputed component matrix of the categorical profile column (see loadComponentMatrices()).
+                                      Defaults to None parsing the distinct profiles of the input
+        grouping (tuple, optional): group by mode grouping of the 'df' rows computed by getSelectionGrouping(). Calculated from 'df' if not provided
     """
     print("RenderBarComponentsPlot: Find components in the input variable {}".format(df_col_name))
 
@@ -825,8 +1733,7 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
     if df_col_name in df.columns.to_list() and df2.empty is True:
 
         print("delimiter_symbol {}".format(session['delimiter_symbol']))
-        plot_data_dict=Counter([item for sublist in df.loc[df[df_col_name].isnull() == False,df_col_name].str.split(session['delimiter_symbol']).to_list()
-                                for item in sublist])
+        plot_data_dict=getComponentCounts(df[df_col_name], session['delimiter_symbol'], components)[0]
 
         if 'percent_yscale' in form_data_dict:
             fig.update_yaxes(title_text="% of trace total", secondary_y=False)
@@ -844,33 +1751,13 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
         )
 
         if 'groupby_selector_value' in form_data_dict:
-            groups_total = df.groupby(
-                form_data_dict['groupby_selector_value']).size().reset_index(
-                name='counts').sort_values(by='counts', ascending=False)[form_data_dict['groupby_selector_value']].to_list()
-            groups_total=[group for group in groups_total if not pd.isna(group)]
-            groups_select = sorted([str(value) for idx,value in enumerate(groups_total) if idx < 10]) #user might provide non-string values (e.g. floats)
-
-
-            if len(groups_total) > 10:
-                regex_pattern="|".join(groups_select)
-                df.loc[~df[form_data_dict['groupby_selector_value']].astype(str).str.fullmatch(regex_pattern),
-                       form_data_dict['groupby_selector_value']]="other({})".format(len(groups_total)-len(groups_select))
-                other_cat_name="other({})".format(len(groups_total)-len(groups_select))
-                groups_select.append(other_cat_name)
-            else:
-                other_cat_name = ''
-
-
-
+            traces, groups_select, other_cat_name = grouping if grouping is not None else getGroupCodes(df[form_data_dict['groupby_selector_value']])
+            traces_data_dict = getComponentCounts(df[df_col_name], session['delimiter_symbol'], components, traces, len(groups_select))
 
             fig = make_subplots(specs=[[{"secondary_y": False}]])
             fig.update_layout(title=plot_title, xaxis_title="ID", barmode='group')
             for idx, group in enumerate(groups_select):
-                df_tmp = df[df[form_data_dict['groupby_selector_value']]==group].copy()
-                df_tmp[form_data_dict['groupby_selector_value']].replace(np.nan, 'unknown', inplace=True)
-
-                plot_data_dict=Counter([item for sublist in df_tmp.loc[df_tmp[df_col_name].isnull() == False,df_col_name].str.split(session['delimiter_symbol']).to_list()
-                                    for item in sublist])
+                plot_data_dict = traces_data_dict[idx]
 
                 if 'percent_yscale' in form_data_dict:
                     fig.update_yaxes(title_text="% of trace total", secondary_y=False)
@@ -903,8 +1790,8 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
     elif df_col_name in df.columns.to_list() and df2.empty is False:
         print("RenderBarComponentsPlot: Find components when two groups")
 
-        plot_data_dict=Counter([item for sublist in df.loc[df[df_col_name].isnull() == False,df_col_name].str.split(session['delimiter_symbol']).to_list()
-                                for item in sublist])
+        plot_data_dict=getComponentCounts(df[df_col_name], session['delimiter_symbol'], components)[0]
+        group1_counts = dict(plot_data_dict)
 
         if 'percent_yscale' in form_data_dict:
             fig.update_yaxes(title_text="% of trace total", secondary_y=False)
@@ -919,8 +1806,8 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
         )
 
     
-        plot_data_dict=Counter([item for sublist in df2.loc[df2[df_col_name].isnull() == False,df_col_name].str.split(session['delimiter_symbol']).to_list()
-                                for item in sublist])
+        plot_data_dict=getComponentCounts(df2[df_col_name], session['delimiter_symbol'], components)[0]
+        group2_counts = dict(plot_data_dict)
         if 'percent_yscale' in form_data_dict:
             sum_group_total =  sum(plot_data_dict.values())
             for key in plot_data_dict:
@@ -944,14 +1831,8 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
                                                                                           df2[df_col_name].isna().sum(),
                                                                                           session['delimiter_symbol'])
 
-        unique_categories=sorted(set(fig.data[1].x).union(fig.data[0].x))
-        group1_counts = [fig.data[0].y[fig.data[0].x.index(date)] if date in fig.data[0].x else 0  for date in unique_categories]
-        group2_counts = [fig.data[1].y[fig.data[1].x.index(date)] if date in fig.data[1].x else 0  for date in unique_categories ]
-        if len(group1_counts) >=3 and len(group2_counts)>=3 :
-            corr, pvalue, npoints = calculate_correlation(group1_counts,group2_counts, 'epicurve')
-            jsonPlotsDict['captions'][jsonPlotsDictKey]=jsonPlotsDict['captions'][jsonPlotsDictKey]+ \
-                                                        "\nPearson correlation coefficient between two groups based on the {} data points: {:.3f} (p-value: {:.3e})".format(
-                                                            npoints,corr,pvalue)
+        addComparison(jsonPlotsDict, jsonPlotsDictKey, getAlignedCounts(pd.Series(group1_counts, dtype=np.int64),
+                                                                         pd.Series(group2_counts, dtype=np.int64)))
 
     fig.for_each_trace(
         lambda trace: trace.update(visible='legendonly') if trace.name == "unknown" else ()
@@ -1018,9 +1899,247 @@ def renderBarComponentsPlot(df, df_col_name, form_data_dict, jsonPlotsDict, json
 
 
 
-def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, plot_title, df2=pd.DataFrame(), layout_dict={}):
+def getColumnCodes(series):
+    '''
+    Integer codes of column values and the values they stand for. Categorical columns reuse their dictionary codes,
+    other columns are factorized. Missing values get the -1 code
+    Arguments:
+        series {pandas series} - column values
+    Return:
+        codes {numpy array} - value codes
+        categories {pandas index} - distinct values indexed by code
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories
+    return pd.factorize(series)
+
+
+def getGroupCodes(series, ngroups=10):
+    '''
+    Group by plots option grouping of the selected rows. The ngroups most numerous values are kept as groups (sorted by
+    their text) and the remaining values (and missing values) are lumped into the last other(N) group, so plots aggregate
+    by small integer group codes instead of matching the group values row by row
+    Arguments:
+        series {pandas series} - group by field values of the selected rows
+        ngroups {int} - number of the most numerous values kept as groups
+    Return:
+        codes {numpy array} - group of each row indexing the groups list (-1 for missing values if there is no other group)
+        groups {list} - group names
+        other {string} - name of the group of the remaining values ('' if all values are kept)
+    '''
+    codes, categories = getColumnCodes(series)
+    sizes = np.bincount(codes[codes >= 0], minlength=len(categories))
+    observed = np.flatnonzero(sizes)
+    top = observed[np.argsort(-sizes[observed], kind='stable')][:ngroups]
+    names = np.asarray(categories[top].astype(str), dtype=object) #user might provide non-string values (e.g. floats)
+    order = np.argsort(names, kind='stable')
+    mapping = np.full(len(categories) + 1, -1, dtype=np.int16) #last element maps the missing value code
+    groups, other = names[order].tolist(), ''
+    if len(observed) > len(top):
+        other = "other({})".format(len(observed) - len(top))
+        mapping[:] = len(groups) #the remaining and missing values
+        groups.append(other)
+    mapping[top[order]] = np.arange(len(top))
+    return mapping[codes], groups, other
+
+
+def aggregateSelection(df, columns, groupby=None):
+    '''
+    Aggregation engine of the dashboard plots. Counts the selected rows per value of each plotted column (and per
+    group by value) in a single pass reading each column's codes once, so plot builders consume counts instead of
+    copying and rescanning the selected rows panel by panel
+    Arguments:
+        df {pandas dataframe} - selected rows (Group #1 or Group #2)
+        columns {list} - plotted column names (columns not in the dataframe are skipped)
+        groupby {string} - group by field name (optional)
+    Return:
+        {dict} - counts dataframe per column with the column values (and group by values) and their 'counts'.
+                 Missing values are kept as NaN
+    '''
+    aggregates = {}
+    if groupby is not None:
+        group_codes, group_categories = getColumnCodes(df[groupby])
+        ngroups, group_keys = len(group_categories) + 1, group_codes.astype(np.int64) + 1
+    else:
+        ngroups, group_keys = 1, 0
+    for column in dict.fromkeys(columns):
+        if column not in df.columns:
+            continue
+        codes, categories = getColumnCodes(df[column])
+        counts = np.bincount((codes.astype(np.int64) + 1) * ngroups + group_keys, minlength=(len(categories) + 1) * ngroups)
+        keys = np.flatnonzero(counts)
+        data = {column: np.asarray(pd.Categorical.from_codes(keys // ngroups - 1, categories))}
+        if groupby is not None and groupby != column:
+            data[groupby] = np.asarray(pd.Categorical.from_codes(keys % ngroups - 1, group_categories))
+        data['counts'] = counts[keys]
+        aggregates[column] = pd.DataFrame(data)
+    return aggregates
+
+
+def getDataCubeDimensions(df):
+    '''
+    Integer codes of the data cube dimensions built after the validation mapping (see writeDataCube()): the low cardinality
+    expected categorical fields plotted as histograms (dictionary codes) and the age plot bins (bin number, the open top
+    bin last). Fields with more distinct values than the DATA_CUBE_MAX_CARDINALITY config value are left out and counted
+    from rows. Epidemiological curve weeks are not a dimension: their cardinality is close to the number of rows in
+    combination with the other dimensions, so the curve is counted from the selected dates
+    Arguments:
+        df {pandas dataframe} - mapped dataset with categorical expected fields and the derived '__age_years' column
+    Return:
+        {dict} - dictionary of dimension names and codes per row (-1 for missing values)
+    '''
+    dimensions = {}
+    for column in ['gender', 'source_type', 'source_site', 'geoloc_id', 'primary_type', 'secondary_type']:
+        if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype) and \
+                len(df[column].cat.categories) <= app.config.get('DATA_CUBE_MAX_CARDINALITY', 1000):
+            dimensions[column] = df[column].cat.codes.to_numpy()
+    if '__age_years' in df.columns or 'age' in df.columns:
+        years = getAgeYears(df).astype(np.int64)
+        width, top = app.config.get('AGE_BIN_WIDTH', 5), app.config.get('AGE_BIN_MAX', 105)
+        nbins = len(range(0, top, width))
+        dimensions[getAgeBinDimension()] = np.where(years < 0, -1, np.where(years < top, years // width, nbins))
+    return dimensions
+
+
+def getAgeBinDimension():
+    '''
+    Name of the data cube age bin dimension. The name carries the AGE_BIN_WIDTH and AGE_BIN_MAX config values the bins
+    were built with, so the cube of a dataset stored before the age bins were reconfigured is not used for the age plot
+    Return:
+        {string} - dimension name (e.g. 'age_bin_5_105')
+    '''
+    return 'age_bin_{}_{}'.format(app.config.get('AGE_BIN_WIDTH', 5), app.config.get('AGE_BIN_MAX', 105))
+
+
+def getCubeSelection(cube, df, filter_dict):
+    '''
+    Cells of the data cube selected by the filters. Only value and pattern filters on the cube dimensions can be answered
+    from the cube
+    Arguments:
+        cube {dict} - data cube of the dataset (see loadDataCube())
+        df {pandas dataframe} - dataset (or selected rows) with the categorical columns the cube dimension codes refer to
+        filter_dict {dict} - dictionary with filter values (see extactFilterValuesFromPOST2Dict())
+    Return:
+        {numpy array} - boolean mask of the selected cube cells or None if the filters are not covered by the cube
+    '''
+    if any(filter_dict[key] for key in filter_dict if 'hs_level' in key) or filter_dict.get('hs_path') or \
+            filter_dict['start_date'] or filter_dict['end_date']:
+        return None
+
+    selected = np.ones(cube['counts'].shape[0], dtype=bool)
+    for field in ['primary_type', 'secondary_type', 'genetic_profile', 'phenotypic_profile', 'cluster_id',
+                  'investigation_id', 'source_site', 'source_type', 'geoloc_id']:
+        if filter_dict[field] or field in filter_dict.get('patterns', {}):
+            if field not in cube['columns']:
+                return None
+            codes = getFilterCodes(df[field], filter_dict[field], filter_dict.get('patterns', {}).get(field, []), case=False)
+            selected &= np.isin(cube['codes'][:, cube['columns'].index(field)], codes)
+    return selected
+
+
+def getCubeCounts(cube, df, filter_dict, columns, groupby=None):
+    '''
+    Answer the counts of the selected rows per value of the plotted columns (see aggregateSelection()) from the data cube
+    without reading row level data (see getCubeSelection())
+    Arguments:
+        cube {dict} - data cube of the dataset (see loadDataCube())
+        df {pandas dataframe} - dataset (or selected rows) with the categorical columns the cube dimension codes refer to
+        filter_dict {dict} - dictionary with filter values (see extactFilterValuesFromPOST2Dict())
+        columns {list} - plotted column names (columns that are not cube dimensions are skipped)
+        groupby {string} - group by field name (optional)
+    Return:
+        {dict} - counts dataframe per plotted cube dimension or None if the filters or the group by field are not
+                 covered by the cube (i.e. counts need a row scan)
+    '''
+    if cube is None or (groupby is not None and groupby not in cube['columns']):
+        return None
+    selected = getCubeSelection(cube, df, filter_dict)
+    if selected is None:
+        return None
+    cell_counts = cube['counts'][selected]
+
+    aggregates = {}
+    if groupby is not None:
+        group_categories = df[groupby].cat.categories
+        ngroups = len(group_categories) + 1
+        group_keys = cube['codes'][selected, cube['columns'].index(groupby)].astype(np.int64) + 1
+    else:
+        ngroups, group_keys = 1, 0
+    for column in dict.fromkeys(columns):
+        if column not in cube['columns'] or column not in df.columns:
+            continue
+        categories = df[column].cat.categories
+        codes = cube['codes'][selected, cube['columns'].index(column)].astype(np.int64)
+        counts = np.bincount((codes + 1) * ngroups + group_keys, weights=cell_counts,
+                             minlength=(len(categories) + 1) * ngroups).astype(np.int64)
+        keys = np.flatnonzero(counts)
+        data = {column: np.asarray(pd.Categorical.from_codes(keys // ngroups - 1, categories))}
+        if groupby is not None and groupby != column:
+            data[groupby] = np.asarray(pd.Categorical.from_codes(keys % ngroups - 1, group_categories))
+        data['counts'] = counts[keys]
+        aggregates[column] = pd.DataFrame(data)
+    return aggregates
+
+
+def getCubeAgeBinCounts(cube, df, filter_dict, groupby=None):
+    '''
+    Age bin counts of the selected rows (see getAgeBinCounts()) answered from the data cube age bin dimension
+    (see getAgeBinDimension()) without reading the age of the selected rows
+    Arguments:
+        cube {dict} - data cube of the dataset (see loadDataCube())
+        df {pandas dataframe} - dataset (or selected rows) with the categorical columns the cube dimension codes refer to
+        filter_dict {dict} - dictionary with filter values (see extactFilterValuesFromPOST2Dict())
+        groupby {string} - group by field name (optional)
+    Return:
+        {tuple} - age bin labels, counts per group by value code (rows, the first row for missing values or a single row
+                  without group by field) and age bin (columns), numbers of samples of known and unknown age per row.
+                  None if the filters, the group by field or the age bins are not covered by the cube
+    '''
+    dimension = getAgeBinDimension()
+    if cube is None or dimension not in cube['columns'] or (groupby is not None and groupby not in cube['columns']):
+        return None
+    selected = getCubeSelection(cube, df, filter_dict)
+    if selected is None:
+        return None
+
+    top = app.config.get('AGE_BIN_MAX', 105)
+    labels = getAgeBinLabels()
+    nbins = len(range(0, top, app.config.get('AGE_BIN_WIDTH', 5)))
+    bins = cube['codes'][selected, cube['columns'].index(dimension)].astype(np.int64) + 1 #unknown age first
+    if groupby is not None:
+        ngroups = len(df[groupby].cat.categories) + 1
+        group_keys = cube['codes'][selected, cube['columns'].index(groupby)].astype(np.int64) + 1
+    else:
+        ngroups, group_keys = 1, 0
+    table = np.bincount(group_keys * (nbins + 2) + bins, weights=cube['counts'][selected],
+                        minlength=ngroups * (nbins + 2)).astype(np.int64).reshape(ngroups, nbins + 2)
+    return labels, table[:, 1:len(labels) + 1], table[:, 1:].sum(axis=1), table[:, 0]
+
+
+def getHistogramCounts(df_counts, df_col_name, groupby=None):
+    '''
+    Total the counts per category (and group by value) after values were relabelled (e.g. as 'unknown') so histograms
+    are sent as category/count bar traces instead of a value per sample binned in the browser
+    Arguments:
+        df_counts {pandas dataframe} - counts of a plot column (see aggregateSelection())
+        df_col_name {string} - field name of the plot categories (e.g. 'geoloc_id')
+        groupby {string} - group by field name (optional)
+    Return:
+        {pandas dataframe} - categories (and group by values) with 'counts' and 'percent' of the trace (group by value) total
+    '''
+    if groupby is None:
+        df_counts = df_counts.groupby(df_col_name, sort=False, dropna=False)['counts'].sum().reset_index()
+        df_counts['percent'] = df_counts['counts'] / df_counts['counts'].sum() * 100
+        return df_counts
+    df_counts = df_counts.groupby(list(dict.fromkeys([groupby, df_col_name])), sort=False, dropna=False)['counts'].sum().reset_index()
+    df_counts['percent'] = df_counts['counts'] / df_counts.groupby(groupby, sort=False, dropna=False)['counts'].transform('sum') * 100
+    return df_counts
+
+
+def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, plot_title, df2=pd.DataFrame(), layout_dict={},
+                   counts=None, counts2=None, grouping=None):
     """Render a historgram plot on categorical variables. This is the most frequently used function to plot rendering 
-    Given a column name by 'df_col_name' and input dataset stored in 'df' render a plot via px.histogram() Plotly function
+    Given a column name by 'df_col_name' and input dataset stored in 'df' render a plot of category counts via px.bar() Plotly function
 
     Arguments:
         df (pandas dataframe): a copy of the a dataframe to plot representing either a complete or filtred input dataset (Group #1)
@@ -1032,56 +2151,49 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
         plot_title (string):   a string used to assign initial plot title to the resulting figure
         df2 (pandas dataframe, optional): A copy of the Group #2 pandas dataframe representing the second dataset to create traces on
         layout_dict (dict, optional): A dictionary of with Plotly Layout directives such as forcing vertical x-axis tick labels {'xaxis.tickangle':90}. Defaults to {}.
+        counts (pandas dataframe, optional): Group #1 counts of the 'df_col_name' values (and group by values) computed by aggregateSelection()
+                                             or getCubeCounts(). Calculated from 'df' if not provided
+        counts2 (pandas dataframe, optional): Group #2 counts of the 'df_col_name' values computed by aggregateSelection()
+        grouping (tuple, optional): group by mode grouping of the 'df' rows computed by getSelectionGrouping(). Calculated from 'df' if not provided
     """
     print("renderHistPlot '{}': df1 shape {}; df2 shape: {}".format(df_col_name, df.shape, df2.shape))
-    if df_col_name in df.columns.to_list() and df2.empty is True:
+    #columns counted by the data cube are not part of the selected rows
+    plotted = counts is not None or df_col_name in df.columns.to_list()
+    if plotted and df2.empty is True:
         print("{} abundances barplot being rendered ...".format(df_col_name))
+        groupby = form_data_dict['groupby_selector_value'] if 'groupby_selector_value' in form_data_dict else None
+        if counts is None:
+            counts = aggregateSelection(df, [df_col_name], groupby)[df_col_name]
 
-        if any(not element for element in df[df_col_name].isna()):
+        if counts[df_col_name].notna().any():
             # standardize the filed names in case they are long or have non-informative information (e.g. empty antigenic formula)
-            df.loc[df[df_col_name] == 0, df_col_name] = 'unknown'
-            df.loc[df[df_col_name] == '-:-:-', df_col_name] = 'unknown'
-            df.fillna('unknown',inplace=True)
-            n_unknown = sum(df[df_col_name] == 'unknown')
-            #n_unknown = df[df_col_name].isna().sum()
+            counts.loc[counts[df_col_name] == 0, df_col_name] = 'unknown'
+            counts.loc[counts[df_col_name] == '-:-:-', df_col_name] = 'unknown'
+            counts.fillna('unknown',inplace=True)
+            n_unknown = counts.loc[counts[df_col_name] == 'unknown', 'counts'].sum()
             
-            if 'groupby_selector_value' in form_data_dict:
-                print("renderHistPlot() group by mode on value: {}".format(form_data_dict['groupby_selector_value']))
-                
-                if any(df[form_data_dict['groupby_selector_value']].isna()):
-                    df[form_data_dict['groupby_selector_value']].replace(np.nan, 'unknown', inplace=True)
-
-                groups_total = df[~df.isin(['unknown'])].groupby(
-                    form_data_dict['groupby_selector_value']).size().reset_index(
-                    name='counts').sort_values(by='counts', ascending=False)[form_data_dict['groupby_selector_value']].to_list()
-                #print(groups_total)
-                #groups_total = [g for g in groups_total if g != 'unknown']
-                groups_select = sorted([re.sub(r'\.','\\.',str(value))for idx,value in enumerate(groups_total) if idx < 10]) #user might provide non-string values (e.g. floats)
-
-                
-
-                if len(groups_total) > 10:
-                    regex_pattern = "|".join(groups_select)
-                    print(regex_pattern)
-                    df.loc[~df[form_data_dict['groupby_selector_value']].astype(str).str.fullmatch(regex_pattern),
-                       form_data_dict['groupby_selector_value']]='other({})'.format(len(groups_total)-len(groups_select))
-
+            if groupby is not None:
+                print("renderHistPlot() group by mode on value: {}".format(groupby))
+                #values outside of the shared top groups (see getSelectionGrouping()) are relabeled to the other group
+                _, groups, other_cat_name = grouping if grouping is not None else getGroupCodes(df[groupby])
+                if other_cat_name:
+                    counts.loc[~counts[groupby].astype(str).isin(groups[:-1]), groupby] = other_cat_name
 
                 #print(form_data_dict)
+                df_counts = getHistogramCounts(counts, df_col_name, groupby)
                 if 'percent_yscale' in form_data_dict:
                     print("Percent scale selected")
-                    fig = px.histogram(df, x=df_col_name,
+                    fig = px.bar(df_counts, x=df_col_name, y='percent',
                                        title=plot_title,
-                                       color=form_data_dict['groupby_selector_value'],
-                                       height=600,
-                                       histnorm='percent')
+                                       color=groupby,
+                                       height=600)
                     fig.layout['yaxis']['title']='% of trace total'
                     fig.update_layout({'barmode':'relative'})
                     fig.update_yaxes(type='linear')
                     print("Done")
                 else:
-                    fig = px.histogram(df,
-                                       x=df_col_name, color=form_data_dict['groupby_selector_value'],
+                    fig = px.bar(df_counts,
+                                       x=df_col_name, y='counts', color=groupby,
                                        title=plot_title,
                                        height=600)
                     fig.update_layout(barmode='relative')
@@ -1090,7 +2202,9 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
                     else:
                         fig.update_yaxes(type='linear')
 
-                fig.data=[fig.data[idx] for idx in np.argsort([i.name for i in fig.data])] #order alphabetically
+                #order as the groups (i.e. alphabetically with the other group last) followed by the unknown trace
+                fig.data=[fig.data[idx] for idx in sorted(range(len(fig.data)), key=lambda idx: (
+                    groups.index(fig.data[idx].name) if fig.data[idx].name in groups else len(groups), fig.data[idx].name))]
                 for idx,trace in enumerate(fig.data):
                     #print(idx,trace.name, len(px.colors.qualitative.Plotly))
                     if idx >= len(px.colors.qualitative.Plotly)-1: #there are 10 colours, so if idx is greater repeat again colours
@@ -1103,14 +2217,14 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
                     else:
                         trace.marker.color= px.colors.qualitative.Plotly[idx]
             else:
+                df_counts = getHistogramCounts(counts, df_col_name)
                 if 'percent_yscale' in form_data_dict:
-                    fig = px.histogram(df, x=df_col_name,
+                    fig = px.bar(df_counts, x=df_col_name, y='percent',
                                        title=plot_title,
-                                       height=600,
-                                       histnorm='percent')
+                                       height=600)
                     fig.update_yaxes(title_text="% of trace total", secondary_y=False, type='linear')
                 else:
-                    fig = px.histogram(df, x=df_col_name,
+                    fig = px.bar(df_counts, x=df_col_name, y='counts',
                                        title=plot_title,
                                        height=600)
                     if 'log_yscale' in form_data_dict:
@@ -1174,49 +2288,50 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
             jsonPlotsDict['captions'][jsonPlotsDictKey] = "The plot of \'{}\' field composed of {} categories " \
                                                           "distributed across {} samples (with {} missing samples).".format(
                 df_col_name,
-                df[df[df_col_name].isna() == False][df_col_name].unique().size,
-                df.shape[0],
-                df[df[df_col_name].isna() == True].shape[0]+n_unknown)
+                counts[df_col_name].unique().size,
+                counts['counts'].sum(),
+                n_unknown)
         else:
             print("{} has no valid values to build bar plot on".format(df_col_name))
             flash('Barplot would not be rendered on {}.'.format(df_col_name))
             jsonPlotsDict['figures'][jsonPlotsDictKey] = '{}'
             jsonPlotsDict['captions'][jsonPlotsDictKey] = '{}'
-    elif df_col_name in df.columns.to_list() and df2.empty is False:
+    elif plotted and df2.empty is False:
         print("Two groups case ...")
-        df.loc[df[df_col_name] == 0, df_col_name] = 'unknown'
-        df.loc[df[df_col_name] == '-:-:-', df_col_name] = 'unknown'
-        df.fillna('unknown',inplace=True)
-
-        n_unknown = sum(df[df_col_name] == 'unknown')
-        df2.loc[df2[df_col_name] == 0, df_col_name] = 'unknown'
-        df2.loc[df2[df_col_name] == '-:-:-', df_col_name] = 'unknown'
-        df2.fillna('unknown',inplace=True)
-        n_unknown2 = sum(df2[df_col_name] == 'unknown')
+        if counts is None:
+            counts = aggregateSelection(df, [df_col_name])[df_col_name]
+        if counts2 is None:
+            counts2 = aggregateSelection(df2, [df_col_name])[df_col_name]
+        for group_counts in [counts, counts2]:
+            group_counts.loc[group_counts[df_col_name] == 0, df_col_name] = 'unknown'
+            group_counts.loc[group_counts[df_col_name] == '-:-:-', df_col_name] = 'unknown'
+            group_counts.fillna('unknown',inplace=True)
+        n_unknown = counts.loc[counts[df_col_name] == 'unknown', 'counts'].sum()
+        n_unknown2 = counts2.loc[counts2[df_col_name] == 'unknown', 'counts'].sum()
 
         fig=make_subplots(specs=[[{"secondary_y": False}]])
         fig.update_layout(title=plot_title, xaxis_title="ID",barmode='group', xaxis={'type': 'category'})
+        df_counts, df2_counts = getHistogramCounts(counts, df_col_name), getHistogramCounts(counts2, df_col_name)
 
         if 'percent_yscale' in form_data_dict:
             fig.add_trace(
-                go.Histogram(x=df[df_col_name],
-                             name="Group #1", histnorm='percent',
+                go.Bar(x=df_counts[df_col_name], y=df_counts['percent'],
+                             name="Group #1",
                              showlegend=True)
             )
             fig.add_trace(
-                go.Histogram(x=df2[df_col_name],
-                             histnorm='percent',
+                go.Bar(x=df2_counts[df_col_name], y=df2_counts['percent'],
                              name="Group #2", showlegend=True)
             )
             fig.update_yaxes(title_text="% of trace total", secondary_y=False, type='linear')
         else:
             print('Adding traces')
             fig.add_trace(
-                go.Histogram(x=df[df_col_name],
+                go.Bar(x=df_counts[df_col_name], y=df_counts['counts'],
                        name="Group #1", showlegend=True)
             )
             fig.add_trace(
-                go.Histogram(x=df2[df_col_name],
+                go.Bar(x=df2_counts[df_col_name], y=df2_counts['counts'],
                              name="Group #2", showlegend=True)
             )
             if 'log_yscale' in form_data_dict:
@@ -1279,27 +2394,19 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
                                                       "distributed across {} samples (with {} missing samples);\n" \
                                                       "b) Group #2 with {} categories distributed across {} samples (with {} missing samples).".format(
             df_col_name,
-            df[df[df_col_name].isna() == False][df_col_name].unique().size,
-            df.shape[0],
-            df[df[df_col_name].isna() == True].shape[0]+n_unknown,
-            df2[df2[df_col_name].isna() == False][df_col_name].unique().size,
-            df2.shape[0]+n_unknown2,
-            df2[df2[df_col_name].isna() == True].shape[0]
+            counts[df_col_name].unique().size,
+            counts['counts'].sum(),
+            n_unknown,
+            counts2[df_col_name].unique().size,
+            counts2['counts'].sum(),
+            n_unknown2
         )
         fig.update_layout(layout_dict)
 
-        print("Pearson correlation coefficient calculation ")
-        unique_categories=[i for i in set(fig.data[0].x).union(fig.data[1].x) if i != None] #remove note defined None category
-        group1_counts_dict = Counter(fig.data[0].x)
-        group1_counts= [group1_counts_dict[key_profile] for key_profile in unique_categories]
-        group2_counts_dict = Counter(fig.data[1].x)
-        group2_counts= [group2_counts_dict[key_profile] for key_profile in unique_categories]
-
-        if len(group1_counts) >=3 and len(group2_counts)>=3 :
-            corr, pvalue, npoints = calculate_correlation(group1_counts,group2_counts, df_col_name)
-            jsonPlotsDict['captions'][jsonPlotsDictKey]=jsonPlotsDict['captions'][jsonPlotsDictKey]+\
-                                                    "\nPearson correlation coefficient between two groups based on the {} data points: {:.3f} (p-value: {:.3e})".format(
-            npoints,corr,pvalue)
+        # two groups statistics are calculated on the aligned category counts once all plots are rendered
+        comparison = getAlignedCounts(df_counts.set_index(df_col_name)['counts'], df2_counts.set_index(df_col_name)['counts'])
+        if len(comparison[0]) >= 3:
+            addComparison(jsonPlotsDict, jsonPlotsDictKey, comparison)
         else:
             jsonPlotsDict['captions'][jsonPlotsDictKey] = '{}'
         print("Done rendering")
@@ -1308,7 +2415,67 @@ def renderHistPlot(df, df_col_name, form_data_dict, jsonPlotsDict, jsonPlotsDict
         jsonPlotsDict['figures'][jsonPlotsDictKey] = '{}'
         jsonPlotsDict['captions'][jsonPlotsDictKey] = '{}'
 
-def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, df2=pd.DataFrame()):
+def getEpiCurveBins(dates):
+    '''
+    Weekly bins of the epidemiological curve. Dates fall into the week ending on Monday they belong to, i.e. the same
+    Tuesday to Monday bins labelled by their Monday as pd.Grouper(freq='W-MON')
+    Arguments:
+        dates {pandas series} - parsed dates without missing values
+    Return:
+        {pandas series} - bin label (Monday) of each date
+    '''
+    day_ns = 86400 * 10**9
+    days = -(-dates.to_numpy(dtype='datetime64[ns]').astype(np.int64) // day_ns) #days since 1970-01-01 (a Thursday) rounded up
+    return pd.Series(((days + (4 - days) % 7) * day_ns).astype('datetime64[ns]'), index=dates.index)
+
+
+def getEpiCurveCalendar(bins):
+    '''
+    Dense week, month and year labels of the calendar years spanned by the epidemiological curve weekly bins
+    Arguments:
+        bins {pandas series} - bin label dates (see getEpiCurveBins())
+    Return:
+        {tuple} - lists of week ('2021/01' ... '2021/53'), month ('2021/1' ... '2021/12') and year ('2021') labels
+    '''
+    years = range(bins.min().year, bins.max().year + 1)
+    return ([str(y) + "/" + str(w).zfill(2) for y in years for w in range(1, 53 + 1)], #zero padded weeks sort correctly by name
+            [str(y) + "/" + str(m) for y in years for m in range(1, 12 + 1)],
+            [str(y) for y in years])
+
+
+def getEpiCurveSeries(bin_counts, calendar, percent=False):
+    '''
+    Aggregate sample counts of the weekly bins into the daily (weekly bins), weekly, monthly and yearly epidemiological
+    curve series by one grouped sum per time unit reindexed to the dense calendar labels
+    Arguments:
+        bin_counts {pandas series} - sample counts indexed by sorted bin label dates (see getEpiCurveBins())
+        calendar {tuple} - week, month and year labels (see getEpiCurveCalendar())
+        percent {bool} - convert counts to percent of the series total
+    Return:
+        {dict} - 'daily' x (bin label dates between the first and last bin) and y values and 'weekly', 'monthly' and
+                 'yearly' y values aligned to the calendar labels. 'counts' are the daily sample counts indexed by the dates
+    '''
+    data_x_week_year, data_x_month_year, data_x_year = calendar
+    if bin_counts.empty:
+        daily = pd.Series([], index=pd.DatetimeIndex([]), dtype=np.int64)
+    else:
+        daily = bin_counts.reindex(pd.date_range(bin_counts.index.min(), bin_counts.index.max(), freq='7D'), fill_value=0)
+    labels = daily.index
+    weeks = np.where((labels.month == 12) & (labels.day == 31), 53, labels.isocalendar()['week'].to_numpy()) # as ISO will assing week 1 to December 31st dates
+    series = {'counts': daily,
+              'daily': {'x': pd.Series(labels), 'y': daily.reset_index(drop=True)},
+              'weekly': daily.groupby([str(y) + "/" + str(w).zfill(2) for y, w in zip(labels.year, weeks)]).sum(),
+              'monthly': daily.groupby([str(y) + "/" + str(m) for y, m in zip(labels.year, labels.month)]).sum(),
+              'yearly': daily.groupby(labels.year.astype(str)).sum()}
+    for key, labels in [('weekly', data_x_week_year), ('monthly', data_x_month_year), ('yearly', data_x_year)]:
+        values = series[key].reindex(labels, fill_value=0).to_numpy()
+        series[key] = (values / max(values.sum(), 1) * 100 if percent else values).tolist()
+    if percent:
+        series['daily']['y'] = (series['daily']['y'] / max(series['daily']['y'].sum(), 1) * 100).tolist()
+    return series
+
+
+def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictKey, df2=pd.DataFrame(), grouping=None):
     """Render an epidemiological curve based on a selected time-series variable (e.g. collection date).
     Create Day, Week, Month and Year views by carefully transforming data
 
@@ -1321,6 +2488,7 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
         jsonPlotsDictKey (string): a string identifying the plot key associated with the plot to store caption information and access figure object
                                    in the jsonPlotsDict dictionary
         df2 (pandas dataframe, optional): A copy of the Group #2 pandas dataframe representing the second dataset to create traces on. Defaults to pd.DataFrame().
+        grouping (tuple, optional): group by mode grouping of the 'df' rows computed by getSelectionGrouping(). Calculated from 'df' if not provided
 
     Returns:
         ValueError: raises a value error if 'x_time_var' variable is not defined or filtred dataframe is empty due to missing data or corresponding column does not exist in data
@@ -1366,80 +2534,48 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
                           barmode='stack', legend={'traceorder':'normal'}
                           ) #initial plot to be shown
 
-        df[x_time_var]=pd.to_datetime(df[x_time_var],errors='coerce') #convert to date
-        idx_date_ok = pd.to_datetime(df['date'], errors='coerce').notnull()
+        df[x_time_var]=parseDates(df[x_time_var]) #convert to date if not parsed at mapping time
+        idx_date_ok = df[x_time_var].notnull()
         if False in idx_date_ok.value_counts():
             df1_n_missing = idx_date_ok.value_counts()[False]
         else:
             df1_n_missing=0
         
 
-        df_filtered = df.loc[idx_date_ok].groupby(
-            pd.Grouper(key=x_time_var, axis=0, freq='W-MON')).size().reset_index(name="counts")
+        bins = getEpiCurveBins(df.loc[idx_date_ok, x_time_var])
 
-        if df_filtered.empty:
+        if bins.empty:
             return ValueError('Empty datetime dataframe on {}'.format(x_time_var))
 
-        df_filtered["week"] = df_filtered[x_time_var].dt.isocalendar().week
-        df_filtered["day"] = df_filtered[x_time_var].dt.day
-        df_filtered["month"] = df_filtered[x_time_var].dt.month
-        df_filtered["year"] = df_filtered[x_time_var].dt.year
-        df_filtered.loc[df_filtered.eval(
-            "day==31 & month==12"), "week"] = 53  # as ISO will assing week 1 to December 31st dates
-        data_x_week_year = [str(y) + "/0" + str(w) if w < 10 else str(y) + "/" + str(w)  for y in
-                            range(min(df_filtered["year"]), max(df_filtered["year"] + 1))
-                            for w in range(1, 53 + 1)] #addition to zero to week values < 10 guarantees correct name sorting
-        data_x_month_year = [str(y) + "/" + str(m) for y in
-                             range(min(df_filtered["year"]), max(df_filtered["year"] + 1)) for m in
-                             range(1, 12 + 1)]
-        data_x_year = [str(y) for y in range(min(df_filtered["year"]), max(df_filtered["year"] + 1))]
+        calendar = getEpiCurveCalendar(bins)
+        data_x_week_year, data_x_month_year, data_x_year = calendar
 
         if 'groupby_selector_value' in form_data_dict:
             fig.update_layout(legend_title_text=form_data_dict['groupby_selector_value'])
             fig.layout['yaxis']['title']='count'
-            df_filtered = df.loc[idx_date_ok]
             group_plot_vals_dict={}
             group_plot_vals_dict['daily']={'x':[],'y':[]}
-            group_plot_vals_dict['weekly']={'x':[],'y':[]}
-            group_plot_vals_dict['monthly']={'x':[],'y':[]}
-            group_plot_vals_dict['yearly']={'x':[],'y':[]}
+            group_plot_vals_dict['weekly']={'x':data_x_week_year,'y':[]}
+            group_plot_vals_dict['monthly']={'x':data_x_month_year,'y':[]}
+            group_plot_vals_dict['yearly']={'x':data_x_year,'y':[]}
 
-            # get top 9 sub-categories and the rest lump into others category
-            groups_total = df.groupby(
-                form_data_dict['groupby_selector_value']).size().reset_index(
-                name='counts').sort_values(by='counts', ascending=False)[form_data_dict['groupby_selector_value']].to_list()
-            groups_select = sorted([value for idx,value in enumerate(groups_total) if idx < 10])
-            if len(groups_total) > 10:
-                n_other_categories = len(groups_total)-len(groups_select)
-                groups_select.append('other({})'.format(n_other_categories))
+            # top 10 sub-categories and the rest lumped into the other category (shared by the group by mode plots)
+            group_codes, groups_select, other_cat_name = grouping if grouping is not None else getGroupCodes(df[form_data_dict['groupby_selector_value']])
+            traces = group_codes[idx_date_ok.to_numpy()] #trace of each dated sample
+            # counts of all traces weekly bins in a single grouped aggregation
+            trace_bin_counts = bins.groupby([traces, bins.to_numpy()]).size()
+            trace_bin_counts = {trace: counts.droplevel(0) for trace, counts in trace_bin_counts.groupby(level=0)}
 
 
-            groups_select_df_index = []
             other_group_idx = None #other category index for grey color setting
             for group_idx, group in enumerate(groups_select):
                 print("Processing groupby sub-category: {}".format(groups_select[group_idx]))
-                if re.search(r'other',group): #last index
-                    df_tmp=df_filtered.loc[~df_filtered.index.isin(set(groups_select_df_index))].groupby(
-                        pd.Grouper(key=x_time_var, axis=0, freq='W-MON')).size().reset_index(name="counts") #get complement of indices (the remainder not captured in groups)
+                if group == other_cat_name: #last index
                     other_group_idx=group_idx
-                else:
-                    df_tmp = df_filtered.loc[df_filtered[form_data_dict['groupby_selector_value']] == group].groupby(
-                        pd.Grouper(key=x_time_var, axis=0, freq='W-MON')).size().reset_index(name="counts")
-                    groups_select_df_index = groups_select_df_index + df_tmp.index.to_list()
-
-                df_tmp["week"] = df_tmp[x_time_var].dt.isocalendar().week
-                df_tmp["day"] = df_tmp[x_time_var].dt.day
-                df_tmp["month"] = df_tmp[x_time_var].dt.month
-                df_tmp["year"] = df_tmp[x_time_var].dt.year
-
-                if 'percent_yscale' in form_data_dict:
-                    sum_total=sum(df_tmp["counts"])
-                    group_plot_vals_dict['daily']['y'].append([i/sum_total*100 for i in df_tmp["counts"].to_list()])
-                    group_plot_vals_dict['daily']['x'].append(df_tmp[x_time_var])
-                else:
-                    group_plot_vals_dict['daily']['x'].append(df_tmp[x_time_var])
-                    group_plot_vals_dict['daily']['y'].append(df_tmp["counts"])
-
+                series = getEpiCurveSeries(trace_bin_counts.get(group_idx, pd.Series([], dtype=np.int64)), calendar,
+                                           percent='percent_yscale' in form_data_dict)
+                group_plot_vals_dict['daily']['x'].append(series['daily']['x'])
+                group_plot_vals_dict['daily']['y'].append(series['daily']['y'])
 
                 fig.add_trace(
                     go.Bar(x=group_plot_vals_dict['daily']['x'][group_idx], y=group_plot_vals_dict['daily']['y'][group_idx],
@@ -1453,43 +2589,10 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
                     lambda trace: trace.update(visible='legendonly') if trace.name == "unknown" else ()
                 )
 
-                data_y_month_year = [0] * len(data_x_month_year)
-                for idx, item in enumerate(data_x_month_year):
-                    y, m = [int(i) for i in item.split('/')]
-                    # result_df = df_filtered.query("month == "+m+" &  year == "+y)
-                    result_df = df_tmp.loc[(df_tmp["month"] == m) & (df_tmp["year"] == y)]
-                    if result_df.empty == False:
-                        data_y_month_year[idx] = sum(result_df["counts"])
-
-                group_plot_vals_dict['monthly']['x']=data_x_month_year
-                group_plot_vals_dict['monthly']['y'].append(data_y_month_year)
-
-
-                data_y_week_year = [0] * len(data_x_week_year)
-                for idx, item in enumerate(data_x_week_year):
-                    y, w = [int(i) for i in item.split('/')]
-                    result_df = df_tmp.loc[(df_tmp["week"] == w) & (df_tmp["year"] == y)]
-                    if result_df.empty == False:
-                        data_y_week_year[idx] = sum(result_df["counts"])
-
-                group_plot_vals_dict['weekly']['x']=data_x_week_year
-                group_plot_vals_dict['weekly']['y'].append(data_y_week_year)
-
-                data_y_year = [0] * len(data_x_year)
-                for idx, y in enumerate(data_x_year):
-                    result_df = df_tmp.loc[df_tmp["year"] == int(y)]
-                    if result_df.empty == False:
-                        data_y_year[idx] = sum(result_df["counts"])
-                group_plot_vals_dict['yearly']['x']=data_x_year
-                group_plot_vals_dict['yearly']['y'].append(data_y_year)
-
+                group_plot_vals_dict['weekly']['y'].append(series['weekly'])
+                group_plot_vals_dict['monthly']['y'].append(series['monthly'])
+                group_plot_vals_dict['yearly']['y'].append(series['yearly'])
                 if 'percent_yscale' in form_data_dict:
-                    sum_total=sum(group_plot_vals_dict['weekly']['y'][group_idx])
-                    group_plot_vals_dict['weekly']['y'][group_idx]=[i/sum_total*100 for i in group_plot_vals_dict['weekly']['y'][group_idx]]
-                    sum_total=sum(group_plot_vals_dict['monthly']['y'][group_idx])
-                    group_plot_vals_dict['monthly']['y'][group_idx]=[i/sum_total*100 for i in group_plot_vals_dict['monthly']['y'][group_idx]]
-                    sum_total=sum(group_plot_vals_dict['yearly']['y'][group_idx])
-                    group_plot_vals_dict['yearly']['y'][group_idx]=[i/sum_total*100 for i in group_plot_vals_dict['yearly']['y'][group_idx]]
                     fig.layout['yaxis']['title']='% of trace total'
 
 
@@ -1581,33 +2684,9 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
                 df[x_time_var].isna().sum())
             return 0 #finish function execution as group by has finished processing
 
-        data_y_week_year = [0] * len(data_x_week_year)
-
-        for idx, item in enumerate(data_x_week_year):
-            y, w = [int(i) for i in item.split('/')]
-            result_df = df_filtered.loc[(df_filtered["week"] == w) & (df_filtered["year"] == y)]
-            if result_df.empty == False:
-                data_y_week_year[idx] = sum(result_df["counts"])
-
-
-        data_y_month_year = [0] * len(data_x_month_year)
-
-        for idx, item in enumerate(data_x_month_year):
-            y, m = [int(i) for i in item.split('/')]
-            # result_df = df_filtered.query("month == "+m+" &  year == "+y)
-            result_df = df_filtered.loc[(df_filtered["month"] == m) & (df_filtered["year"] == y)]
-            if result_df.empty == False:
-                data_y_month_year[idx] = sum(result_df["counts"])
-
-
-        data_y_year = [0] * len(data_x_year)
-
-        for idx, y in enumerate(data_x_year):
-            # result_df = df_filtered.query("month == "+m+" &  year == "+y)
-            result_df = df_filtered.loc[df_filtered["year"] == int(y)]
-            if result_df.empty == False:
-                data_y_year[idx] = sum(result_df["counts"])
-
+        series = getEpiCurveSeries(bins.value_counts().sort_index(), calendar, percent='percent_yscale' in form_data_dict)
+        df_filtered = pd.DataFrame({x_time_var: series['daily']['x'], 'counts': series['daily']['y']})
+        data_y_week_year, data_y_month_year, data_y_year = series['weekly'], series['monthly'], series['yearly']
 
         # create graph objects from pre-calculated data
         fig = make_subplots(specs=[[{"secondary_y": False}]])
@@ -1615,14 +2694,6 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
         fig.update_yaxes(title_text="counts", secondary_y=False)
 
         if 'percent_yscale' in form_data_dict:
-            sum_total=sum(df_filtered['counts'].to_list())
-            df_filtered['counts']=[i/sum_total*100 for i in df_filtered['counts'].to_list()]
-            sum_total=sum(data_y_week_year)
-            data_y_week_year=[i/sum_total*100 for i in data_y_week_year]
-            sum_total=sum(data_y_month_year)
-            data_y_month_year=[i/sum_total*100 for i in data_y_month_year]
-            sum_total=sum(data_y_year)
-            data_y_year=[i/sum_total*100 for i in data_y_year]
             fig.layout['yaxis']['title']='% of trace total'
 
 
@@ -1717,61 +2788,21 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
         # if group#2 are selected the second subset rendering
         if df2.empty is False:
             fig.update_layout({'showlegend': True})
-            df2[x_time_var]=pd.to_datetime(df2[x_time_var],errors='coerce') #convert to date
-            idx_date_ok_df2 = pd.to_datetime(df2['date'], errors='coerce').notnull()
+            df2[x_time_var]=parseDates(df2[x_time_var]) #convert to date if not parsed at mapping time
+            idx_date_ok_df2 = df2[x_time_var].notnull()
             if False in idx_date_ok_df2.value_counts():
-                df2_n_missing = idx_date_ok.value_counts()[False]
+                df2_n_missing = idx_date_ok_df2.value_counts()[False]
             else:
                 df2_n_missing=0
-            df2_filtered = df2.loc[idx_date_ok_df2].groupby(
-                pd.Grouper(key=x_time_var, axis=0, freq='W-MON')).size().reset_index(name="counts")
-            df2_filtered["week"] = df2_filtered[x_time_var].dt.isocalendar().week
-            df2_filtered["day"] = df2_filtered[x_time_var].dt.day
-            df2_filtered["month"] = df2_filtered[x_time_var].dt.month
-            df2_filtered["year"] = df2_filtered[x_time_var].dt.year
-            df2_filtered.loc[df2_filtered.eval(
-                "day==31 & month==12"), "week"] = 53  # as ISO will assing week 1 to December 31st dates
-            data2_x_week_year = [str(y) + "/0" + str(w) if w<10 else str(y) + "/" + str(w) for y in
-                                range(min(df2_filtered["year"]), max(df2_filtered["year"] + 1))
-                                for w in range(1, 53 + 1)]
-            data2_x_month_year = [str(y) + "/" + str(m) for y in
-                             range(min(df2_filtered["year"]), max(df2_filtered["year"] + 1)) for m in
-                             range(1, 12 + 1)]
-            data2_x_year = [str(y) for y in range(min(df2_filtered["year"]), max(df2_filtered["year"] + 1))]
-
-            data2_y_week_year = [0] * len(data2_x_week_year)
-            for idx, item in enumerate(data2_x_week_year):
-                y, w = [int(i) for i in item.split('/')]
-                # result_df = df_filtered.query("week == "+w+" &  year == "+y)
-                result_df = df2_filtered.loc[(df2_filtered["week"] == w) & (df2_filtered["year"] == y)]
-                if result_df.empty == False:
-                    data2_y_week_year[idx] = sum(result_df["counts"])
-
-            data2_y_month_year = [0] * len(data2_x_month_year)
-            for idx, item in enumerate(data2_x_month_year):
-                y, m = [int(i) for i in item.split('/')]
-                # result_df = df_filtered.query("month == "+m+" &  year == "+y)
-                result_df = df2_filtered.loc[(df2_filtered["month"] == m) & (df2_filtered["year"] == y)]
-                if result_df.empty == False:
-                    data2_y_month_year[idx] = sum(result_df["counts"])
-
-            data2_y_year = [0] * len(data2_x_year)
-            for idx, y in enumerate(data2_x_year):
-                # result_df = df_filtered.query("month == "+m+" &  year == "+y)
-                result_df = df2_filtered.loc[df2_filtered["year"] == int(y)]
-                if result_df.empty == False:
-                    data2_y_year[idx] = sum(result_df["counts"])
+            bins2 = getEpiCurveBins(df2.loc[idx_date_ok_df2, x_time_var])
+            calendar2 = getEpiCurveCalendar(bins2) if bins2.empty == False else ([], [], [])
+            data2_x_week_year, data2_x_month_year, data2_x_year = calendar2
+            series2 = getEpiCurveSeries(bins2.value_counts().sort_index(), calendar2, percent='percent_yscale' in form_data_dict)
+            df2_filtered = pd.DataFrame({x_time_var: series2['daily']['x'], 'counts': series2['daily']['y']})
+            data2_y_week_year, data2_y_month_year, data2_y_year = series2['weekly'], series2['monthly'], series2['yearly']
 
             if 'percent_yscale' in form_data_dict:
                 fig.layout.yaxis.title.text = '% of trace total'
-                sum_total=sum(df2_filtered['counts'].to_list())
-                df2_filtered['counts']=[i/sum_total*100 for i in df2_filtered['counts'].to_list()]
-                sum_total=sum(data2_y_week_year)
-                data2_y_week_year=[i/sum_total*100 for i in data2_y_week_year]
-                sum_total=sum(data_y_month_year)
-                data2_y_month_year=[i/sum_total*100 for i in data2_y_month_year]
-                sum_total=sum(data2_y_year)
-                data2_y_year=[i/sum_total*100 for i in data2_y_year]
 
             fig.add_trace(
                 go.Bar(x=df2_filtered[x_time_var], y=df2_filtered["counts"],
@@ -1866,21 +2897,8 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
                 df2_n_missing
 
             )
-            unique_categories=sorted(set(fig.data[1].x).union(fig.data[0].x))
-            
-            if isinstance(fig.data[0].x, tuple):
-                group1_counts = [fig.data[0].y[fig.data[0].x.index(date)] if date in fig.data[0].x else 0  for date in unique_categories ]
-                group2_counts = [fig.data[1].y[fig.data[1].x.index(date)] if date in fig.data[1].x else 0  for date in unique_categories ]
-            else:     
-                group1_counts = [fig.data[0].y[np.where(fig.data[0].x == date)[0][0]] if date in fig.data[0].x else 0  for date in unique_categories]
-                group2_counts = [fig.data[1].y[np.where(fig.data[1].x == date)[0][0]] if date in fig.data[1].x else 0  for date in unique_categories ]
-
-            
-            if len(group1_counts) >=3 and len(group2_counts)>=3 :
-                corr, pvalue, npoints = calculate_correlation(group1_counts,group2_counts, 'epicurve')
-                jsonPlotsDict['captions'][jsonPlotsDictKey]=jsonPlotsDict['captions'][jsonPlotsDictKey]+ \
-                                                        "\nPearson correlation coefficient between two groups based on the {} data points: {:.3f} (p-value: {:.3e})".format(
-                                                            npoints,corr,pvalue)
+            categories, group1_counts, group2_counts = getAlignedCounts(series['counts'], series2['counts'])
+            addComparison(jsonPlotsDict, jsonPlotsDictKey, (categories.strftime('%Y-%m-%d'), group1_counts, group2_counts))
 
         if 'log_yscale' in form_data_dict:
             fig.update_yaxes(type='log', title='counts')
@@ -1895,10 +2913,11 @@ def renderEpiCurve(df, x_time_var, form_data_dict, jsonPlotsDict, jsonPlotsDictK
         jsonPlotsDict['figures'][jsonPlotsDictKey] = '{}'
         jsonPlotsDict['captions'][jsonPlotsDictKey] = '{}'
 
-def uploadvalidatedata(file, extension):
-    """Starts loading input CSV or Excel file to webapp cache and into pandas dataframe object for future data manipulations
-    To speed loading the openpyxl is used to more rapidly upload and parse Excel files. 
-    The CSV files are read much faster than Excel file due to minimal parsing and conversion steps
+def uploadvalidatedata(file, extension, sheet=None):
+    """Starts loading input CSV or Excel file to the session dataset store and into pandas dataframe object for future data manipulations
+    To speed loading the Excel files are converted to CSV text by xlsx2csv without building Python objects for every row.
+    The CSV files are read much faster than Excel file due to minimal parsing and conversion steps and are streamed in chunks
+    in a single pass directly into the session dataset store (see ingestCSV())
 
     Also generates metadata dictionary to be displayed in validation screen including list of observed variable names (i.e. columns),
     data dimensions, missing counts per variable, expected variables tip text displayed over blue information icon. 
@@ -1907,6 +2926,7 @@ def uploadvalidatedata(file, extension):
     Arguments:
         file (FileStorage): the actual file transferred from the frontend and stored in Flask FileStorage object
         extension (string): extracted file extension from the submitted file
+        sheet (string, optional): Excel worksheet name or number to load. Defaults to None loading the active worksheet
 
     Raises:
         ValueError: raises error if uploaded file is of not allowed type (other than CSV and EXLS). 
@@ -1921,43 +2941,34 @@ def uploadvalidatedata(file, extension):
     start_time = time.time()
     #both cases allow for duplicated columns (no automatic renaming)
     if extension == "xlsx":
-        data = load_workbook(file, read_only=True, data_only=True).active.values
-        cols = next(data)
-        df = pd.DataFrame(data, columns=cols) 
+        #worksheet converted to CSV text on the fly and streamed through the same single pass CSV ingest
+        fingerprint, summary, error_msg = ingestXLSX(file, session['id'], sheet=sheet)
+        if error_msg:
+            print(error_msg)
+            return {}, error_msg
     elif extension == "csv":
-        df = pd.read_csv(file, header = None, skiprows = 1)
-        file.seek(0)
-        rownames  =  pd.read_csv(file, header = None, nrows = 1).loc[0,:].to_list()
-        df.columns = rownames
+        #single streaming pass parsing, storing and calculating the validation screen statistics chunk by chunk
+        fingerprint, summary, error_msg = ingestCSV(file, session['id'])
+        if error_msg:
+            print(error_msg)
+            return {}, error_msg
     else:
         raise ValueError("Unknown input file extension. Only xlsx and csv supported")
     end_time = time.time()
     print("Input data loading time {}s".format(end_time-start_time) )
-    print("Checkin data on duplicated entries ... ")
-    if df.columns.duplicated().any():
-        dupl_col_names = ",".join(df.columns[df.columns.duplicated()].to_list())
-        error_msg = f'''Duplicated column(s) found ({dupl_col_names}) in file {file.filename}! Aborting upload. Make sure input has unique header names'''
-        print()
-        return {}, error_msg
-    #    df=df.loc[:,df.columns.duplicated()==False].copy()
-    
-    print("Empty rows cleaning")
-    df=df[df.iloc[:,0].isna()==False].copy()
-    print(f"Total valid data rows in input {df.shape[0]}")
+    print(f"Total valid data rows in input {summary['data_shape'][0]}")
 
+    session['dataset_fingerprint'] = fingerprint
 
-    cache.delete('df_dashboard') #delete previous data
-    cache.add('df_dashboard', df, timeout=0)
-
-    metadata_dict['data_shape'] = df.shape
-    metadata_dict['fields_observed'] = df.columns.sort_values().unique().to_list() #+ ['']
+    metadata_dict['data_shape'] = summary['data_shape']
+    metadata_dict['fields_observed'] = pd.Index(list(summary['counts'].keys())).sort_values().unique().to_list() #+ ['']
     metadata_dict['fields_counts_observed'] = dict(zip(metadata_dict['fields_observed'],
-                                                       [df[field].count() for field in
+                                                       [summary['counts'][field] for field in
                                                         metadata_dict['fields_observed']]))
     
-    metadata_dict['fields_counts_unique_observed'] = dict(zip(df.columns.sort_values().to_list(),
-                                                              [df[field].unique().size for field in metadata_dict['fields_counts_observed'].keys()]))
-    metadata_dict['fields_counts_missing_observed'] = dict(zip(df.columns.sort_values().to_list(),
+    metadata_dict['fields_counts_unique_observed'] = dict(zip(metadata_dict['fields_observed'],
+                                                              [summary['unique'][field] for field in metadata_dict['fields_counts_observed'].keys()]))
+    metadata_dict['fields_counts_missing_observed'] = dict(zip(metadata_dict['fields_observed'],
                                                                [metadata_dict['data_shape'][0] -
                                                                 metadata_dict['fields_counts_observed'][field]
                                                                 for field in metadata_dict['fields_counts_observed']]))
@@ -1996,8 +3007,8 @@ def uploadvalidatedata(file, extension):
                                                     'phenotypic_profile': 'a categorical composite field related to phenotypic characteristics defined by one or more components \
                                                         separated by the selected delimiter symbol. E.g., AMR phenotypes encoded as streptomycin_susceptible|betalactam_resistant',
                                               }
-    metadata_dict['fieldtypes_observed'] = dict(zip(df.columns.sort_values().to_list(),
-                                                    [str(df.dtypes[field]) for field in
+    metadata_dict['fieldtypes_observed'] = dict(zip(metadata_dict['fields_observed'],
+                                                    [summary['dtypes'][field] for field in
                                                      metadata_dict['fields_counts_observed']]))
     metadata_dict['warnings'] = dict.fromkeys(metadata_dict['fields_observed'], '')
     print(metadata_dict['fields_counts_observed'])
@@ -2020,21 +3031,81 @@ def uploadvalidatedata(file, extension):
     return metadata_dict, ''
 
 
-def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
-    """Generates age distribution bar plot by binning age into 5 year bins. Calculates counts per each age bin. 
+def getAgeYears(df):
+    '''
+    Completed years of the sample age. Age is parsed once at the validation mapping and stored in the derived __age_years
+    column (1 year bins) so the age plot bins are summed from year counts whatever the configured bin width
+    Arguments:
+        df {pandas dataframe} - dataset (or selected rows) with the derived '__age_years' column or the 'age' field
+    Return:
+        {numpy array} - age in completed years (-1 for missing, non numerical or negative age)
+    '''
+    if '__age_years' in df.columns:
+        return df['__age_years'].to_numpy()
+    age = pd.to_numeric(df['age'], errors='coerce').to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        return np.where(age >= 0, np.minimum(np.floor(age), np.iinfo(np.int16).max), -1).astype(np.int16)
+
+
+def getAgeBinCounts(years, traces=None, ntraces=1):
+    '''
+    Age distribution counts of all plot traces from a single 2-D bincount of (trace, year) summed into bins of
+    AGE_BIN_WIDTH years up to AGE_BIN_MAX years. Ages above are counted in an open-ended top bin (e.g. 105+) if
+    AGE_OPEN_TOP_BIN is set and left out otherwise
+    Arguments:
+        years {numpy array} - age in completed years of each sample (see getAgeYears())
+        traces {numpy array} - trace of each sample (-1 for samples of no trace). Defaults to None (single trace)
+        ntraces {int} - number of traces
+    Return:
+        labels {list} - age bin labels (e.g. [0-5))
+        counts {numpy array} - counts per trace (rows) and age bin (columns)
+    '''
+    width = app.config.get('AGE_BIN_WIDTH', 5)
+    top = app.config.get('AGE_BIN_MAX', 105)
+    years = np.minimum(years, top).astype(np.int64) #years above the top bin edge share the last year column
+    traces = np.zeros(years.size, dtype=np.int64) if traces is None else np.asarray(traces, dtype=np.int64)
+    valid = (years >= 0) & (traces >= 0)
+    year_counts = np.bincount(traces[valid] * (top + 1) + years[valid], minlength=ntraces * (top + 1)).reshape(ntraces, top + 1)
+
+    starts = np.arange(0, top, width)
+    counts = np.add.reduceat(year_counts[:, :top], starts, axis=1) if top > 0 else np.zeros((ntraces, 0), dtype=np.int64)
+    if app.config.get('AGE_OPEN_TOP_BIN', False):
+        counts = np.column_stack([counts, year_counts[:, top]])
+    return getAgeBinLabels(), counts
+
+
+def getAgeBinLabels():
+    '''
+    Labels of the age bins of AGE_BIN_WIDTH years up to AGE_BIN_MAX years (and the open-ended top bin if AGE_OPEN_TOP_BIN is set)
+    Return:
+        {list} - age bin labels (e.g. [0-5), ..., 105+)
+    '''
+    width, top = app.config.get('AGE_BIN_WIDTH', 5), app.config.get('AGE_BIN_MAX', 105)
+    labels = ["[{}-{})".format(start, min(start + width, top)) for start in range(0, top, width)]
+    if app.config.get('AGE_OPEN_TOP_BIN', False):
+        labels.append("{}+".format(top))
+    return labels
+
+
+def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame(), grouping=None, age_counts=None, age_counts2=None):
+    """Generates age distribution bar plot by binning age into AGE_BIN_WIDTH year bins (see getAgeBinCounts()). Calculates counts per each age bin. 
     Provides bar or line views of the plot for easier comparioson of data groups. Returns a dictionary of Plotly figure in JSON format and figure caption text
 
     Arguments:
         df (pandas dataframe): a copy of dataframe to render plot on usually represents either a total or filtred data assigned to Group #1
         form_data_dict (dict): a dictionary of values submitted from fronend POST request contaning information on y-axis scale and groupy by variable
         df2 (pandas dataframe, optional): a . Defaults to pd.DataFrame().
+        grouping (tuple, optional): group by mode grouping of the 'df' rows computed by getSelectionGrouping(). Calculated from 'df' if not provided
+        age_counts (tuple, optional): Group #1 age bin counts (per group by value in group by mode) answered by the data cube (see getCubeAgeBinCounts()).
+                                      Counted from the 'df' rows if not provided
+        age_counts2 (tuple, optional): Group #2 age bin counts answered by the data cube. Counted from the 'df2' rows if not provided
 
     Returns:
         {dict}: a dictionary containing the 'figure' and 'captions' keys that store JSON representation of Plotly figure object and figure caption text
+                and the 'comparison' key with the aligned Group #1 and Group #2 age bin counts if two groups are defined (see addComparison())
     """
     print("Generating age distribution plot ...")
 
-    # df_global = cache.get('df_dashboard') #unfiltred
     df_barplot_dict = {'group1': {},'group2':{}}
     df_barplot_dict['group1']['xaxis'] = {}
     df_barplot_dict['group1']['yaxis'] = {}
@@ -2054,22 +3125,40 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
         #legend=dict(orientation='h', borderwidth=1, y=-0.2, x=0.6)
     )
 
+    def getAgeCounts(df_group, traces=None, ntraces=1):
+        years = getAgeYears(df_group)
+        return getAgeBinCounts(years, traces, ntraces) + (np.count_nonzero(years >= 0), np.count_nonzero(years < 0))
+
+    def getCubeTotals(cube_counts): #samples of known and unknown age of all the cube group by values
+        return cube_counts[0], cube_counts[1], cube_counts[2].sum(), cube_counts[3].sum()
+
     try:
-        df.loc[:,'age']=pd.to_numeric(df.loc[:,'age'], errors='coerce')
-        df_filtered = df[~df["age"].isna()].copy()
-        df_filtered['age_bin'] = pd.cut(df_filtered['age'], [x for x in range(0, 110, 5)], right=False)
-        df_filtered_counts = df_filtered.groupby(["age_bin"]).size().reset_index(name='counts')
-        age_bins_str = ["[" + str(i.left) + "-" + str(i.right) + ")" for i in df_filtered_counts["age_bin"]]
-        df_barplot_dict['group1']['xaxis'] = age_bins_str
-        df_barplot_dict['group1']['yaxis'] = df_filtered_counts["counts"].to_list()
-        if df2.empty == False:
+        # the traces (Group #1 and Group #2 or the group by mode groups) are counted by a 2-D bincount of the selected rows
+        # or summed from the data cube age bin counts
+        if 'groupby_selector_value' in form_data_dict:
+            groupby = form_data_dict['groupby_selector_value']
+            traces, groups_select, other_cat_name = grouping if grouping is not None else getGroupCodes(df[groupby])
+            if age_counts is None:
+                age_bins_str, trace_counts, known, unknown = getAgeCounts(df, traces, len(groups_select))
+            else:
+                # group by values of the cube rows are mapped to their traces as getGroupCodes() maps the selected rows
+                age_bins_str, counts, known, unknown = getCubeTotals(age_counts)
+                other_trace = len(groups_select) - 1 if other_cat_name else -1
+                trace_of = {name: idx for idx, name in enumerate(groups_select) if name != other_cat_name}
+                code_traces = np.array([other_trace] + [trace_of.get(name, other_trace) for name in df[groupby].cat.categories.astype(str)])
+                trace_counts = np.zeros((len(groups_select), counts.shape[1]), dtype=np.int64)
+                np.add.at(trace_counts, code_traces[code_traces >= 0], counts[code_traces >= 0])
+        elif df2.empty == False:
             print("Two groups defined, working on df2 {}".format(df2.shape))
-            df2['age']=pd.to_numeric(df2['age'], errors='coerce')
-            df2_filtered = df2[~df2["age"].isna()]
-            df2_filtered['age_bin'] = pd.cut(df2_filtered['age'], [x for x in range(0, 110, 5)], right=False)
-            df2_filtered_counts = df2_filtered.groupby(["age_bin"]).size().reset_index(name='counts')
-            df_barplot_dict['group2']['yaxis'] = df2_filtered_counts["counts"].to_list()
-            df_barplot_dict['group2']['xaxis'] = df_barplot_dict['group1']['xaxis']
+            age_bins_str, trace_counts, known, unknown = getAgeCounts(df) if age_counts is None else getCubeTotals(age_counts)
+            _, trace_counts2, known2, unknown2 = getAgeCounts(df2) if age_counts2 is None else getCubeTotals(age_counts2)
+            trace_counts = np.vstack([trace_counts, trace_counts2])
+            df_barplot_dict['group2']['xaxis'] = age_bins_str
+            df_barplot_dict['group2']['yaxis'] = trace_counts[1].tolist()
+        else:
+            age_bins_str, trace_counts, known, unknown = getAgeCounts(df) if age_counts is None else getCubeTotals(age_counts)
+        df_barplot_dict['group1']['xaxis'] = age_bins_str
+        df_barplot_dict['group1']['yaxis'] = trace_counts[0].tolist()
     except Exception as e:
         print(e)
         print("Age field could not be converted to integer. The age distribution plot could not be rendered")
@@ -2085,24 +3174,8 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
         layout['legend']['title']=form_data_dict['groupby_selector_value']
         offset_counter=0
 
-        groups_total = df.groupby(
-            form_data_dict['groupby_selector_value']).size().reset_index(
-            name='counts').sort_values(by='counts', ascending=False)[form_data_dict['groupby_selector_value']].to_list()
-        groups_select = sorted([str(value) for idx,value in enumerate(groups_total) if idx < 10]) #user might provide non-string values (e.g. floats)
-
-
-        if len(groups_total) > 10:
-            other_cat_name="other({})".format(len(groups_total)-len(groups_select))
-            regex_pattern="|".join(groups_select)
-            df_filtered.loc[~df_filtered[form_data_dict['groupby_selector_value']].astype(str).str.fullmatch(regex_pattern),
-                       form_data_dict['groupby_selector_value']]=other_cat_name
-            groups_select.append(other_cat_name)
-        else:
-            other_cat_name = ''
-
         for idx,group in enumerate(groups_select):
-            df_filtered_counts = df_filtered[df_filtered[form_data_dict['groupby_selector_value']] == group].groupby(["age_bin"]).size().reset_index(name='counts')
-            df_barplot_dict['group1']['yaxis'] = df_filtered_counts["counts"].to_list()
+            df_barplot_dict['group1']['yaxis'] = trace_counts[idx].tolist()
             if 'percent_yscale' in form_data_dict:
                 total_sum=sum(df_barplot_dict['group1']['yaxis'])
 
@@ -2128,14 +3201,13 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
 
 
         figCaption = "Age distribution plot on {} " \
-                     "cases in groupby mode with age data ({} cases age unknown)".format(df_filtered.shape[0],
-                                                                         df.shape[0] - df_filtered.shape[0])
+                     "cases in groupby mode with age data ({} cases age unknown)".format(known, unknown)
     elif df2.empty is False:
         if 'percent_yscale' in form_data_dict:
             total_sum=sum(df_barplot_dict['group1']['yaxis'])
             total_sum2=sum(df_barplot_dict['group2']['yaxis'])
-            df_barplot_dict['group1']['yaxis']=[i/total_sum*100 for i in df_barplot_dict['group1']['yaxis']]
-            df_barplot_dict['group2']['yaxis']=[i/total_sum2*100 for i in df_barplot_dict['group2']['yaxis']]
+            df_barplot_dict['group1']['yaxis']=[i/total_sum*100 if total_sum > 0 else 0 for i in df_barplot_dict['group1']['yaxis']]
+            df_barplot_dict['group2']['yaxis']=[i/total_sum2*100 if total_sum2 > 0 else 0 for i in df_barplot_dict['group2']['yaxis']]
             #layout['yaxis']['range']=[0,1]
             layout['yaxis']['title']='% of trace total'
         plot_objs_list = [
@@ -2155,11 +3227,11 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
         figCaption = "Age distribution plot on two groups:\n" \
                      "a) Group #1 composed of {} cases with age data ({} cases with age unknown)\n" \
                      "b) Group #2 composed of {} cases with age data ({} cases with age unknown)".format(
-            df_filtered.shape[0],df.shape[0] - df_filtered.shape[0],df2_filtered.shape[0],df.shape[0] - df2_filtered.shape[0] )
+            known, unknown, known2, unknown2)
     else:
         if 'percent_yscale' in form_data_dict:
             total_sum=sum(df_barplot_dict['group1']['yaxis'])
-            df_barplot_dict['group1']['yaxis']=[i/total_sum*100 for i in df_barplot_dict['group1']['yaxis']]
+            df_barplot_dict['group1']['yaxis']=[i/total_sum*100 if total_sum > 0 else 0 for i in df_barplot_dict['group1']['yaxis']]
             #layout['yaxis']['range']=[0,1]
             layout['yaxis']['title']='% of trace total'
         plot_objs_list = [
@@ -2171,8 +3243,7 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
                    )
         ]
         figCaption = "Age distribution plot on {} " \
-                     "cases with age data ({} cases age unknown)".format(df_filtered.shape[0],
-                                                                         df.shape[0] - df_filtered.shape[0])
+                     "cases with age data ({} cases age unknown)".format(known, unknown)
 
 
     fig = go.Figure(
@@ -2180,11 +3251,6 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
         layout=layout
     )
 
-    if len(plot_objs_list) == 2:
-        corr, pvalue, npoints = calculate_correlation(fig['data'][0]['y'],fig['data'][1]['y'], "age")
-        figCaption=figCaption+"\nPeason correlation between two groups based on the {} data points: {:.3f} (p-value: {:.3e})".format(
-            npoints,corr,pvalue)
-        print('Pearsons correlation in \"age\" Group#1 vs Group #2 {}'.format(corr))
     #fig.data=[fig.data[idx] for idx in np.argsort([i.name for i in fig.data])] #order traces alphabetically
 
     fig.for_each_trace(
@@ -2233,7 +3299,9 @@ def generateAgeBarPlot(df, form_data_dict, df2=pd.DataFrame()):
     )
 
     graphJSON = to_json_plotly(fig, pretty=False, engine='orjson')
-    return ({'figure': graphJSON,
-             'caption': figCaption})
+    figCapDict = {'figure': graphJSON, 'caption': figCaption}
+    if len(plot_objs_list) == 2 and 'groupby_selector_value' not in form_data_dict:
+        figCapDict['comparison'] = (age_bins_str, trace_counts[0], trace_counts[1]) #aligned Group #1 and Group #2 bin counts
+    return figCapDict
 
 
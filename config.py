@@ -8,10 +8,37 @@ class ConfigDebug(object):
     SECRET_KEY=secrets.token_urlsafe(16)
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = datetime.timedelta(hours = 24)
+    DATASET_STORE_DIR = 'cache-dir'
+    DATASET_STORE_TIMEOUT = 86400 #seconds before an unused session dataset is purged from the store
+    UPLOAD_CHUNK_ROWS = 100000 #rows parsed at once by the streaming CSV upload
+    SELECTION_CACHE_MEMORY_LIMIT = 256*1024**2 #bytes of filtered row selections cached per worker process
+    DATA_CUBE_MAX_CELLS = 1000000 #cells of the precomputed dashboard counts cube (0 disables the cube)
+    DATA_CUBE_MAX_CARDINALITY = 1000 #fields with more distinct values are not cube dimensions (counted from rows)
+    SUNBURST_MAX_NODES = 1000 #sectors of the hierarchical subtype sunburst plot (the most numerous paths fitting in are shown)
+    AGE_BIN_WIDTH = 5 #years per bin of the age distribution plot
+    AGE_BIN_MAX = 105 #upper edge of the last age bin
+    AGE_OPEN_TOP_BIN = False #count ages above AGE_BIN_MAX in an open-ended top bin (e.g. 105+) instead of leaving them out
+    ENRICHMENT_MAX_RESULTS = 1000 #top ranked categories returned by the Group #1 vs Group #2 enrichment scan
+    FILTER_GROUPS_MAX = 10 #filter groups compared side by side (one trace colour each)
+    RENDER_WORKERS = 1 #processes forked per request to render the dashboard plots in parallel (1 renders them one after another). Requires threads = 1 in uwsgi.ini
+    RENDER_PANEL_TIMEOUT = 60 #seconds the forked processes may take to render the dashboard plots before the unfinished ones are left out (None waits for every plot)
 
 class ProductionConfig(object):
     DEVELOPMENT = False
     DEBUG = False
     SECRET_KEY=secrets.token_urlsafe(16)
     SESSION_PERMANENT = False
-    
\ No newline at end of file
+    DATASET_STORE_DIR = 'cache-dir'
+    DATASET_STORE_TIMEOUT = 86400
+    UPLOAD_CHUNK_ROWS = 100000
+    SELECTION_CACHE_MEMORY_LIMIT = 256*1024**2
+    DATA_CUBE_MAX_CELLS = 1000000
+    DATA_CUBE_MAX_CARDINALITY = 1000
+    SUNBURST_MAX_NODES = 1000
+    AGE_BIN_WIDTH = 5
+    AGE_BIN_MAX = 105
+    AGE_OPEN_TOP_BIN = False
+    ENRICHMENT_MAX_RESULTS = 1000
+    FILTER_GROUPS_MAX = 10
+    RENDER_WORKERS = 1
+    RENDER_PANEL_TIMEOUT = 60
@@ -1,6 +1,8 @@
 from app.views import renderHistPlot
+from werkzeug.datastructures import FileStorage
 import pandas as pd
 import pathlib, os,json
+import pytest
 
 
 ROOT_DIR = os.path.join(pathlib.Path(__file__).parents[1].resolve())
@@ -15,13 +17,555 @@ from_data_dict={'validatedfields_exp2obs_map':
                 'delimiter_symbol': '|'}
 jsonPlotsDict = {'figures': {}, 'captions': {}}
 
+
+@pytest.fixture
+def store(tmp_path):
+    '''Dataset store of a test in a temporary directory. The app config is restored and the datasets and selections
+    of the test sessions are deleted even when the test fails
+
+    Return:
+        {str} -- path of the dataset store directory
+    '''
+    from app import app
+    from app.datastore import deleteDatasets
+    config = app.config.copy()
+    app.config['DATASET_STORE_DIR'] = str(tmp_path / 'cache-dir')
+    try:
+        yield app.config['DATASET_STORE_DIR']
+    finally:
+        datasets_dir = os.path.join(app.config['DATASET_STORE_DIR'], 'datasets')
+        for session_id in (os.listdir(datasets_dir) if os.path.isdir(datasets_dir) else []):
+            deleteDatasets(session_id)
+        app.config.clear()
+        app.config.update(config)
+
 def test_renderHistPlot():
     df=pd.read_csv(demo_df_filepath)
     renderHistPlot(df = df, df_col_name = 'geoloc_id', form_data_dict = from_data_dict, 
                    jsonPlotsDict = jsonPlotsDict, jsonPlotsDictKey = 'geoloc_chart',plot_title = 'Geolocation chart')
     
     json_geo_graph = json.loads(jsonPlotsDict['figures']['geoloc_chart'])
+    geo_counts = dict(zip(json_geo_graph['data'][0]['x'], json_geo_graph['data'][0]['y'])) #aggregated category counts
     
-    assert json_geo_graph['data'][0]['x'].count('Canada') == 29
-    assert json_geo_graph['data'][0]['x'].count('United States') == 394
-    assert json_geo_graph['data'][0]['x'].count('unknown') == 138 #missing data is rendered as unknown
+    assert geo_counts['Canada'] == 29
+    assert geo_counts['United States'] == 394
+    assert geo_counts['unknown'] == 138 #missing data is rendered as unknown
+
+
+def test_session_dataset_isolation(store):
+    from app.datastore import storeDataset, loadDataset, deleteDatasets
+    df1 = pd.DataFrame({'geoloc_id': ['Canada', 'Mexico']})
+    df2 = pd.DataFrame({'geoloc_id': ['Peru']})
+    storeDataset('TESTSESSION1', 'aaaa', df1)
+    storeDataset('TESTSESSION2', 'bbbb', df2)
+
+    assert loadDataset('TESTSESSION1', 'aaaa')['geoloc_id'].to_list() == ['Canada', 'Mexico']
+    assert loadDataset('TESTSESSION2', 'bbbb')['geoloc_id'].to_list() == ['Peru']
+    assert loadDataset('TESTSESSION1', 'bbbb') is None #fingerprint of another session dataset
+
+    storeDataset('TESTSESSION1', 'cccc', df2) #new dataset version replaces the previous one
+    assert loadDataset('TESTSESSION1', 'aaaa') is None
+    deleteDatasets('TESTSESSION1'); deleteDatasets('TESTSESSION2')
+    assert loadDataset('TESTSESSION2', 'bbbb') is None
+
+
+def test_columnar_dataset_store(store):
+    from app.datastore import storeDataset, loadDataset
+    df = pd.read_csv(demo_df_filepath)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    storeDataset('TESTSESSION3', 'dddd', df)
+
+    df_stored = loadDataset('TESTSESSION3', 'dddd')
+    pd.testing.assert_frame_equal(df_stored, df)
+    assert df_stored['age'].values.flags.writeable == False #memory-mapped from the store
+
+    df_stored = loadDataset('TESTSESSION3', 'dddd', columns=['geoloc_id', 'date'])
+    assert df_stored.columns.to_list() == ['geoloc_id', 'date']
+    assert df_stored.shape[0] == df.shape[0]
+
+
+def test_streaming_csv_ingest(store):
+    from app import app
+    from app.ingest import ingestCSV
+    from app.datastore import loadDataset, fileFingerprint
+    with open(demo_df_filepath, 'rb') as fp, app.app_context():
+        file = FileStorage(fp, filename='ecoli_sample_data.csv')
+        fingerprint, summary, error_msg = ingestCSV(file, 'TESTSESSION4', chunksize=64)
+        file.seek(0)
+        assert error_msg == '' and fingerprint == fileFingerprint(file)
+
+    df = pd.read_csv(demo_df_filepath)
+    assert summary['data_shape'] == df.shape
+    assert summary['counts']['geoloc_id'] == df['geoloc_id'].count()
+    assert summary['unique']['geoloc_id'] == df['geoloc_id'].unique().size
+    assert summary['dtypes']['age'] == str(df['age'].dtype)
+    pd.testing.assert_frame_equal(loadDataset('TESTSESSION4', fingerprint), df)
+
+
+def test_xlsx_sheet_ingest(store, tmp_path):
+    from app import app
+    from app.ingest import ingestXLSX
+    from app.datastore import loadDataset
+    df = pd.read_csv(demo_df_filepath)
+    xlsx_filepath = os.path.join(tmp_path, 'ecoli_sample_data.xlsx')
+    with pd.ExcelWriter(xlsx_filepath) as writer:
+        pd.DataFrame({'notes': ['sample data in the second sheet']}).to_excel(writer, sheet_name='readme', index=False)
+        df.to_excel(writer, sheet_name='data', index=False)
+
+    with open(xlsx_filepath, 'rb') as fp, app.app_context():
+        file = FileStorage(fp, filename='ecoli_sample_data.xlsx')
+        fingerprint, summary, error_msg = ingestXLSX(file, 'TESTSESSION5', sheet='data')
+        assert error_msg == '' and summary['data_shape'] == df.shape
+        assert loadDataset('TESTSESSION5', fingerprint)['geoloc_id'].equals(df['geoloc_id'])
+        assert ingestXLSX(file, 'TESTSESSION5', sheet='2')[0] == fingerprint #sheet number
+        assert 'not found' in ingestXLSX(file, 'TESTSESSION5', sheet='missing')[2]
+
+
+def test_categorical_filters():
+    from app.views import encodeCategorical, getFilterBitmap, getFilterValues
+    df = pd.read_csv(demo_df_filepath)
+    geoloc = encodeCategorical(df['geoloc_id'])
+    assert isinstance(geoloc.dtype, pd.CategoricalDtype)
+    assert getFilterValues(geoloc) == getFilterValues(df['geoloc_id']) #includes "not specified"
+
+    assert getFilterBitmap(geoloc, ['canada', 'United States'], case=False).sum() == 29 + 394
+    assert getFilterBitmap(geoloc, ['not specified']).sum() == df['geoloc_id'].isna().sum()
+    assert getFilterBitmap(encodeCategorical(df['cluster_id']), ['23']).sum() == (df['cluster_id'] == 23).sum()
+
+
+def test_inverted_index_filters(store):
+    from app.datastore import storeDataset, loadDataset, loadDatasetIndexes
+    from app.views import encodeCategorical, getFilterBitmap
+    df = pd.read_csv(demo_df_filepath)
+    df['geoloc_id'] = encodeCategorical(df['geoloc_id'])
+    storeDataset('TESTSESSION6', 'eeee', df)
+    df_stored = loadDataset('TESTSESSION6', 'eeee')
+    indexes = loadDatasetIndexes('TESTSESSION6', 'eeee')
+    assert list(indexes) == ['geoloc_id'] #categorical columns only
+
+    for values in [['Canada', 'not specified'], ['United States'], ['missing value']]:
+        bitmap = getFilterBitmap(df_stored['geoloc_id'], values, indexes['geoloc_id'])
+        assert (bitmap == getFilterBitmap(df_stored['geoloc_id'], values)).all()
+
+
+def test_date_parsing():
+    from app.views import parseDates
+    dates = parseDates(pd.Series(['2021-03-01', '2020-12-31', 'unknown', None, '2021-03-01']))
+    assert str(dates.dtype) == 'datetime64[ns]' and dates.isna().sum() == 2
+    assert dates.iloc[0] == dates.iloc[4] == pd.Timestamp('2021-03-01')
+
+
+def test_pattern_filters():
+    from app.views import encodeCategorical, getFilterBitmap
+    df = pd.read_csv(demo_df_filepath)
+    geoloc = encodeCategorical(df['geoloc_id'])
+    assert getFilterBitmap(geoloc, [], patterns=['united s*', '?anada'], case=False).sum() == 29 + 394
+    assert getFilterBitmap(geoloc, ['Canada'], patterns=['not *']).sum() == 29 + df['geoloc_id'].isna().sum()
+    assert (getFilterBitmap(df['geoloc_id'], [], patterns=['Can*']) == getFilterBitmap(geoloc, [], patterns=['Can*'])).all()
+
+
+def test_date_range_index(store):
+    from app.datastore import storeDataset, loadDataset, loadDatasetIndexes
+    from app.views import getDateRangeBitmap
+    df = pd.DataFrame({'date': pd.to_datetime(['2021-03-01', None, '2020-12-31', '2021-01-01', '2022-06-15'])})
+    storeDataset('TESTSESSION7', 'ffff', df)
+    dates = loadDataset('TESTSESSION7', 'ffff')['date']
+    index = loadDatasetIndexes('TESTSESSION7', 'ffff')['date']
+
+    for start_date, end_date in [('20210101', '20210301'), (None, '20201231'), ('20210102', None), ('20230101', None)]:
+        bitmap = getDateRangeBitmap(dates, start_date, end_date, index)
+        assert (bitmap == getDateRangeBitmap(dates, start_date, end_date)).all()
+    assert getDateRangeBitmap(dates, '20210101', '20210301', index).tolist() == [True, False, False, True, False]
+
+
+def test_hierarchy_prefix_index(store):
+    from app.datastore import storeDataset, loadPrefixIndex
+    from app.views import encodeCategorical, getHierarchyPathBitmap
+    df = pd.DataFrame({'hs_level_0': ['1', '1', '2', '1', None, '2'], 'hs_level_1': ['1', '2', '1', '1', None, '1'],
+                       'hs_level_2': ['3', '3', '1', '4', None, '1']}).apply(encodeCategorical)
+    storeDataset('TESTSESSION8', 'abab', df, hierarchy=['hs_level_0', 'hs_level_1', 'hs_level_2'])
+    prefix_index = loadPrefixIndex('TESTSESSION8', 'abab')
+
+    for path in [['1'], ['1', '1'], ['2', '1', '1'], ['1', '2', '4'], ['3'], ['1', '1', '4']]:
+        bitmap = getHierarchyPathBitmap(df, path, prefix_index)
+        assert (bitmap == getHierarchyPathBitmap(df, path)).all()
+    assert getHierarchyPathBitmap(df, ['1', '1'], prefix_index).tolist() == [True, False, False, True, False, False]
+
+
+def test_selection_cache(store):
+    from app import app
+    from app.datastore import storeDataset, loadDataset, deleteDatasets, selectionCacheStats
+    from app.views import getFilteredData, extactFilterValuesFromPOST2Dict
+    df = pd.read_csv(demo_df_filepath)
+    storeDataset('TESTSESSION9', 'acac', df)
+    df = loadDataset('TESTSESSION9', 'acac')
+    stats = selectionCacheStats()
+
+    filter_values = [{'select_geoloc_id_filterset1_0': 'Canada', 'select_geoloc_id_filterset1_1': 'Kenya'},
+                     {'select_geoloc_id_filterset1_0': 'Kenya', 'select_geoloc_id_filterset1_1': 'Canada'}]
+    df_filtered = [getFilteredData(extactFilterValuesFromPOST2Dict(values), df, dataset_key=('TESTSESSION9', 'acac'))
+                   for values in filter_values]
+    assert df_filtered[0].equals(df_filtered[1]) and df_filtered[0].shape[0] == 29 + 20
+    assert selectionCacheStats()['hits'] == stats['hits'] + 1 and selectionCacheStats()['misses'] == stats['misses'] + 1
+
+    with app.app_context():
+        app.config['SELECTION_CACHE_MEMORY_LIMIT'] = 8 #too small for any selection
+        getFilteredData(extactFilterValuesFromPOST2Dict({'select_geoloc_id_filterset1_0': 'Kenya'}), df,
+                        dataset_key=('TESTSESSION9', 'acac'))
+        assert selectionCacheStats()['nbytes'] <= 8 and selectionCacheStats()['evictions'] > stats['evictions']
+    deleteDatasets('TESTSESSION9') #invalidates the session selections
+    assert selectionCacheStats()['nbytes'] == stats['nbytes']
+
+
+def test_incremental_filter_refinement(store):
+    from app.datastore import storeDataset, loadDataset
+    from app.views import getFilteredData, getFilterRefinement, extactFilterValuesFromPOST2Dict, encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    df['geoloc_id'], df['date'] = encodeCategorical(df['geoloc_id']), pd.to_datetime(df['date'], errors='coerce')
+    storeDataset('TESTSESSION10', 'adad', df)
+    df = loadDataset('TESTSESSION10', 'adad')
+
+    steps = [{'select_geoloc_id_filterset1_0': 'Canada', 'select_geoloc_id_filterset1_1': 'United States'},
+             {'select_geoloc_id_filterset1_0': 'United States', 'start_date_filterset1': '2015-01-01'},
+             {'select_geoloc_id_filterset1_0': 'United States', 'start_date_filterset1': '2016-01-01',
+              'end_date_filterset1': '2019-12-31', 'pattern_source_type_filterset1': 'h*'}]
+    for step, filter_values in enumerate(steps):
+        filter_dict = extactFilterValuesFromPOST2Dict(filter_values)
+        if step > 0:
+            assert getFilterRefinement(extactFilterValuesFromPOST2Dict(steps[step-1]), filter_dict) is not None
+        df_refined = getFilteredData(filter_dict, df, dataset_key=('TESTSESSION10', 'adad'), group='filterset1')
+        assert df_refined.equals(getFilteredData(filter_dict, df))
+    assert getFilterRefinement(extactFilterValuesFromPOST2Dict(steps[1]), extactFilterValuesFromPOST2Dict(steps[0])) is None
+
+
+def test_render_data_columns(store):
+    from app.datastore import storeDataset, loadDataset
+    from app.views import decodeCategoricals, encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    df['geoloc_id'] = encodeCategorical(df['geoloc_id'])
+    storeDataset('TESTSESSION11', 'aeae', df)
+    df = loadDataset('TESTSESSION11', 'aeae')
+
+    df_render = decodeCategoricals(df, ['geoloc_id', 'age', 'missing_column', 'age'])
+    assert df_render.columns.to_list() == ['geoloc_id', 'age'] and df_render['geoloc_id'].dtype == object
+    df_render.fillna('unknown', inplace=True) #render functions modify their private copy only
+    assert df['geoloc_id'].isna().sum() == 138 and df_render['age'].values.flags.writeable
+
+
+def test_aggregate_selection():
+    from app.views import aggregateSelection, encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    df_categorical = df.assign(geoloc_id=encodeCategorical(df['geoloc_id']), gender=encodeCategorical(df['gender']))
+
+    aggregates = aggregateSelection(df_categorical, ['geoloc_id', 'gender', 'missing_column'], 'gender')
+    assert set(aggregates) == {'geoloc_id', 'gender'} and aggregates['geoloc_id']['counts'].sum() == df.shape[0]
+    expected = df.fillna('NA').groupby(['geoloc_id', 'gender']).size().to_dict()
+    for data in [df, df_categorical]: #plain and categorical columns give the same counts
+        counts = aggregateSelection(data, ['geoloc_id'], 'gender')['geoloc_id'].fillna('NA')
+        assert counts.set_index(['geoloc_id', 'gender'])['counts'].to_dict() == expected
+
+
+def test_data_cube_counts(store):
+    from app.datastore import storeDataset, loadDataset, loadDataCube
+    from app.views import getDataCubeDimensions, getCubeCounts, aggregateSelection, getFilteredData, \
+        extactFilterValuesFromPOST2Dict, encodeCategorical, getAgeBinDimension, getCubeAgeBinCounts, getAgeBinCounts, getAgeYears
+    df = pd.read_csv(demo_df_filepath)
+    for column in ['geoloc_id', 'gender', 'source_type', 'primary_type', 'cluster_id']:
+        df[column] = encodeCategorical(df[column])
+    storeDataset('TESTSESSION12', 'afaf', df, cube_dimensions=getDataCubeDimensions(df))
+    df, cube = loadDataset('TESTSESSION12', 'afaf'), loadDataCube('TESTSESSION12', 'afaf')
+    assert set(cube['columns']) == {'geoloc_id', 'gender', 'source_type', 'primary_type', getAgeBinDimension()} #plotted fields only
+    assert cube['counts'].sum() == df.shape[0] and cube['counts'].shape[0] < df.shape[0]
+
+    filter_dict = extactFilterValuesFromPOST2Dict({'select_geoloc_id_filterset1_0': 'Canada', 'pattern_source_type_filterset1': 'h*',
+                                                   'select_primary_type_filterset1_0': 'not specified'})
+    for groupby in [None, 'gender', 'source_type']: #filtered and grouped selections
+        cube_counts = getCubeCounts(cube, df, filter_dict, ['gender', 'primary_type', 'cluster_id'], groupby)
+        row_counts = aggregateSelection(getFilteredData(filter_dict, df), ['gender', 'primary_type'], groupby)
+        assert set(cube_counts) == {'gender', 'primary_type'} #cluster_id is not a cube dimension
+        for column in cube_counts:
+            assert cube_counts[column].fillna('NA').equals(row_counts[column].fillna('NA'))
+
+    df_selected = getFilteredData(filter_dict, df)
+    labels, counts, known, unknown = getCubeAgeBinCounts(cube, df, filter_dict)
+    years = getAgeYears(df_selected)
+    assert (labels, counts[0].tolist()) == (getAgeBinCounts(years)[0], getAgeBinCounts(years)[1][0].tolist())
+    assert (known[0], unknown[0]) == ((years >= 0).sum(), (years < 0).sum())
+    _, counts, _, _ = getCubeAgeBinCounts(cube, df, filter_dict, 'gender') #rows per group by value code (missing first)
+    for code, gender in enumerate(df['gender'].cat.categories, start=1):
+        assert counts[code].tolist() == getAgeBinCounts(years[(df_selected['gender'] == gender).to_numpy()])[1][0].tolist()
+
+    columns = [c for c in df.columns if c not in cube_counts] #counted columns are left out of the selected rows
+    assert getFilteredData(filter_dict, df, columns=columns).equals(getFilteredData(filter_dict, df)[columns])
+    filter_dict['cluster_id'] = ['23'] #filters on fields out of the cube need a row scan
+    assert getCubeCounts(cube, df, filter_dict, ['gender']) is None and getCubeAgeBinCounts(cube, df, filter_dict) is None
+
+
+def test_epicurve_series():
+    from app.views import getEpiCurveBins, getEpiCurveCalendar, getEpiCurveSeries
+    dates = pd.to_datetime(pd.read_csv(demo_df_filepath)['date'], errors='coerce').dropna()
+    dates = pd.concat([dates, pd.Series(pd.to_datetime(['2018-12-31', '2019-01-01']))], ignore_index=True)
+    expected = dates.to_frame('date').groupby(pd.Grouper(key='date', freq='W-MON')).size() #dense weekly bins ending on Monday
+
+    bins = getEpiCurveBins(dates)
+    calendar = getEpiCurveCalendar(bins)
+    series = getEpiCurveSeries(bins.value_counts().sort_index(), calendar)
+    assert series['daily']['x'].to_list() == expected.index.to_list() and series['daily']['y'].to_list() == expected.to_list()
+    assert len(series['weekly']) == len(calendar[0]) and calendar[0][:2] == [calendar[2][0] + '/01', calendar[2][0] + '/02']
+    assert series['weekly'][calendar[0].index('2018/53')] == expected['2018-12-31'] #December 31st is not ISO week 1
+    assert sum(series['weekly']) == sum(series['monthly']) == sum(series['yearly']) == dates.shape[0]
+    assert round(sum(getEpiCurveSeries(bins.value_counts().sort_index(), calendar, percent=True)['monthly']), 6) == 100
+
+
+def test_profile_component_counts(store):
+    from collections import Counter
+    import numpy as np
+    from app.datastore import storeDataset, loadDataset, loadComponentMatrices
+    from app.views import getComponentMatrix, getComponentCounts, encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    df['genetic_profile'] = encodeCategorical(df['genetic_profile'])
+    storeDataset('TESTSESSION13', 'b0b0', df, components={'genetic_profile':
+                 getComponentMatrix(df['genetic_profile'].cat.categories, '|') + ('|',)})
+    df, components = loadDataset('TESTSESSION13', 'b0b0'), loadComponentMatrices('TESTSESSION13', 'b0b0')
+
+    selection = df.iloc[::3]
+    expected = Counter([c for profile in selection['genetic_profile'].dropna() for c in str(profile).split('|')])
+    assert getComponentCounts(selection['genetic_profile'], '|', components['genetic_profile'])[0] == expected
+    assert getComponentCounts(selection['genetic_profile'].astype(object), '|')[0] == expected #parsed on the fly
+
+    traces = np.where(selection['gender'] == 'male', 0, np.where(selection['gender'] == 'female', 1, -1))
+    male, female = getComponentCounts(selection['genetic_profile'], '|', components['genetic_profile'], traces, 2)
+    assert male == Counter([c for profile in selection.loc[traces == 0, 'genetic_profile'].dropna() for c in str(profile).split('|')])
+    assert sum(male.values()) + sum(female.values()) <= sum(expected.values()) #samples of no trace are not counted
+
+
+def test_hierarchy_nodes():
+    import plotly.express as px
+    from app.views import getHierarchyNodes, encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    levels = df['hierarchical_subtype'].str.split('|', expand=True)
+    hier_column_names = ['hs_level_{}'.format(level) for level in levels.columns]
+    df[hier_column_names] = levels
+    for column in hier_column_names:
+        df[column] = encodeCategorical(df[column])
+
+    nodes, npaths, ntotal = getHierarchyNodes(df, hier_column_names, 300)
+    assert len(nodes) <= 300 and npaths < ntotal
+    paths = df.dropna(subset=hier_column_names).value_counts(hier_column_names, sort=False).reset_index(name='counts')
+    assert len(paths) == ntotal
+    paths = paths.astype({c: str for c in hier_column_names}).sort_values('counts', ascending=False, kind='stable')
+    expected = px.sunburst(paths.head(npaths), path=hier_column_names, values='counts')['data'][0]
+    shown = px.sunburst(nodes, ids='id', names='labels', parents='parent', values='counts', branchvalues='total')['data'][0]
+    assert list(shown['ids']) == list(expected['ids']) #same nodes in the same order
+    assert list(shown['values']) == list(expected['values'])
+    assert list(shown['parents']) == list(expected['parents'])
+
+
+def test_group_codes():
+    from app.views import getGroupCodes, encodeCategorical
+    from app.datastore import getCachedGrouping, cacheGrouping, invalidateSelections
+    values = pd.Series(['v{:02d}'.format(i) for i in range(12) for _ in range(12 - i)] + [None, 1.5])
+    codes, groups, other = getGroupCodes(values)
+    assert groups == sorted(['v{:02d}'.format(i) for i in range(10)]) + ['other(3)'] and other == 'other(3)'
+    assert (codes[values == 'v00'] == 0).all() and (codes[-4:] == 10).all() #remaining and missing values are other
+    assert getGroupCodes(encodeCategorical(values))[1] == groups
+
+    codes, groups, other = getGroupCodes(pd.Series(['b', 'a', None, 'b']))
+    assert groups == ['a', 'b'] and other == '' and codes.tolist() == [1, 0, -1, 1]
+
+    assert getCachedGrouping('TESTSESSION14', 'c0c0', '{}', 'gender') is None
+    cacheGrouping('TESTSESSION14', 'c0c0', '{}', 'gender', codes, groups, other)
+    cached_codes, cached_groups, cached_other = getCachedGrouping('TESTSESSION14', 'c0c0', '{}', 'gender')
+    assert cached_codes.tolist() == codes.tolist() and cached_groups == groups and cached_codes.flags.writeable == False
+    invalidateSelections('TESTSESSION14')
+    assert getCachedGrouping('TESTSESSION14', 'c0c0', '{}', 'gender') is None
+
+
+def test_age_bin_counts(store):
+    import numpy as np
+    from app import app
+    from app.views import getAgeYears, getAgeBinCounts
+    df = pd.read_csv(demo_df_filepath)
+    df.loc[:3, 'age'] = [-1, 104.5, 105, 'unknown']
+    years = getAgeYears(df)
+    age = pd.to_numeric(df['age'], errors='coerce')
+    expected = pd.cut(age, list(range(0, 110, 5)), right=False).value_counts(sort=False)
+    labels, counts = getAgeBinCounts(years)
+    assert labels == ["[{}-{})".format(i.left, i.right) for i in expected.index] and counts[0].tolist() == expected.to_list()
+
+    traces = np.where(df['gender'] == 'male', 0, np.where(df['gender'] == 'female', 1, -1))
+    _, counts = getAgeBinCounts(years, traces, 2)
+    assert counts[1].tolist() == pd.cut(age[traces == 1], list(range(0, 110, 5)), right=False).value_counts(sort=False).to_list()
+
+    app.config.update(AGE_BIN_WIDTH=10, AGE_BIN_MAX=100, AGE_OPEN_TOP_BIN=True)
+    labels, counts = getAgeBinCounts(years)
+    assert labels[0] == '[0-10)' and labels[-1] == '100+' and counts[0, -1] == np.count_nonzero(age >= 100)
+    assert counts.sum() == np.count_nonzero(age >= 0)
+
+
+def test_comparison_statistics():
+    import numpy as np
+    from scipy import stats
+    from app.views import getAlignedCounts, getComparisonStatistics
+    comparisons = {'geoloc': getAlignedCounts(pd.Series({'Canada': 10, 'Peru': 3, 'Spain': 7}), pd.Series({'Canada': 4, 'Chile': 2, 'Peru': 9})),
+                   'age': (['[0-5)', '[5-10)', '[10-15)', '[15-20)'], np.array([5, 0, 8, 2]), np.array([1, 0, 3, 6]))}
+    assert comparisons['geoloc'][0].to_list() == ['Canada', 'Chile', 'Peru', 'Spain'] and comparisons['geoloc'][2].tolist() == [4, 2, 9, 0]
+
+    statistics = getComparisonStatistics(comparisons)
+    for key, (categories, counts1, counts2) in comparisons.items():
+        corr, pvalue = stats.pearsonr(counts1, counts2)
+        assert np.isclose(statistics.loc[key, 'corr'], corr) and np.isclose(statistics.loc[key, 'corr_pvalue'], pvalue)
+        observed = np.array([counts1, counts2])[:, (counts1 + counts2) > 0]
+        chi2, chi2_pvalue, dof, _ = stats.chi2_contingency(observed, correction=False)
+        assert np.isclose(statistics.loc[key, 'chi2'], chi2) and statistics.loc[key, 'chi2_dof'] == dof
+        assert np.isclose(statistics.loc[key, 'chi2_pvalue'], chi2_pvalue)
+    assert statistics.loc['geoloc', 'difference_category'] == 'Peru' #3/20 vs 9/15 samples differ by 45 percentage points
+    assert np.isclose(statistics.loc['geoloc', 'difference'], (3 / 20 - 9 / 15) * 100)
+
+
+def test_enrichment_statistics():
+    import numpy as np
+    from scipy import stats
+    from app.views import encodeCategorical, getComponentMatrix, getEnrichmentCounts, getEnrichmentStatistics
+    df = pd.read_csv(demo_df_filepath)
+    df = pd.DataFrame({column: encodeCategorical(df[column]) for column in ['source_type', 'gender', 'genetic_profile']})
+    positions1, positions2 = np.flatnonzero(df['gender'] == 'male'), np.flatnonzero(df['gender'] != 'male')
+    components = {'genetic_profile': getComponentMatrix(df['genetic_profile'].cat.categories, ',') + (',',)}
+    counts = getEnrichmentCounts(df, positions1, positions2, components)
+    source_type = counts[counts['field'] == 'source_type'].set_index('category')
+    assert source_type['count1'].to_dict() == df['source_type'].iloc[positions1].value_counts()[source_type.index].to_dict()
+    assert (source_type['total1'] == df['source_type'].iloc[positions1].notna().sum()).all()
+    genes = counts[counts['field'] == 'genetic_profile components'].set_index('category')
+    gene = genes.index[0]
+    has_gene = df['genetic_profile'].astype(object).str.split(',').apply(lambda c: isinstance(c, list) and gene in c)
+    assert genes.loc[gene, 'count2'] == has_gene.iloc[positions2].sum()
+
+    statistics = getEnrichmentStatistics(counts)
+    assert statistics['pvalue'].is_monotonic_increasing and (statistics['qvalue'] >= statistics['pvalue']).all()
+    for row in statistics.itertuples():
+        table = [[row.count1, row.total1 - row.count1], [row.count2, row.total2 - row.count2]]
+        if row.test == 'fisher':
+            assert np.isclose(row.pvalue, stats.fisher_exact(table)[1])
+        else:
+            assert np.isclose(row.pvalue, stats.chi2_contingency(table, correction=True)[1])
+    assert set(statistics['test']) == {'fisher', 'chi-square'}
+
+
+def test_enrichment_route(store):
+    import numpy as np
+    from app import app
+    from app.datastore import storeDataset
+    from app.views import encodeCategorical
+    df = pd.read_csv(demo_df_filepath)
+    for column in ['geoloc_id', 'gender', 'source_type']:
+        df[column] = encodeCategorical(df[column])
+    df['laboratory'] = np.where(df['geoloc_id'] == 'Canada', 'lab A', 'lab B') #unmapped text column
+    storeDataset('TESTSESSION19', 'b1b1', df)
+    filters = {'select_geoloc_id_filterset1_0': 'Canada', 'select_geoloc_id_filterset2_0': 'United States'}
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['id'] = 'TESTSESSION19'
+        assert 'No data present' in client.post('/enrichment', data={'datafilters2apply': json.dumps(filters)}).get_json()['error']
+        with client.session_transaction() as session:
+            session['dataset_fingerprint'] = 'b1b1'
+        group20 = {'select_geoloc_id_filterset1_0': 'Canada', 'select_geoloc_id_filterset20_0': 'Peru'}
+        assert 'Group #2' in client.post('/enrichment', data={'datafilters2apply': json.dumps(group20)}).get_json()['error']
+        enrichment = client.post('/enrichment', data={'datafilters2apply': json.dumps(filters)}).get_json()
+
+    assert enrichment['group1_samples'] == 29 and enrichment['group2_samples'] == 394
+    assert len(enrichment['results']) == min(enrichment['tests'], app.config['ENRICHMENT_MAX_RESULTS'])
+    results = pd.DataFrame(enrichment['results'])
+    assert {'field', 'category', 'count1', 'count2', 'pvalue', 'qvalue'} <= set(results.columns)
+    assert 'sample_id' not in set(results['field']) and not results['field'].str.startswith('__').any()
+    lab = results[results['field'] == 'laboratory'].set_index('category')
+    assert lab.loc['lab A', ['count1', 'count2']].to_list() == [29, 0]
+
+
+def test_groups_selection():
+    import numpy as np
+    from app.views import encodeCategorical, getFilterGroups, extactFilterValuesFromPOST2Dict, getGroupsSelection, aggregateSelection
+    filters = {'select_geoloc_id_filterset1_0': 'Canada', 'select_geoloc_id_filterset10_0': 'Peru',
+               'select_source_type_filterset3_0': 'Human', 'start_date_filterset10': '2019-01-01'}
+    assert getFilterGroups(filters) == ['filterset1', 'filterset3', 'filterset10']
+    assert getFilterGroups(filters, max_groups=2) == ['filterset1', 'filterset3'] and getFilterGroups({}) == ['filterset1']
+    assert getFilterGroups(filters, max_groups=None)[2:] == ['filterset10'] #groups dropped above the maximum
+    filter_dict = extactFilterValuesFromPOST2Dict(filters, 'filterset1') #filterset10 values are not Group #1 values
+    assert filter_dict['geoloc_id'] == ['Canada'] and filter_dict['start_date'] is None
+
+    df = pd.read_csv(demo_df_filepath)
+    df['source_type'] = encodeCategorical(df['source_type'])
+    positions = [np.arange(10), np.arange(5, 20), np.arange(0)] #overlapping and empty groups
+    groups_df, (codes, groups, other) = getGroupsSelection(df, positions, ['Group #1', 'Group #2', 'Group #3'])
+    assert groups_df.shape[0] == 25 and groups == ['Group #1', 'Group #2', 'Group #3'] and other == ''
+    assert codes.tolist() == [0] * 10 + [1] * 15
+    counts = aggregateSelection(groups_df, ['source_type'], 'filter group')['source_type']
+    for group, group_positions in zip(groups, positions):
+        group_counts = counts[counts['filter group'] == group].set_index('source_type')['counts']
+        expected = df['source_type'].iloc[group_positions].value_counts(dropna=False)
+        assert group_counts.sum() == len(group_positions)
+        assert group_counts[group_counts.index.notna()].to_dict() == expected[expected.index.notna() & (expected > 0)].to_dict()
+
+
+def test_render_panels():
+    import time, multiprocessing
+    from flask import session
+    from app import app
+    from app.views import renderPanels
+
+    def renderPanel(plotsDict, key):
+        plotsDict['figures'][key] = '{"data": []}'
+        plotsDict['captions'][key] = 'rendered for {}'.format(session['id'])
+
+    def failPanel(plotsDict, key):
+        raise ValueError('no data')
+
+    def slowPanel(plotsDict, key):
+        time.sleep(1)
+        renderPanel(plotsDict, key)
+
+    panels = {'geoloc_chart': renderPanel, 'gender_distribution_chart': failPanel, 'primary_type_chart': slowPanel,
+              'secondary_type_chart': renderPanel}
+    for workers, timeout in [(1, None), (4, None), (4, 0.2)]: #one after another, then forked worker processes
+        with app.test_request_context('/'):
+            session['id'] = 'TESTSESSION15'
+            jsonPlotsDict = {'figures': {}, 'captions': {}}
+            renderPanels(panels, jsonPlotsDict, workers=workers, timeout=timeout)
+        assert list(jsonPlotsDict['figures']) == list(panels)
+        assert jsonPlotsDict['captions']['geoloc_chart'] == jsonPlotsDict['captions']['secondary_type_chart'] == 'rendered for TESTSESSION15'
+        assert jsonPlotsDict['figures']['gender_distribution_chart'] == '{}' #failed panel does not abort the others
+        assert jsonPlotsDict['figures']['primary_type_chart'] == ('{"data": []}' if timeout is None else '{}')
+        assert multiprocessing.active_children() == [] #worker processes still rendering are terminated
+
+
+def test_dataset_storage_usage(store):
+    from app import app
+    from app.datastore import storeDataset, deleteDatasets, datasetStorageUsage, _readManifest
+    storeDataset('TESTSESSION16', 'adad', pd.read_csv(demo_df_filepath))
+    storeDataset('TESTSESSION17', 'aeae', pd.DataFrame({'geoloc_id': ['Peru']}))
+    usage = datasetStorageUsage()
+    assert usage['TESTSESSION16'] == _readManifest('TESTSESSION16', 'adad')['nbytes'] > usage['TESTSESSION17'] > 0
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['id'] = 'TESTSESSION16'
+        store_usage = client.get('/datasetstorage').get_json()
+    assert store_usage['session_bytes'] == usage['TESTSESSION16'] and store_usage['total_bytes'] == sum(usage.values())
+    deleteDatasets('TESTSESSION16'); deleteDatasets('TESTSESSION17')
+    assert 'TESTSESSION16' not in datasetStorageUsage()
+
+
+def test_failed_ingest_cleanup(store, monkeypatch):
+    import app.ingest
+    from app import app as flask_app
+    from app.datastore import _sessionStoreDir
+
+    def failWrite(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    for target in ['_encodeChunkColumn', 'writeDatasetColumn']: #failure while spooling chunks and while writing columns
+        with monkeypatch.context() as patch, open(demo_df_filepath, 'rb') as fp, flask_app.app_context():
+            patch.setattr(app.ingest, target, failWrite)
+            with pytest.raises(OSError):
+                app.ingest.ingestCSV(FileStorage(fp, filename='ecoli_sample_data.csv'), 'TESTSESSION18', chunksize=64)
+            assert [f for f in os.listdir(_sessionStoreDir('TESTSESSION18')) if f.endswith('.tmp')] == []